@@ -0,0 +1,129 @@
+"""
+Compares p50/p99 latency of a sync (threadpool) and an async ingestion route under 50/200/500 in-flight requests.
+
+The stand-in database gives every pooled connection its own in-memory SQLite database and adds a fixed
+round trip latency to every statement: a blocking sleep on the sync engine, like pyodbc waiting on the
+network, and an awaited sleep on the async engine, like aioodbc. Both routes run the same column
+validation and batched insert as the services, without the Okta and blob storage calls.
+
+Usage: python -m benchmarks.async_ingestion_benchmark [round_trip_ms] [rows_per_request]
+Requires aiosqlite.
+"""
+import asyncio
+import itertools
+import statistics
+import sys
+import time
+from typing import List
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, event, Column, Integer, String
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from sqlalchemy.util import await_only
+
+from models.request.jobs_request_model import JobRequestModel, ListJobRequestModel
+from models.response.base_response_model import BaseResponseModel
+from service.batch_writer import insert_batch, insert_batch_async
+from service.validation import JOB_RULES, to_columns, validate_batch
+
+
+POOL_SIZE = 100
+
+Base = declarative_base()
+
+class Jobs(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    job = Column(String, nullable=False)
+
+
+def prepare_connection(dbapi_connection, connection_record):
+    # pysqlite and aiosqlite need to leave transaction control to SQLAlchemy so SAVEPOINT works.
+    dbapi_connection.isolation_level = None
+    cursor = dbapi_connection.cursor()
+    cursor.execute("CREATE TABLE jobs (id INTEGER PRIMARY KEY, job VARCHAR NOT NULL)")
+    cursor.close()
+
+
+def create_engines(round_trip):
+    sync_engine = create_engine("sqlite://", poolclass=QueuePool, pool_size=POOL_SIZE, max_overflow=0, connect_args={"check_same_thread": False})
+    async_engine = create_async_engine("sqlite+aiosqlite://", poolclass=AsyncAdaptedQueuePool, pool_size=POOL_SIZE, max_overflow=0)
+
+    for engine in (sync_engine, async_engine.sync_engine):
+        event.listen(engine, "connect", prepare_connection)
+        event.listen(engine, "begin", lambda conn: conn.exec_driver_sql("BEGIN"))
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def sync_round_trip(conn, cursor, statement, parameters, context, executemany):
+        time.sleep(round_trip)
+
+    @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+    def async_round_trip(conn, cursor, statement, parameters, context, executemany):
+        await_only(asyncio.sleep(round_trip))
+
+    return sync_engine, async_engine
+
+
+def create_app(sync_engine, async_engine):
+    app = FastAPI()
+    SyncSession = sessionmaker(bind=sync_engine)
+    AsyncSession = async_sessionmaker(bind=async_engine)
+
+    def valid_rows(jobs: List[JobRequestModel]):
+        errors = validate_batch(to_columns(jobs, JOB_RULES), JOB_RULES)
+        return [{"id": job.id, "job": job.job} for job, error in zip(jobs, errors) if not error]
+
+    @app.post("/sync", response_model=BaseResponseModel)
+    def add_jobs_sync(listJobsRequestModel: ListJobRequestModel) -> BaseResponseModel:
+        with SyncSession() as session:
+            insert_batch(session, Jobs.__table__, valid_rows(listJobsRequestModel.jobs))
+            session.commit()
+        return BaseResponseModel(Error=False, ErrorMessage="Los registros se insertaron correctamente")
+
+    @app.post("/async", response_model=BaseResponseModel)
+    async def add_jobs_async(listJobsRequestModel: ListJobRequestModel) -> BaseResponseModel:
+        async with AsyncSession() as session:
+            await insert_batch_async(session, Jobs.__table__, valid_rows(listJobsRequestModel.jobs))
+            await session.commit()
+        return BaseResponseModel(Error=False, ErrorMessage="Los registros se insertaron correctamente")
+
+    return app
+
+
+async def measure(client, path, in_flight, rows_per_request, ids):
+    async def one_request():
+        body = {"jobs": [{"id": str(next(ids)), "job": "Data Engineer"} for _ in range(rows_per_request)]}
+        started = time.perf_counter()
+        response = await client.post(path, json=body)
+        response.raise_for_status()
+        return time.perf_counter() - started
+
+    # Warm the pool before measuring.
+    await asyncio.gather(*[one_request() for _ in range(in_flight)])
+    latencies = []
+    started = time.perf_counter()
+    for _ in range(3):
+        latencies += await asyncio.gather(*[one_request() for _ in range(in_flight)])
+    elapsed = time.perf_counter() - started
+    percentiles = statistics.quantiles(latencies, n=100)
+    print(f"{path:<7} in-flight {in_flight:>4}  p50 {percentiles[49] * 1000:8.1f} ms  p99 {percentiles[98] * 1000:8.1f} ms  {len(latencies) / elapsed:8.0f} req/s")
+
+
+async def main(round_trip, rows_per_request):
+    sync_engine, async_engine = create_engines(round_trip)
+    ids = itertools.count()
+    transport = httpx.ASGITransport(app=create_app(sync_engine, async_engine))
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for in_flight in (50, 200, 500):
+            for path in ("/sync", "/async"):
+                await measure(client, path, in_flight, rows_per_request, ids)
+    await async_engine.dispose()
+    sync_engine.dispose()
+
+
+if __name__ == "__main__":
+    round_trip_ms = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    rows_per_request = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(main(round_trip_ms / 1000, rows_per_request))
@@ -0,0 +1,131 @@
+"""
+Compares the file size and the backup and restore throughput of every Avro block codec.
+
+Backs up a hired_employees table from a local SQLite file to blobs held in memory and restores it into a
+second SQLite file through the bulk staging path, so it does not need the SQL Server or the blob storage.
+The codecs whose library is not installed fall back to deflate and are skipped.
+
+Usage: python -m benchmarks.backup_format_benchmark [rows] [sync_interval]
+"""
+import datetime
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from sqlalchemy import create_engine, text
+
+from service.backup_service import AVRO_CODECS, BackupService, codec_available
+from service.engine_registry import get_engine
+from service.restore_service import RestoreService
+
+
+CREATE_TABLE = "CREATE TABLE hired_employees (id INTEGER PRIMARY KEY, name VARCHAR(250), datetime DATETIME, department_id INTEGER, job_id INTEGER)"
+
+
+class InMemoryContainer:
+    """
+    Stores the blobs written by the backup and serves the ranged reads of the restore.
+    """
+    def __init__(self):
+        self.blobs = {}
+
+    def get_blob_client(self, blob_name):
+        return InMemoryBlob(self.blobs, blob_name)
+
+
+class InMemoryBlob:
+    def __init__(self, blobs, blob_name):
+        self.blobs = blobs
+        self.blob_name = blob_name
+        self.blocks = {}
+
+    def stage_block(self, block_id, data, length=None):
+        self.blocks[block_id] = data
+
+    def commit_block_list(self, block_list):
+        self.blobs[self.blob_name] = b"".join(self.blocks[block.id] for block in block_list)
+
+    def upload_blob(self, data, overwrite=False, etag=None, match_condition=None):
+        from azure.core.exceptions import ResourceExistsError, ResourceModifiedError
+        if not overwrite and self.blob_name in self.blobs:
+            raise ResourceExistsError(self.blob_name)
+        if etag is not None and (self.blob_name not in self.blobs or blob_etag(self.blobs[self.blob_name]) != etag):
+            raise ResourceModifiedError(self.blob_name)
+        self.blobs[self.blob_name] = data.encode() if isinstance(data, str) else data
+
+    def delete_blob(self):
+        from azure.core.exceptions import ResourceNotFoundError
+        if self.blobs.pop(self.blob_name, None) is None:
+            raise ResourceNotFoundError(self.blob_name)
+
+    def get_blob_properties(self):
+        self.size = len(self.blobs[self.blob_name])
+        return self
+
+    def download_blob(self, offset=None, length=None):
+        from azure.core.exceptions import ResourceNotFoundError
+        if self.blob_name not in self.blobs:
+            raise ResourceNotFoundError(self.blob_name)
+        data = self.blobs[self.blob_name]
+        return InMemoryDownload(data if offset is None else data[offset:offset + length], blob_etag(data))
+
+
+class InMemoryDownload:
+    def __init__(self, data, etag):
+        self.data = data
+        self.properties = SimpleNamespace(etag=etag)
+
+    def readall(self):
+        return self.data
+
+
+def blob_etag(data):
+    return hashlib.md5(data).hexdigest()
+
+
+def create_database(path, rows):
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as conn:
+        conn.execute(text(CREATE_TABLE))
+        if rows:
+            hired = datetime.datetime(2021, 1, 1)
+            conn.execute(
+                text("INSERT INTO hired_employees VALUES (:id, :name, :datetime, :department_id, :job_id)"),
+                [{"id": i, "name": f"Employee {i}", "datetime": hired + datetime.timedelta(minutes=i), "department_id": i % 12, "job_id": i % 180} for i in range(rows)],
+            )
+    engine.dispose()
+    return f"sqlite:///{path}"
+
+
+def run(codec, rows, sync_interval, source, directory):
+    container = InMemoryContainer()
+    backup = BackupService(source, None, None, codec=codec, sync_interval=sync_interval)
+    backup.get_blob_client = container.get_blob_client
+    started = time.perf_counter()
+    response = backup.backup_table_to_blob("hired_employees")
+    backup_seconds = time.perf_counter() - started
+    assert not response.Error, response.ErrorMessage
+
+    target = create_database(os.path.join(directory, f"restore_{codec}.db"), 0)
+    restore = RestoreService(target, None, None)
+    restore.get_blob_client = container.get_blob_client
+    started = time.perf_counter()
+    response = restore.restore_table_from_blob("hired_employees")
+    restore_seconds = time.perf_counter() - started
+    assert not response.Error, response.ErrorMessage
+    get_engine(target).dispose()
+
+    size = sum(len(data) for name, data in container.blobs.items() if name.endswith(".avro"))
+    print(f"{codec:<10} {size / 2**20:8.2f} MiB  backup {rows / backup_seconds:10.0f} rows/sec  restore {rows / restore_seconds:10.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    sync_interval = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    with tempfile.TemporaryDirectory() as directory:
+        source = create_database(os.path.join(directory, "source.db"), rows)
+        for codec in AVRO_CODECS:
+            if codec_available(codec):
+                run(codec, rows, sync_interval, source, directory)
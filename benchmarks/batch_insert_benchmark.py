@@ -0,0 +1,90 @@
+"""
+Compares the rows/sec of the per-row insert loop against the batched write path.
+
+Runs against a local SQLite file so it does not need the SQL Server or the Key Vault.
+Usage: python -m benchmarks.batch_insert_benchmark [rows] [rejected_every]
+"""
+import os
+import sys
+import tempfile
+import time
+from sqlalchemy import create_engine, event, Column, Integer, String
+from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy.exc import IntegrityError
+
+from service.batch_writer import insert_batch
+
+
+Base = declarative_base()
+
+class Jobs(Base):
+    __tablename__ = 'jobs'
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    job = Column(String, nullable=False)
+
+
+def create_sqlite_engine(path):
+    engine = create_engine(f"sqlite:///{path}")
+
+    # pysqlite needs to leave transaction control to SQLAlchemy so SAVEPOINT works.
+    @event.listens_for(engine, "connect")
+    def do_connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+
+    @event.listens_for(engine, "begin")
+    def do_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def build_rows(count, rejected_every):
+    rows = []
+    for i in range(count):
+        row_id = i if rejected_every and i % rejected_every == 0 else i + count
+        rows.append({"id": row_id, "job": f"job {i}"})
+    return rows
+
+
+def per_row_loop(engine, rows):
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    for row in rows:
+        try:
+            session.add(Jobs(**row))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+    session.close()
+
+
+def batched(engine, rows):
+    Session = sessionmaker(bind=engine)
+    session = Session()
+    insert_batch(session, Jobs.__table__, rows)
+    session.commit()
+    session.close()
+
+
+def run(name, function, rows, rejected_every):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_sqlite_engine(os.path.join(directory, "bench.db"))
+        Session = sessionmaker(bind=engine)
+        with Session() as session:
+            # Existing ids so every rejected_every-th row hits the PK constraint.
+            session.add_all([Jobs(id=i, job="existing") for i in range(0, len(rows), rejected_every or len(rows) + 1)])
+            session.commit()
+        started = time.perf_counter()
+        function(engine, rows)
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+    print(f"{name:<14} {len(rows):>7} rows  {elapsed:8.3f} s  {len(rows) / elapsed:12.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rejected_every = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    rows = build_rows(count, rejected_every)
+    run("per-row loop", per_row_loop, rows, rejected_every)
+    run("batched", batched, rows, rejected_every)
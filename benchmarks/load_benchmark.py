@@ -0,0 +1,92 @@
+"""
+Compares the rows/sec of loading a hired employees CSV extract through the JSON add endpoint, in requests of
+1000 rows, the streaming endpoint and the file upload endpoint.
+
+Runs the application in process against a local SQLite file with the secrets read from the environment
+(SECRETS_SOURCE=env), the Okta token check is skipped. Every endpoint loads the file into an empty table.
+The JSON times include encoding the requests on the client side.
+
+Usage: python -m benchmarks.load_benchmark [rows]
+"""
+import datetime
+import json
+import os
+import sys
+import tempfile
+import time
+
+
+def write_extract(path, rows):
+    hired = datetime.datetime(2021, 1, 1)
+    with open(path, "w", newline="") as file:
+        for i in range(rows):
+            file.write(f"{i},Employee {i},{(hired + datetime.timedelta(minutes=i)).isoformat()}Z,{i % 12 + 1},{i % 180 + 1}\n")
+
+
+def read_extract(path):
+    with open(path) as file:
+        for line in file:
+            id, name, hired, department_id, job_id = line.rstrip("\n").split(",")
+            yield {"id": id, "name": name, "dateTime": hired, "departmentId": department_id, "jobId": job_id}
+
+
+def reset(engine, key_index):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DELETE FROM hired_employees")
+    key_index.invalidate()
+
+
+def run(name, rows, load):
+    started = time.perf_counter()
+    result = load()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<16} {rows:>8} rows  {elapsed:8.1f} s  {rows / elapsed:10.0f} rows/sec  {result}")
+
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    directory = tempfile.mkdtemp()
+    os.environ.update(SECRETS_SOURCE="env", DATABASEURI1=f"sqlite:///{os.path.join(directory, 'load.db')}", JOBS_DB_PATH=os.path.join(directory, "jobs.db"))
+
+    from fastapi.testclient import TestClient
+    import main
+    from service.engine_registry import get_engine
+    from service.key_index import key_index
+
+    engine = get_engine()
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE jobs (id INTEGER PRIMARY KEY, job VARCHAR(250))")
+        conn.exec_driver_sql("CREATE TABLE departments (id INTEGER PRIMARY KEY, department VARCHAR(250))")
+        conn.exec_driver_sql("CREATE TABLE hired_employees (id INTEGER PRIMARY KEY, name VARCHAR(250), datetime DATETIME, department_id INTEGER, job_id INTEGER)")
+        conn.exec_driver_sql("INSERT INTO jobs VALUES " + ",".join(f"({i}, 'Job {i}')" for i in range(1, 181)))
+        conn.exec_driver_sql("INSERT INTO departments VALUES " + ",".join(f"({i}, 'Department {i}')" for i in range(1, 13)))
+    extract = os.path.join(directory, "hired_employees.csv")
+    write_extract(extract, rows)
+
+    app = main.create_app()
+    app.dependency_overrides[main.validate_token] = lambda: {}
+    app.dependency_overrides[main.validate_token_async] = lambda: {}
+    with TestClient(app) as client:
+        def add():
+            batch = []
+            for employee in read_extract(extract):
+                batch.append(employee)
+                if len(batch) == 1000:
+                    client.post("/v1/employees/add", content=json.dumps({"hiredEmployees": batch}), headers={"content-type": "application/json"}).raise_for_status()
+                    batch = []
+            if batch:
+                client.post("/v1/employees/add", content=json.dumps({"hiredEmployees": batch}), headers={"content-type": "application/json"}).raise_for_status()
+            with engine.connect() as conn:
+                return conn.exec_driver_sql("SELECT COUNT(*) FROM hired_employees").scalar()
+
+        def stream():
+            with open(extract, "rb") as file:
+                return client.post("/v2/employees/stream", content=iter(lambda: file.read(1024 * 1024), b""), headers={"content-type": "text/csv"}).json()["rowsAccepted"]
+
+        def upload():
+            with open(extract, "rb") as file:
+                return client.post("/v1/employees/upload", files={"file": ("hired_employees.csv", file, "text/csv")}).json()["rowsAccepted"]
+
+        for name, load in (("json add", add), ("stream", stream), ("upload", upload)):
+            reset(engine, key_index)
+            run(name, rows, load)
@@ -0,0 +1,54 @@
+"""
+Compares the cost per 1000 rows of decoding and validating the body of an add hired employees request:
+the request models built by FastAPI for the v1 and v2 endpoints and the columns decoded by the v3 endpoint.
+
+The database is not touched, only the work done before the rows are written is timed. The v2 time is the
+body parsed with json.loads and validated into the request models, as FastAPI does, then converted to
+columns and validated in bulk. The v3 time is decode_body and the same bulk validation.
+
+Usage: python -m benchmarks.request_decoding_benchmark [requests]
+"""
+import json
+import sys
+import time
+
+
+def request_body(rows, rejected_every):
+    employees = []
+    for i in range(rows):
+        employee = {"id": str(i), "name": f"Employee {i}", "dateTime": "2021-11-07T02:48:42Z", "departmentId": str(i % 12 + 1), "jobId": str(i % 180 + 1)}
+        if rejected_every and i % rejected_every == 0:
+            employee["name"] = f"Employee {i}!"
+        employees.append(employee)
+    return json.dumps({"hiredEmployees": employees}).encode()
+
+
+def run(name, requests, decode):
+    started = time.perf_counter()
+    for _ in range(requests):
+        decode()
+    elapsed = time.perf_counter() - started
+    print(f"{name:<24} {elapsed / requests * 1000:8.2f} ms per 1000 rows")
+
+
+if __name__ == "__main__":
+    requests = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+
+    from models.request.hired_employees_request_model import ListHiredEmployeesRequestModel
+    from service.columnar_ingestion_service import decode_body
+    from service.validation import HIRED_EMPLOYEE_RULES, to_columns, validate_batch
+
+    def models(body):
+        employees = ListHiredEmployeesRequestModel.model_validate(json.loads(body)).hiredEmployees
+        return validate_batch(to_columns(employees, HIRED_EMPLOYEE_RULES), HIRED_EMPLOYEE_RULES)
+
+    def columns(body):
+        columns, decode_errors = decode_body("employees", body)
+        return validate_batch(columns, HIRED_EMPLOYEE_RULES)
+
+    for rejected_every in (0, 10):
+        body = request_body(1000, rejected_every)
+        assert models(body) == columns(body)
+        print(f"{1000 // rejected_every if rejected_every else 0} rejected rows")
+        run("v2 request models", requests, lambda: models(body))
+        run("v3 columns", requests, lambda: columns(body))
@@ -0,0 +1,99 @@
+"""
+Compares the rows/sec of the row-at-a-time restore against the bulk restore.
+
+Runs against a local SQLite file with the backup held in memory, so it does not need the SQL Server or the
+blob storage. SQLite has no stored procedures: the row restore runs an upsert with the same effect as
+upsMergeJobs for every record, and the bulk restore takes the staging table path. Half of the ids already
+exist so both the update and the insert branches of the merge run. round_trip_ms adds a fixed latency to
+every statement, like the network round trip to the SQL Server.
+
+Usage: python -m benchmarks.restore_benchmark [rows] [round_trip_ms]
+"""
+import io
+import os
+import sys
+import tempfile
+import time
+from fastavro import parse_schema, writer
+from sqlalchemy import create_engine, event, text
+
+from service import restore_service
+from service.restore_service import RestoreService
+
+
+JOBS_SCHEMA = parse_schema({
+    "type": "record",
+    "name": "jobs",
+    "fields": [
+        {"name": "id", "type": ["null", "int"], "default": None},
+        {"name": "job", "type": ["null", "string"], "default": None},
+    ],
+})
+
+
+class InMemoryBlob:
+    """
+    Serves the ranged reads of the restore from a bytes object.
+    """
+    def __init__(self, data):
+        self.data = data
+        self.size = len(data)
+
+    def get_blob_properties(self):
+        return self
+
+    def download_blob(self, offset, length):
+        return InMemoryDownload(self.data[offset:offset + length])
+
+
+class InMemoryDownload:
+    def __init__(self, data):
+        self.data = data
+
+    def readall(self):
+        return self.data
+
+
+def build_backup(count):
+    backup = io.BytesIO()
+    writer(backup, JOBS_SCHEMA, ({"id": i, "job": f"job {i}"} for i in range(count)))
+    return backup.getvalue()
+
+
+def run(name, bulk, backup, count, round_trip):
+    with tempfile.TemporaryDirectory() as directory:
+        db_connection_string = f"sqlite:///{os.path.join(directory, 'bench.db')}"
+        engine = create_engine(db_connection_string)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE TABLE jobs (id INTEGER PRIMARY KEY, job VARCHAR(250))"))
+            conn.execute(text("INSERT INTO jobs (id, job) VALUES (:id, 'existing')"), [{"id": i} for i in range(0, count, 2)])
+        engine.dispose()
+
+        restore_service_engine = restore_service.get_engine(db_connection_string)
+
+        @event.listens_for(restore_service_engine, "before_cursor_execute")
+        def add_round_trip(conn, cursor, statement, parameters, context, executemany):
+            time.sleep(round_trip)
+
+        restore = RestoreService(db_connection_string, None, None)
+        restore.get_blob_client = lambda blob_name: InMemoryBlob(backup)
+        started = time.perf_counter()
+        response = restore.restore_table_from_blob("jobs", bulk)
+        elapsed = time.perf_counter() - started
+        assert not response.Error, response.ErrorMessage
+        with restore_service_engine.connect() as conn:
+            assert conn.execute(text("SELECT COUNT(*) FROM jobs WHERE job LIKE 'job %'")).scalar() == count
+        restore_service_engine.dispose()
+    print(f"{name:<10} {count:>7} rows  {elapsed:8.3f} s  {count / elapsed:12.0f} rows/sec")
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    round_trip = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0
+    backup = build_backup(count)
+
+    # pyodbc sends every row of an executemany as its own statement, like the original per-row loop.
+    restore_service.RESTORE_BATCH_SIZE = 1
+    restore_service.MERGE_PROCEDURES["jobs"] = text("INSERT INTO jobs (id, job) VALUES (:id, :job) ON CONFLICT (id) DO UPDATE SET job = excluded.job")
+    run("row", False, backup, count, round_trip)
+    run("bulk", True, backup, count, round_trip)
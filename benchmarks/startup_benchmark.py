@@ -0,0 +1,41 @@
+"""
+Measures the cold start of the application: the time to import main in a fresh interpreter.
+
+Reads the secrets from a local file (SECRETS_SOURCE=file) so it runs without Azure. Against the Key Vault
+every secret read at import time adds a network round trip on top of these numbers.
+Usage: python -m benchmarks.startup_benchmark <secrets.json> [runs] [tree]
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+IMPORT_MAIN = """
+import time
+started = time.perf_counter()
+import main
+elapsed = time.perf_counter() - started
+from security.secrets_provider import get_secrets_provider
+print(elapsed, len(get_secrets_provider().secrets))
+"""
+
+
+if __name__ == "__main__":
+    secrets_file = sys.argv[1]
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    tree = sys.argv[3] if len(sys.argv) > 3 else os.getcwd()
+    environment = dict(os.environ, SECRETS_SOURCE="file", SECRETS_FILE=secrets_file, PYTHONPATH=tree)
+
+    imports = []
+    processes = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        output = subprocess.run([sys.executable, "-c", IMPORT_MAIN], cwd=tree, env=environment, capture_output=True, text=True, check=True).stdout
+        processes.append(time.perf_counter() - started)
+        import_seconds, secrets_read = output.split()
+        imports.append(float(import_seconds))
+    print(f"import main      median {statistics.median(imports) * 1000:8.1f} ms")
+    print(f"process startup  median {statistics.median(processes) * 1000:8.1f} ms")
+    print(f"secrets read at import: {secrets_read}")
@@ -0,0 +1,64 @@
+"""
+Compares the per-row regex validation of hired employees against the column validation engine.
+
+Usage: python -m benchmarks.validation_benchmark [rows] [repeat]
+"""
+import datetime
+import re
+import sys
+import timeit
+
+from models.request.hired_employees_request_model import HiredEmployeesRequestModel
+from service.validation import HIRED_EMPLOYEE_RULES, to_columns, validate_batch
+
+
+def per_row_validation(hiredEmployee):
+    # The per-row validation the services used before the column engine.
+    if hiredEmployee.id is None:
+        return True, "El campo id es requerido"
+    if hiredEmployee.name is None:
+        return True, "El campo name es requerido"
+    if hiredEmployee.dateTime is None:
+        return True,  "El campo dateTime es requerido"
+    if hiredEmployee.departmentId is None:
+        return True, "El campo departmentId es requerido"
+    if hiredEmployee.jobId is None:
+        return True, "El campo jobId es requerido"
+    if not re.match(r'^[a-zA-Z0-9 ]+$', hiredEmployee.name):
+        return True, "El campo name solo puede contener letras y numeros"
+    if not re.match(r'^[0-9 ]+$', hiredEmployee.id):
+        return True, "El campo id solo puede contener numeros"
+    if not re.match(r'^[0-9 ]+$', hiredEmployee.departmentId):
+        return True, "El campo departmentId solo puede contener numeros"
+    if not re.match(r'^[0-9 ]+$', hiredEmployee.jobId):
+        return True, "El campo jobId solo puede contener numeros"
+    return False, ""
+
+
+def build_employees(count, with_errors):
+    employees = []
+    for i in range(count):
+        employee = HiredEmployeesRequestModel(id=str(i), name=f"Employee {i}", dateTime=datetime.datetime(2021, 1, 1), departmentId=str(i % 12), jobId=str(i % 180))
+        if with_errors and i % 10 == 1:
+            employee.name = "Employee-" + str(i)
+        elif with_errors and i % 10 == 2:
+            employee.jobId = None
+        elif with_errors and i % 10 == 3:
+            employee.departmentId = "x" + str(i)
+        employees.append(employee)
+    return employees
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    for name, with_errors in [("all valid", False), ("30% invalid", True)]:
+        employees = build_employees(count, with_errors)
+
+        expected = [per_row_validation(employee)[1] for employee in employees]
+        assert validate_batch(to_columns(employees, HIRED_EMPLOYEE_RULES), HIRED_EMPLOYEE_RULES) == expected
+
+        per_row = min(timeit.repeat(lambda: [per_row_validation(employee) for employee in employees], number=repeat, repeat=3)) / repeat
+        columns = min(timeit.repeat(lambda: validate_batch(to_columns(employees, HIRED_EMPLOYEE_RULES), HIRED_EMPLOYEE_RULES), number=repeat, repeat=3)) / repeat
+        print(f"{name:<12} per-row validation  {count:>7} rows  {per_row * 1000:8.3f} ms")
+        print(f"{name:<12} column validation   {count:>7} rows  {columns * 1000:8.3f} ms  ({per_row / columns:.1f}x)")
@@ -1,30 +1,209 @@
+import atexit
+import datetime
+import os
+import socket
+import threading
+import time
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
+from security.secrets_provider import get_secrets_provider
+from service.metrics import stage
+
+# The buffered bytes that trigger a flush before LOG_FLUSH_SECONDS.
+LOG_FLUSH_BYTES = int(os.getenv("LOG_FLUSH_BYTES", str(1024 * 1024)))
+# Seconds a rejected row waits in the buffer at most.
+LOG_FLUSH_SECONDS = float(os.getenv("LOG_FLUSH_SECONDS", "2"))
+# The buffered bytes kept while the blob storage fails, the oldest rows are dropped beyond it.
+LOG_BUFFER_MAX_BYTES = int(os.getenv("LOG_BUFFER_MAX_BYTES", str(64 * 1024 * 1024)))
+# Longest wait in seconds between two flushes while the blob storage fails, the wait doubles from LOG_FLUSH_SECONDS.
+LOG_RETRY_MAX_SECONDS = float(os.getenv("LOG_RETRY_MAX_SECONDS", "60"))
+# The largest block accepted by append_block.
+APPEND_BLOCK_SIZE = 4 * 1024 * 1024
+# An append blob takes at most 50,000 blocks, every process appends to blobs of its own so the workers of all the
+# instances do not add up their flushes on the same blob.
+LOG_WRITER_ID = f"{socket.gethostname()}-{os.getpid()}"
 
 class AzureBlobLogger:
     """
     A class for logging data to Azure Blob Storage.
-    
+
+    log_rows only adds the rows to an in-memory buffer. A background thread appends the buffer to one append
+    blob per prefix, hour and process once it holds flush_bytes or flush_seconds have passed, every row as a
+    JSON line.
+    While the appends fail the thread waits from flush_seconds up to LOG_RETRY_MAX_SECONDS between retries.
+    close() writes what is left, it runs on shutdown and at the interpreter exit.
+
     Attributes:
         connection_string (str): The connection string for the Azure Blob Storage account.
         container_name (str): The name of the container in Azure Blob Storage.
         blob_service_client (BlobServiceClient): The BlobServiceClient instance for interacting with the Blob service.
         container_client (ContainerClient): The ContainerClient instance for interacting with the container.
+        dropped_rows (int): The rows lost because the buffer went over LOG_BUFFER_MAX_BYTES.
     """
-    
-    def __init__(self, connection_string, container_name):
+
+    def __init__(self, connection_string, container_name, flush_bytes=LOG_FLUSH_BYTES, flush_seconds=LOG_FLUSH_SECONDS):
         self.connection_string = connection_string
         self.container_name = container_name
         self.blob_service_client = BlobServiceClient.from_connection_string(connection_string)
         self.container_client = self.blob_service_client.get_container_client(container_name)
+        self.flush_bytes = flush_bytes
+        self.flush_seconds = flush_seconds
+        self.condition = threading.Condition()
+        # Blob name -> list of encoded lines, in the order they were logged.
+        self.buffer = {}
+        self.buffered_bytes = 0
+        self.dropped_rows = 0
+        self.closed = False
+        self.created_blobs = set()
+        self.flush_thread = threading.Thread(target=self.run, name="blob-logger", daemon=True)
+        self.flush_thread.start()
+        atexit.register(self.close)
 
 
-    def log_data(self, data, blob_name):
+    def log_rows(self, rows, blob_prefix):
         """
-        Uploads the provided data to Azure Blob Storage with the specified blob name.
-        
+        Adds the rows to the buffer of the current log blob of the prefix, without any network call.
+
         Args:
-            data: The data to be uploaded.
-            blob_name (str): The name of the blob.
+            rows (List): Pydantic models, every one is written as a JSON line.
+            blob_prefix (str): The prefix of the blob name, the hour of the log and LOG_WRITER_ID are appended to it.
         """
+        with stage("rejected_row_log"):
+            lines = [(row.model_dump_json() + "\n").encode() for row in rows]
+            blob_name = f"{blob_prefix}{datetime.datetime.now().strftime('%Y-%m-%dT%H')}.{LOG_WRITER_ID}.log"
+            with self.condition:
+                if self.closed:
+                    raise RuntimeError("El logger esta cerrado.")
+                self.buffer.setdefault(blob_name, []).extend(lines)
+                self.buffered_bytes += sum(len(line) for line in lines)
+                if self.buffered_bytes >= self.flush_bytes:
+                    self.condition.notify()
+
+
+    def run(self):
+        retry_seconds = 0
+        while True:
+            with self.condition:
+                # After a failed flush the requeued rows wait retry_seconds, even over flush_bytes.
+                deadline = time.monotonic() + (retry_seconds or self.flush_seconds)
+                while not self.closed and (retry_seconds or self.buffered_bytes < self.flush_bytes) and time.monotonic() < deadline:
+                    self.condition.wait(deadline - time.monotonic())
+                if self.closed:
+                    return
+            if self.flush():
+                retry_seconds = 0
+            else:
+                retry_seconds = min(retry_seconds * 2 or self.flush_seconds, LOG_RETRY_MAX_SECONDS)
+
+
+    def flush(self) -> bool:
+        """
+        Appends the buffered lines to their blobs. The lines of a failed append go back to the buffer and are
+        retried on the next flush.
+
+        Returns:
+            bool: False if an append failed.
+        """
+        with self.condition:
+            buffer, self.buffer = self.buffer, {}
+            self.buffered_bytes = 0
+        succeeded = True
+        for blob_name, lines in buffer.items():
+            blocks = list(self.line_blocks(lines))
+            appended = 0
+            try:
+                with stage("rejected_row_upload"):
+                    for block in blocks:
+                        self.append(blob_name, b"".join(block))
+                        appended += 1
+            except Exception:
+                # The blocks not appended yet, without the lines line_blocks dropped.
+                self.requeue(blob_name, [line for block in blocks[appended:] for line in block])
+                succeeded = False
+        return succeeded
+
+
+    def line_blocks(self, lines):
+        """
+        Groups the lines in blocks of up to APPEND_BLOCK_SIZE bytes. Every block ends at the end of a line, so
+        the blocks appended to the same blob by other workers never land inside a line. A line longer than
+        a block can not be appended whole, it is dropped.
+        """
+        block = []
+        block_bytes = 0
+        for line in lines:
+            if len(line) > APPEND_BLOCK_SIZE:
+                with self.condition:
+                    self.dropped_rows += 1
+                continue
+            if block_bytes + len(line) > APPEND_BLOCK_SIZE:
+                yield block
+                block = []
+                block_bytes = 0
+            block.append(line)
+            block_bytes += len(line)
+        if block:
+            yield block
+
+
+    def append(self, blob_name, data):
         blob_client = self.container_client.get_blob_client(blob_name)
-        blob_client.upload_blob(data, overwrite=True)
\ No newline at end of file
+        if blob_name not in self.created_blobs:
+            try:
+                # Only creates the blob when it does not exist, another instance may be appending to it.
+                blob_client.create_append_blob(match_condition=MatchConditions.IfMissing)
+            except ResourceExistsError:
+                pass
+            self.created_blobs.add(blob_name)
+        try:
+            blob_client.append_block(data)
+        except ResourceNotFoundError:
+            self.created_blobs.discard(blob_name)
+            raise
+
+
+    def requeue(self, blob_name, lines):
+        with self.condition:
+            self.buffer[blob_name] = lines + self.buffer.get(blob_name, [])
+            self.buffered_bytes += sum(len(line) for line in lines)
+            for name in list(self.buffer):
+                while self.buffered_bytes > LOG_BUFFER_MAX_BYTES and self.buffer[name]:
+                    self.buffered_bytes -= len(self.buffer[name].pop(0))
+                    self.dropped_rows += 1
+
+
+    def close(self):
+        """
+        Stops the flush thread and writes the buffered lines.
+        """
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify()
+        self.flush_thread.join()
+        self.flush()
+
+
+rejected_row_logger_lock = threading.Lock()
+rejected_row_logger = None
+
+def get_rejected_row_logger() -> AzureBlobLogger:
+    """
+    Returns the logger of the rejected rows, it is created on the first call.
+    """
+    global rejected_row_logger
+    if rejected_row_logger is None:
+        with rejected_row_logger_lock:
+            if rejected_row_logger is None:
+                rejected_row_logger = AzureBlobLogger(get_secrets_provider().get_secret("DataCodeDLConnectionString"), 'logger')
+    return rejected_row_logger
+
+
+def close_rejected_row_logger():
+    """
+    Writes the rejected rows still buffered, when the logger was created.
+    """
+    if rejected_row_logger is not None:
+        rejected_row_logger.close()
@@ -1,56 +1,85 @@
+import asyncio
+import datetime
+import time
+from typing import List
+from contextlib import asynccontextmanager
 #FastApi
-from fastapi import FastAPI, Body, Query, Path, status, Header, Form, File, UploadFile, Depends, HTTPException, Cookie
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, FastAPI, Body, Query, Path, status, Header, Form, File, UploadFile, Depends, HTTPException, Cookie, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, OAuth2AuthorizationCodeBearer
 
-from models.request.backup_request_model import BackupTableRequestModel
+from models.request.backup_request_model import BackupSetRequestModel, BackupTableRequestModel
 from models.request.departments_request_model import ListDepartmentRequestModel
 from models.request.hired_employees_request_model import HiredEmployeesRequestModel, ListHiredEmployeesRequestModel
 from models.request.jobs_request_model import ListJobRequestModel
 from models.response.base_response_model import BaseResponseModel
-from security.okta import OktaJWTValidator
-from service.backup_service import BackupService
+from models.response.ingest_response_model import IngestResponseModel
+from models.response.job_response_model import JobResponseModel
+from security.okta import get_validator
+from service.async_ingestion_service import insert_departments_async, insert_hired_employee_async, insert_jobs_async
+from service.backup_service import BACKUP_FORMATS, DEFAULT_BACKUP_SET, MAX_BACKUP_PARTS, BackupService, codec_available, codec_error
+from service.columnar_ingestion_service import decode_body, insert_columns_async
 from service.departments_service import insert_departments
+from service.engine_registry import dispose_engines, get_async_engine, get_engine, pool_stats, warm_up_async_pool, warm_up_pool
+from service.file_load_service import load_csv_file, shutdown_load_executor
 from service.hired_employees_service import insert_hired_employee
-from security.keyvault import KeyVaultSecrets
+from service.idempotency_store import run_idempotent, run_idempotent_async
+from security.secrets_provider import get_secrets_provider
+from logger.logger import close_rejected_row_logger, get_rejected_row_logger
+from service.job_runner import JobProgress, JobRunner
 from service.jobs_service import insert_jobs
+from service.key_index import key_index
+from service.metrics import MetricsMiddleware, metrics, stage
+from service.profiling import PROFILE_TOKEN, ProfilingMiddleware
 from service.restore_service import RestoreService
+from service.stream_ingestion_service import ingest_stream
 
 
-app = FastAPI()
+oauth2_scheme = OAuth2AuthorizationCodeBearer(authorizationUrl="", tokenUrl="")
 
-key_vault_name = "ServicesDbKeyVault"
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-key_vault_secrets = KeyVaultSecrets(vault_url=key_vault_uri)
+def validate_token(token: str = Depends(oauth2_scheme)):
+    with stage("auth"):
+        return get_validator().validate_token(token)
 
-OKTA_CLIENT_ID = key_vault_secrets.get_secret("OKTACLIENTID")
-OKTA_CLIENT_SECRET = key_vault_secrets.get_secret("OKTACLIENTSECRET")
-OkTA_ISSUER = key_vault_secrets.get_secret("OKTAISSUER")
+async def validate_token_async(token: str = Depends(oauth2_scheme)):
+    with stage("auth"):
+        return await get_validator().validate_token_async(token)
 
-validator = OktaJWTValidator(OkTA_ISSUER)
-oauth2_scheme = OAuth2AuthorizationCodeBearer(authorizationUrl="", tokenUrl="")
 
-def validate_token(token: str = Depends(oauth2_scheme)):
-    return validator.validate_token(token)
+router = APIRouter()
 
 
-@app.get("/")
-async def read_root(user: dict = Depends(validate_token)):
+def backup_request_error(backup_request_model) -> str:
+    """
+    Returns the error message of an invalid backup request, None when it is valid.
+    """
+    if not (1 <= getattr(backup_request_model, "parts", 1) <= MAX_BACKUP_PARTS):
+        return f"El numero de partes debe estar entre 1 y {MAX_BACKUP_PARTS}"
+    if backup_request_model.format not in [None] + BACKUP_FORMATS:
+        return "El formato debe ser avro o parquet"
+    if backup_request_model.codec is not None and not codec_available(backup_request_model.codec):
+        return codec_error(backup_request_model.codec)
+    return None
+
+@router.get("/")
+async def read_root(user: dict = Depends(validate_token_async)):
     return {"App": "Alive!"}
 
-@app.post(
+@router.post(
     path="/v1/employees/add",
     response_model=BaseResponseModel,
     status_code=status.HTTP_200_OK,
     tags=["Employees"],
     )
-def add_hired_employees(listHiredEmployeesRequestModel: ListHiredEmployeesRequestModel, user: dict = Depends(validate_token)) -> BaseResponseModel:
+def add_hired_employees(listHiredEmployeesRequestModel: ListHiredEmployeesRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token)) -> BaseResponseModel:
     """
     # Insert Employees
     - Add a list of employees
 
     ## Parameters:
         - ListHiredEmployees Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
 
     ## Returns:
         - Return Base Response Model
@@ -63,24 +92,25 @@ def add_hired_employees(listHiredEmployeesRequestModel: ListHiredEmployeesReques
         response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
         return response
     
-    response = insert_hired_employee(employees_list)
+    response = run_idempotent(idempotency_key, "employees", listHiredEmployeesRequestModel, insert_hired_employee, employees_list)
 
     return response
 
 
-@app.post(
+@router.post(
     path="/v1/jobs/add",
     response_model=BaseResponseModel,
     status_code=status.HTTP_200_OK,
     tags=["Jobs"],
     )
-def add_jobs(listJobsRequestModel: ListJobRequestModel, user: dict = Depends(validate_token)) -> BaseResponseModel:
+def add_jobs(listJobsRequestModel: ListJobRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token)) -> BaseResponseModel:
     """
     # Insert Jobs
     - Add a list of jobs
 
     ## Parameters:
         - ListJobRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
 
     ## Returns:
         - Return Base Response Model
@@ -93,25 +123,26 @@ def add_jobs(listJobsRequestModel: ListJobRequestModel, user: dict = Depends(val
         response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
         return response
     
-    response = insert_jobs(jobs_list)
+    response = run_idempotent(idempotency_key, "jobs", listJobsRequestModel, insert_jobs, jobs_list)
 
     return response
 
 
 
-@app.post(
+@router.post(
     path="/v1/departments/add",
     response_model=BaseResponseModel,
     status_code=status.HTTP_200_OK,
     tags=["Departments"],
     )
-def add_department(listDepartmentsRequestModel: ListDepartmentRequestModel, user: dict = Depends(validate_token)) -> BaseResponseModel:
+def add_department(listDepartmentsRequestModel: ListDepartmentRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token)) -> BaseResponseModel:
     """
     # Insert Departments
     - Add a list of departments
 
     ## Parameters:
         - ListDepartmentRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
 
     ## Returns:
         - Return Base Response Model
@@ -124,12 +155,321 @@ def add_department(listDepartmentsRequestModel: ListDepartmentRequestModel, user
         response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
         return response
     
-    response = insert_departments(departments_list)
+    response = run_idempotent(idempotency_key, "departments", listDepartmentsRequestModel, insert_departments, departments_list)
 
     return response
 
 
-@app.post(
+@router.post(
+    path="/v2/employees/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Employees"],
+    )
+async def add_hired_employees_async(listHiredEmployeesRequestModel: ListHiredEmployeesRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Employees (async)
+    - Add a list of employees without blocking a worker thread on the database or the blob storage
+
+    ## Parameters:
+        - ListHiredEmployees Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    response = BaseResponseModel()
+    employees_list = listHiredEmployeesRequestModel.hiredEmployees
+    if not (1 <= len(employees_list) <= 1000):
+        response.Error = True
+        response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
+        return response
+
+    response = await run_idempotent_async(idempotency_key, "employees", listHiredEmployeesRequestModel, insert_hired_employee_async, employees_list)
+
+    return response
+
+
+@router.post(
+    path="/v2/jobs/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Jobs"],
+    )
+async def add_jobs_async(listJobsRequestModel: ListJobRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Jobs (async)
+    - Add a list of jobs without blocking a worker thread on the database or the blob storage
+
+    ## Parameters:
+        - ListJobRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    response = BaseResponseModel()
+    jobs_list = listJobsRequestModel.jobs
+    if not (1 <= len(jobs_list) <= 1000):
+        response.Error = True
+        response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
+        return response
+
+    response = await run_idempotent_async(idempotency_key, "jobs", listJobsRequestModel, insert_jobs_async, jobs_list)
+
+    return response
+
+
+@router.post(
+    path="/v2/departments/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Departments"],
+    )
+async def add_department_async(listDepartmentsRequestModel: ListDepartmentRequestModel, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Departments (async)
+    - Add a list of departments without blocking a worker thread on the database or the blob storage
+
+    ## Parameters:
+        - ListDepartmentRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    response = BaseResponseModel()
+    departments_list = listDepartmentsRequestModel.departments
+    if not (1 <= len(departments_list) <= 1000):
+        response.Error = True
+        response.ErrorMessage = "El numero de registros debe estar entre 1 y 1000"
+        return response
+
+    response = await run_idempotent_async(idempotency_key, "departments", listDepartmentsRequestModel, insert_departments_async, departments_list)
+
+    return response
+
+
+def columnar_request_body(schema_name: str) -> dict:
+    """
+    Declares the body of a v3 add endpoint for the documentation, it is the same as the one of the v1 and v2 endpoints.
+    """
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": {"$ref": f"#/components/schemas/{schema_name}"}}},
+        },
+    }
+
+async def add_columnar(entity_name: str, request: Request, idempotency_key: str) -> BaseResponseModel:
+    body = await request.body()
+    try:
+        with stage("decode"):
+            columns, decode_errors = decode_body(entity_name, body)
+    except ValueError as e:
+        return BaseResponseModel(Error=True, ErrorMessage=str(e))
+    return await run_idempotent_async(idempotency_key, entity_name, body, insert_columns_async, entity_name, columns, decode_errors)
+
+@router.post(
+    path="/v3/employees/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Employees"],
+    openapi_extra=columnar_request_body("ListHiredEmployeesRequestModel"),
+    )
+async def add_hired_employees_columnar(request: Request, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Employees (columnar)
+    - Add a list of employees like the v2 endpoint, the body is decoded straight into columns and validated in bulk, only the rejected rows are built as objects
+    - The values are coerced like in the v2 endpoint, but a value of the wrong type rejects only its row instead of the whole request with a 422
+
+    ## Parameters:
+        - ListHiredEmployees Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    return await add_columnar("employees", request, idempotency_key)
+
+@router.post(
+    path="/v3/jobs/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Jobs"],
+    openapi_extra=columnar_request_body("ListJobRequestModel"),
+    )
+async def add_jobs_columnar(request: Request, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Jobs (columnar)
+    - Add a list of jobs like the v2 endpoint, the body is decoded straight into columns and validated in bulk, only the rejected rows are built as objects
+    - The values are coerced like in the v2 endpoint, but a value of the wrong type rejects only its row instead of the whole request with a 422
+
+    ## Parameters:
+        - ListJobRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    return await add_columnar("jobs", request, idempotency_key)
+
+@router.post(
+    path="/v3/departments/add",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Departments"],
+    openapi_extra=columnar_request_body("ListDepartmentRequestModel"),
+    )
+async def add_departments_columnar(request: Request, idempotency_key: str = Header(default=None, alias="Idempotency-Key"), user: dict = Depends(validate_token_async)) -> BaseResponseModel:
+    """
+    # Insert Departments (columnar)
+    - Add a list of departments like the v2 endpoint, the body is decoded straight into columns and validated in bulk, only the rejected rows are built as objects
+    - The values are coerced like in the v2 endpoint, but a value of the wrong type rejects only its row instead of the whole request with a 422
+
+    ## Parameters:
+        - ListDepartmentRequestModel Request Model
+        - Idempotency-Key header (optional): the retries with the same key get the first response
+
+    ## Returns:
+        - Return Base Response Model
+
+    """
+    return await add_columnar("departments", request, idempotency_key)
+
+
+# The body of the stream endpoints is read by the service, it is only declared for the documentation.
+STREAM_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/x-ndjson": {"schema": {"type": "string"}},
+            "text/csv": {"schema": {"type": "string"}},
+        },
+    },
+}
+
+@router.post(
+    path="/v2/employees/stream",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Employees"],
+    openapi_extra=STREAM_REQUEST_BODY,
+    )
+async def stream_hired_employees(request: Request, user: dict = Depends(validate_token_async)) -> IngestResponseModel:
+    """
+    # Load Employees
+    - Add any number of employees from an NDJSON or CSV body (id, name, dateTime, departmentId, jobId), read and written in batches as it is uploaded
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return await ingest_stream("employees", request.headers.get("content-type", ""), request.stream())
+
+@router.post(
+    path="/v2/jobs/stream",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Jobs"],
+    openapi_extra=STREAM_REQUEST_BODY,
+    )
+async def stream_jobs(request: Request, user: dict = Depends(validate_token_async)) -> IngestResponseModel:
+    """
+    # Load Jobs
+    - Add any number of jobs from an NDJSON or CSV body (id, job), read and written in batches as it is uploaded
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return await ingest_stream("jobs", request.headers.get("content-type", ""), request.stream())
+
+@router.post(
+    path="/v2/departments/stream",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Departments"],
+    openapi_extra=STREAM_REQUEST_BODY,
+    )
+async def stream_departments(request: Request, user: dict = Depends(validate_token_async)) -> IngestResponseModel:
+    """
+    # Load Departments
+    - Add any number of departments from an NDJSON or CSV body (id, department), read and written in batches as it is uploaded
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return await ingest_stream("departments", request.headers.get("content-type", ""), request.stream())
+
+@router.post(
+    path="/v1/employees/upload",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Employees"],
+    )
+def upload_hired_employees(file: UploadFile = File(...), user: dict = Depends(validate_token)) -> IngestResponseModel:
+    """
+    # Upload Employees
+    - Add the employees of a CSV file (id, name, dateTime, departmentId, jobId), parsed in parallel and written in bulk
+
+    ## Parameters:
+        - CSV file
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return load_csv_file("employees", file.file)
+
+@router.post(
+    path="/v1/jobs/upload",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Jobs"],
+    )
+def upload_jobs(file: UploadFile = File(...), user: dict = Depends(validate_token)) -> IngestResponseModel:
+    """
+    # Upload Jobs
+    - Add the jobs of a CSV file (id, job), parsed in parallel and written in bulk
+
+    ## Parameters:
+        - CSV file
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return load_csv_file("jobs", file.file)
+
+@router.post(
+    path="/v1/departments/upload",
+    response_model=IngestResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Departments"],
+    )
+def upload_departments(file: UploadFile = File(...), user: dict = Depends(validate_token)) -> IngestResponseModel:
+    """
+    # Upload Departments
+    - Add the departments of a CSV file (id, department), parsed in parallel and written in bulk
+
+    ## Parameters:
+        - CSV file
+
+    ## Returns:
+        - Return Ingest Response Model
+
+    """
+    return load_csv_file("departments", file.file)
+
+
+@router.post(
     path="/v1/maintenance/backup",
     response_model=BaseResponseModel,
     status_code=status.HTTP_200_OK,
@@ -150,18 +490,57 @@ def backup_tables(backup_table_request_model: BackupTableRequestModel, user: dic
     response = BaseResponseModel()
     response.Error = False
     response.ErrorMessage = ""
+    error_message = backup_request_error(backup_table_request_model)
+    if error_message:
+        response.Error = True
+        response.ErrorMessage = error_message
+        return response
+
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
+    container_name = 'backups'
+
+    backup_service = BackupService(db_connection,dl_connection,container_name,codec=backup_table_request_model.codec,file_format=backup_table_request_model.format)
+    response = backup_service.backup_table_to_blob(backup_table_request_model.tableName, backup_table_request_model.incremental, backup_table_request_model.parts)
+
+    return response
+
+@router.post(
+    path="/v1/maintenance/backup-set",
+    response_model=BaseResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def backup_table_set(backup_set_request_model: BackupSetRequestModel, user: dict = Depends(validate_token)) -> BaseResponseModel:
+    """
+    # Backup Table Set
+    - Copy several tables concurrently from the same snapshot to files in a blob storage, with a manifest of the files
+
+    ## Parameters:
+        - Backup Set Request Model, jobs, departments and hired_employees when tableNames is not given
+
+    ## Returns:
+        - Return Base Response Model
 
+    """
+    response = BaseResponseModel()
+    error_message = backup_request_error(backup_set_request_model)
+    if error_message:
+        response.Error = True
+        response.ErrorMessage = error_message
+        return response
+    table_names = list(dict.fromkeys(backup_set_request_model.tableNames or DEFAULT_BACKUP_SET))
 
-    db_connection = key_vault_secrets.get_secret("DATABASEURI1")
-    dl_connection = key_vault_secrets.get_secret("DataCodeDLConnectionString")
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
     container_name = 'backups'
 
-    backup_service = BackupService(db_connection,dl_connection,container_name)
-    response = backup_service.backup_table_to_blob(backup_table_request_model.tableName)
+    backup_service = BackupService(db_connection,dl_connection,container_name,codec=backup_set_request_model.codec,file_format=backup_set_request_model.format)
+    response = backup_service.backup_tables_to_blob(table_names)
 
     return response
 
-@app.post(
+@router.post(
     path="/v1/maintenance/restore",
     response_model=BaseResponseModel,
     status_code=status.HTTP_200_OK,
@@ -182,12 +561,266 @@ def restore_tables(backup_table_request_model: BackupTableRequestModel, user: di
     response.Error = False
     response.ErrorMessage = ""
 
-    db_connection = key_vault_secrets.get_secret("DATABASEURI1")
-    dl_connection = key_vault_secrets.get_secret("DataCodeDLConnectionString")
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
     container_name = 'backups'
 
     restore_service = RestoreService(db_connection,dl_connection,container_name)
-    response = restore_service.restore_table_from_blob(backup_table_request_model.tableName)
+    response = restore_service.restore_table_from_blob(backup_table_request_model.tableName, backup_table_request_model.bulkRestore)
+
+    return response
+
+@router.get(
+    path="/v1/maintenance/pool",
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def get_pool_stats(user: dict = Depends(validate_token)):
+    """
+    # Pool Statistics
+    - Connections checked out, idle and in overflow, and the wait for a connection of every database pool
+
+    ## Returns:
+        - Return the list of pools
+
+    """
+    return {"pools": pool_stats()}
+
+
+def run_backup_job(params: dict, progress: JobProgress) -> BaseResponseModel:
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
+    backup_service = BackupService(db_connection,dl_connection,'backups',codec=params.get("codec"),file_format=params["format"],progress=progress)
+    return backup_service.backup_table_to_blob(params["tableName"], params["incremental"], params["parts"])
 
+def run_backup_set_job(params: dict, progress: JobProgress) -> BaseResponseModel:
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
+    backup_service = BackupService(db_connection,dl_connection,'backups',codec=params.get("codec"),file_format=params["format"],progress=progress)
+    return backup_service.backup_tables_to_blob(list(dict.fromkeys(params["tableNames"] or DEFAULT_BACKUP_SET)))
+
+def run_restore_job(params: dict, progress: JobProgress) -> BaseResponseModel:
+    db_connection = get_secrets_provider().get_secret("DATABASEURI1")
+    dl_connection = get_secrets_provider().get_secret("DataCodeDLConnectionString")
+    restore_service = RestoreService(db_connection,dl_connection,'backups',progress=progress)
+    return restore_service.restore_table_from_blob(params["tableName"], params["bulkRestore"])
+
+JOB_FUNCTIONS = {
+    "backup": run_backup_job,
+    "backup-set": run_backup_set_job,
+    "restore": run_restore_job,
+}
+
+
+def to_job_response(job: dict) -> JobResponseModel:
+    """
+    Builds the response of a job, with its rate and, while it runs, the estimated seconds to finish.
+    """
+    response = JobResponseModel(
+        Error=bool(job["error"]),
+        ErrorMessage=job["error_message"] or "",
+        jobId=job["id"],
+        kind=job["kind"],
+        status=job["status"],
+        rowsDone=job["rows_done"],
+        rowsTotal=job["rows_total"],
+        bytesDone=job["bytes_done"],
+        createdAt=job["created_at"],
+        startedAt=job["started_at"],
+        finishedAt=job["finished_at"],
+    )
+    if job["started_at"]:
+        finished_at = datetime.datetime.fromisoformat(job["finished_at"]) if job["finished_at"] else datetime.datetime.now(datetime.timezone.utc)
+        seconds = (finished_at - datetime.datetime.fromisoformat(job["started_at"])).total_seconds()
+        if seconds > 0:
+            response.rowsPerSecond = round(job["rows_done"] / seconds, 1)
+        if job["status"] == "running" and job["rows_total"] is not None and response.rowsPerSecond:
+            response.etaSeconds = round(max(job["rows_total"] - job["rows_done"], 0) / response.rowsPerSecond, 1)
     return response
 
+
+def submit_job(request: Request, kind: str, params: dict) -> JobResponseModel:
+    job_id = request.app.state.job_runner.submit(kind, params)
+    return to_job_response(request.app.state.job_runner.get(job_id))
+
+@router.post(
+    path="/v1/maintenance/jobs/backup",
+    response_model=JobResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def submit_backup_job(backup_table_request_model: BackupTableRequestModel, request: Request, user: dict = Depends(validate_token)) -> JobResponseModel:
+    """
+    # Backup Table Job
+    - Queue the backup of a table and return the job id at once
+
+    ## Parameters:
+        - Backup Table Request Model
+
+    ## Returns:
+        - Return Job Response Model
+
+    """
+    error_message = backup_request_error(backup_table_request_model)
+    if error_message:
+        return JobResponseModel(Error=True, ErrorMessage=error_message)
+    return submit_job(request, "backup", backup_table_request_model.model_dump())
+
+@router.post(
+    path="/v1/maintenance/jobs/backup-set",
+    response_model=JobResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def submit_backup_set_job(backup_set_request_model: BackupSetRequestModel, request: Request, user: dict = Depends(validate_token)) -> JobResponseModel:
+    """
+    # Backup Table Set Job
+    - Queue the backup of several tables from the same snapshot and return the job id at once
+
+    ## Parameters:
+        - Backup Set Request Model
+
+    ## Returns:
+        - Return Job Response Model
+
+    """
+    error_message = backup_request_error(backup_set_request_model)
+    if error_message:
+        return JobResponseModel(Error=True, ErrorMessage=error_message)
+    return submit_job(request, "backup-set", backup_set_request_model.model_dump())
+
+@router.post(
+    path="/v1/maintenance/jobs/restore",
+    response_model=JobResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def submit_restore_job(backup_table_request_model: BackupTableRequestModel, request: Request, user: dict = Depends(validate_token)) -> JobResponseModel:
+    """
+    # Restore Table Job
+    - Queue the restore of a table and return the job id at once
+
+    ## Parameters:
+        - Backup Table Request Model
+
+    ## Returns:
+        - Return Job Response Model
+
+    """
+    return submit_job(request, "restore", backup_table_request_model.model_dump())
+
+@router.get(
+    path="/v1/maintenance/jobs/{job_id}",
+    response_model=JobResponseModel,
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def get_job(job_id: str, request: Request, user: dict = Depends(validate_token)) -> JobResponseModel:
+    """
+    # Job Status
+    - Status and progress of a backup or restore job: rows done, bytes, rate and estimated seconds to finish
+
+    ## Returns:
+        - Return Job Response Model
+
+    """
+    job = request.app.state.job_runner.get(job_id)
+    if job is None:
+        return JobResponseModel(Error=True, ErrorMessage="El job no existe.")
+    return to_job_response(job)
+
+@router.get(
+    path="/v1/maintenance/jobs",
+    response_model=List[JobResponseModel],
+    status_code=status.HTTP_200_OK,
+    tags=["Maintenance"],
+    )
+def list_jobs(request: Request, user: dict = Depends(validate_token)) -> List[JobResponseModel]:
+    """
+    # Jobs
+    - The last backup and restore jobs, newest first
+
+    ## Returns:
+        - Return the list of Job Response Models
+
+    """
+    return [to_job_response(job) for job in request.app.state.job_runner.list()]
+
+
+async def warm_up(app: FastAPI):
+    """
+    Opens the database pools, downloads the Okta signing keys, loads the key index and starts the rejected
+    rows logger in the background.
+
+    The steps that fail are retried every 10 seconds, /health/ready reports ready once all of them succeeded.
+    """
+    started = time.perf_counter()
+    steps = {
+        "database": lambda: run_in_threadpool(lambda: warm_up_pool(get_engine())),
+        "async_database": lambda: warm_up_async_pool(get_async_engine()),
+        "jwks": lambda: run_in_threadpool(lambda: get_validator().refresh_signing_keys()),
+        "key_index": lambda: run_in_threadpool(lambda: key_index.refresh(get_engine())),
+        "rejected_row_logger": lambda: run_in_threadpool(get_rejected_row_logger),
+    }
+    while steps:
+        for name, step in list(steps.items()):
+            try:
+                await step()
+                del steps[name]
+                app.state.warm_up_errors.pop(name, None)
+            except Exception as e:
+                app.state.warm_up_errors[name] = str(e)
+        if steps:
+            await asyncio.sleep(10)
+    app.state.warm_up_seconds = time.perf_counter() - started
+    app.state.ready = True
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.ready = False
+    app.state.warm_up_errors = {}
+    app.state.warm_up_seconds = None
+    app.state.job_runner = JobRunner(JOB_FUNCTIONS)
+    app.state.job_runner.resume()
+    warm_up_task = asyncio.create_task(warm_up(app))
+    yield
+    warm_up_task.cancel()
+    await run_in_threadpool(app.state.job_runner.shutdown)
+    await run_in_threadpool(shutdown_load_executor)
+    await run_in_threadpool(close_rejected_row_logger)
+    await dispose_engines()
+
+
+def create_app() -> FastAPI:
+    """
+    Builds the application.
+
+    Nothing is loaded at import time: the secrets, engines and Okta keys are created on first use, and the
+    lifespan hook warms them up in the background so the first requests do not pay for it.
+    """
+    app = FastAPI(lifespan=lifespan)
+    app.include_router(router)
+    app.add_middleware(MetricsMiddleware)
+    if PROFILE_TOKEN:
+        app.add_middleware(ProfilingMiddleware)
+
+    @app.get("/health/ready", tags=["Health"])
+    async def ready():
+        body = {"ready": app.state.ready, "warmUpSeconds": app.state.warm_up_seconds, "errors": app.state.warm_up_errors}
+        return JSONResponse(body, status_code=status.HTTP_200_OK if app.state.ready else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    @app.get("/metrics", tags=["Health"], response_class=PlainTextResponse)
+    def get_metrics():
+        """
+        # Metrics
+        - Requests, latency of every stage (auth, validation, db_write, rejected_row_log, backup and restore),
+          rows accepted and rejected and database pools, in the Prometheus text format
+
+        """
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+    return app
+
+
+app = create_app()
@@ -1,3 +1,4 @@
+from typing import List
 from pydantic import BaseModel, Field
 
 
@@ -6,3 +7,17 @@ class BackupTableRequestModel(BaseModel):
     Represents a request model for backup tables.
     """
     tableName: str = Field(default=None)
+    bulkRestore: bool = Field(default=True)
+    incremental: bool = Field(default=False)
+    parts: int = Field(default=1)
+    format: str = Field(default=None)
+    codec: str = Field(default=None)
+
+
+class BackupSetRequestModel(BaseModel):
+    """
+    Represents a request model for a backup of several tables from the same snapshot.
+    """
+    tableNames: List[str] = Field(default=None)
+    format: str = Field(default=None)
+    codec: str = Field(default=None)
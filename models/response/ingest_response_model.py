@@ -0,0 +1,13 @@
+from pydantic import Field
+from models.response.base_response_model import BaseResponseModel
+
+
+class IngestResponseModel(BaseResponseModel):
+    """
+    Represents the summary of a streamed load: the rows read, written and rejected.
+    """
+    rowsRead: int = Field(default=None)
+    rowsAccepted: int = Field(default=None)
+    rowsRejected: int = Field(default=None)
+    batches: int = Field(default=None)
+    seconds: float = Field(default=None)
@@ -0,0 +1,20 @@
+from typing import Optional
+from pydantic import Field
+from models.response.base_response_model import BaseResponseModel
+
+
+class JobResponseModel(BaseResponseModel):
+    """
+    Represents the status and progress of a background backup or restore job.
+    """
+    jobId: str = Field(default=None)
+    kind: str = Field(default=None)
+    status: str = Field(default=None)
+    rowsDone: int = Field(default=None)
+    rowsTotal: Optional[int] = Field(default=None)
+    bytesDone: int = Field(default=None)
+    rowsPerSecond: Optional[float] = Field(default=None)
+    etaSeconds: Optional[float] = Field(default=None)
+    createdAt: str = Field(default=None)
+    startedAt: Optional[str] = Field(default=None)
+    finishedAt: Optional[str] = Field(default=None)
@@ -1,52 +1,254 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
 from fastapi import HTTPException, status
-from jose import jwt, JWTError
+from fastapi.concurrency import run_in_threadpool
+from jose import jwk, jwt, JWTError
+from jose.exceptions import JWKError
 import httpx
 from pydantic import BaseModel
+from security.secrets_provider import get_secrets_provider
+from service.metrics import stage
 
 
 OKTA_AUDIENCE ="api://default"
 
+class SigningKeysUnavailable(Exception):
+    """
+    The signing keys of the issuer could not be downloaded or read and none are cached.
+    """
+
+
 class TokenData(BaseModel):
     iss: str
     aud: str
 
+class VerifiedTokenCache:
+    """
+    A bounded LRU cache of the claims of tokens that were already verified.
+
+    The entries are keyed by the SHA-256 digest of the token, so the tokens themselves are not kept in
+    memory, and every entry expires at the exp claim of its token.
+
+    Args:
+        max_size (int): The maximum number of tokens kept in the cache.
+    """
+    def __init__(self, max_size: int = 1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, digest: bytes):
+        with self.lock:
+            entry = self.entries.get(digest)
+            if entry is not None and time.time() < entry[0]:
+                self.entries.move_to_end(digest)
+                self.hits += 1
+                return dict(entry[1])
+            if entry is not None:
+                del self.entries[digest]
+            self.misses += 1
+            return None
+
+    def put(self, digest: bytes, claims: dict):
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)):
+            return
+        with self.lock:
+            self.entries[digest] = (expires_at, dict(claims))
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
+
+
 class OktaJWTValidator:
-    def __init__(self, issuer: str):
+    """
+    Validates Okta access tokens against the signing keys published by the issuer.
+
+    The OIDC discovery document and the JWKS are cached in process for keys_ttl_seconds, with the keys
+    already built and indexed by kid. A token signed with an unknown kid forces one refresh, at most once
+    every min_refresh_seconds, and only one thread refreshes at a time while the others wait for it. The async
+    validation refreshes the keys in the thread pool under the same lock.
+
+    Args:
+        issuer (str): The Okta issuer url.
+        keys_ttl_seconds (int): The seconds the discovery document and the signing keys are cached.
+        min_refresh_seconds (int): The minimum seconds between two refreshes triggered by an unknown kid.
+        token_cache_size (int): The maximum number of verified tokens whose claims are cached, 0 disables the cache.
+    """
+    def __init__(self, issuer: str, keys_ttl_seconds: int = 3600, min_refresh_seconds: int = 30, token_cache_size: int = 1024):
         self.issuer = issuer
         self.jwks_uri = f"{issuer}/.well-known/openid-configuration"
+        self.keys_ttl_seconds = keys_ttl_seconds
+        self.min_refresh_seconds = min_refresh_seconds
+        self.client = httpx.Client(timeout=10)
+        self.oidc_config = None
+        self.signing_keys = {}
+        self.keys_loaded_at = None
+        self.refresh_lock = threading.Lock()
+        self.token_cache = VerifiedTokenCache(token_cache_size) if token_cache_size > 0 else None
 
     def get_signing_keys(self):
-        with httpx.Client() as client:
-            oidc_config = client.get(self.jwks_uri).json()
-            jwks_uri = oidc_config['jwks_uri']
-            return client.get(jwks_uri).json()
+        if self.oidc_config is None or self.keys_expired():
+            self.oidc_config = self.client.get(self.jwks_uri).json()
+        jwks_uri = self.oidc_config['jwks_uri']
+        return self.client.get(jwks_uri).json()
+
+    def keys_expired(self) -> bool:
+        return self.keys_loaded_at is None or time.monotonic() - self.keys_loaded_at >= self.keys_ttl_seconds
+
+    def refresh_signing_keys(self, kid_miss: bool = False):
+        """
+        Downloads the JWKS and rebuilds the keys indexed by kid.
+
+        Args:
+            kid_miss (bool): True when the refresh is triggered by an unknown kid, these are rate limited.
+
+        Raises:
+            SigningKeysUnavailable: If the keys could not be downloaded or read and none are cached.
+        """
+        loaded_at = self.keys_loaded_at
+        with self.refresh_lock:
+            if not self.refresh_needed(loaded_at, kid_miss):
+                return
+            try:
+                with stage("okta_key_fetch"):
+                    self.set_signing_keys(self.get_signing_keys())
+            except (httpx.HTTPError, ValueError, KeyError, TypeError, JWKError) as e:
+                if not self.signing_keys:
+                    raise SigningKeysUnavailable(f"No se pudieron obtener las llaves de firma del emisor: {e}") from e
+                self.retry_refresh_later()
+
+    async def refresh_signing_keys_async(self, kid_miss: bool = False):
+        """
+        Same as refresh_signing_keys, run in the thread pool so the event loop is not blocked and the sync and
+        async validations share the same lock.
+        """
+        await run_in_threadpool(self.refresh_signing_keys, kid_miss)
+
+    def refresh_needed(self, loaded_at, kid_miss: bool) -> bool:
+        if self.keys_loaded_at != loaded_at:
+            # Another caller refreshed the keys while this one was waiting.
+            return False
+        if kid_miss and loaded_at is not None and time.monotonic() - loaded_at < self.min_refresh_seconds:
+            return False
+        return True
+
+    def retry_refresh_later(self):
+        # Keep serving the cached keys while the issuer can not be reached and retry later.
+        self.keys_loaded_at = time.monotonic() - self.keys_ttl_seconds + self.min_refresh_seconds
+
+    def set_signing_keys(self, jwks: dict):
+        signing_keys = {}
+        for key in jwks["keys"]:
+            if key.get("kty") == "RSA":
+                rsa_key = {
+                    "kty": key["kty"],
+                    "kid": key["kid"],
+                    "use": key.get("use"),
+                    "n": key["n"],
+                    "e": key["e"]
+                }
+                signing_keys[key["kid"]] = jwk.construct(rsa_key, "RS256")
+        self.signing_keys = signing_keys
+        self.keys_loaded_at = time.monotonic()
+
+    def get_signing_key(self, kid: str):
+        if self.keys_expired():
+            self.refresh_signing_keys()
+        key = self.signing_keys.get(kid)
+        if key is None:
+            self.refresh_signing_keys(kid_miss=True)
+            key = self.signing_keys.get(kid)
+        return key
+
+    async def get_signing_key_async(self, kid: str):
+        if self.keys_expired():
+            await self.refresh_signing_keys_async()
+        key = self.signing_keys.get(kid)
+        if key is None:
+            await self.refresh_signing_keys_async(kid_miss=True)
+            key = self.signing_keys.get(kid)
+        return key
 
     def validate_token(self, token: str):
+        digest, claims = self.get_cached_claims(token)
+        if claims is not None:
+            return claims
+        try:
+            unverified_header = jwt.get_unverified_header(token)
+            rsa_key = self.get_signing_key(unverified_header.get("kid"))
+            return self.decode_token(token, rsa_key, digest)
+        except JWTError as e:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=str(e)
+            )
+        except SigningKeysUnavailable as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+
+    async def validate_token_async(self, token: str):
+        digest, claims = self.get_cached_claims(token)
+        if claims is not None:
+            return claims
         try:
             unverified_header = jwt.get_unverified_header(token)
-            jwks = self.get_signing_keys()
-            rsa_key = {}
-            for key in jwks["keys"]:
-                if key["kid"] == unverified_header["kid"]:
-                    rsa_key = {
-                        "kty": key["kty"],
-                        "kid": key["kid"],
-                        "use": key["use"],
-                        "n": key["n"],
-                        "e": key["e"]
-                    }
-            if rsa_key:
-                payload = jwt.decode(
-                    token, rsa_key, algorithms=["RS256"],
-                    audience=OKTA_AUDIENCE,
-                    issuer=self.issuer
-                )
-                return payload
-            else:
-                raise JWTError("Appropriate key not found.")
+            rsa_key = await self.get_signing_key_async(unverified_header.get("kid"))
+            return self.decode_token(token, rsa_key, digest)
         except JWTError as e:
             raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN,
                 detail=str(e)
             )
+        except SigningKeysUnavailable as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail=str(e)
+            )
+
+    def get_cached_claims(self, token: str):
+        if self.token_cache is None:
+            return None, None
+        digest = self.token_cache.digest(token)
+        return digest, self.token_cache.get(digest)
+
+    def decode_token(self, token: str, rsa_key, digest):
+        if rsa_key is None:
+            raise JWTError("Appropriate key not found.")
+        payload = jwt.decode(
+            token, rsa_key, algorithms=["RS256"],
+            audience=OKTA_AUDIENCE,
+            issuer=self.issuer
+        )
+        if self.token_cache is not None:
+            self.token_cache.put(digest, payload)
+        return payload
+
+
+validator_lock = threading.Lock()
+validator = None
 
+def get_validator() -> OktaJWTValidator:
+    """
+    Returns the validator of the OKTAISSUER issuer, it is created on the first call.
+    """
+    global validator
+    if validator is None:
+        with validator_lock:
+            if validator is None:
+                validator = OktaJWTValidator(get_secrets_provider().get_secret("OKTAISSUER"))
+    return validator
@@ -0,0 +1,133 @@
+import json
+import os
+import threading
+import time
+from dotenv import dotenv_values
+from security.keyvault import KeyVaultSecrets
+
+
+class EnvironmentSecrets:
+    """
+    Reads the secrets from environment variables, e.g. DATABASEURI1.
+    """
+    def __init__(self, prefix=""):
+        self.prefix = prefix
+
+    def get_secret(self, secret_name):
+        return os.environ[f"{self.prefix}{secret_name}"]
+
+
+class FileSecrets:
+    """
+    Reads the secrets from a local JSON file or a KEY=VALUE .env file.
+    """
+    def __init__(self, path):
+        self.path = path
+
+    def get_secret(self, secret_name):
+        if self.path.endswith(".json"):
+            with open(self.path) as secrets_file:
+                secrets = json.load(secrets_file)
+        else:
+            secrets = dotenv_values(self.path)
+        return secrets[secret_name]
+
+
+class SecretsProvider:
+    """
+    A process-wide secrets cache in front of the Key Vault, the environment or a local file.
+
+    Every secret is resolved once and cached for ttl_seconds. A daemon thread refreshes the cached secrets
+    before they expire, so requests do not wait on the source, and if the source can not be reached the
+    last known value keeps being served.
+
+    Args:
+        source: Any object with a get_secret(secret_name) method, e.g. KeyVaultSecrets.
+        ttl_seconds (int): The seconds a secret is cached.
+        refresh_seconds (int): The seconds between background refreshes, None disables the refresh thread.
+    """
+    def __init__(self, source, ttl_seconds=3600, refresh_seconds=None):
+        self.source = source
+        self.ttl_seconds = ttl_seconds
+        self.refresh_seconds = refresh_seconds
+        self.secrets = {}
+        self.lock = threading.Lock()
+        self.stop_refresh = threading.Event()
+        self.refresh_thread = None
+
+    def get_secret(self, secret_name):
+        cached = self.secrets.get(secret_name)
+        if cached is not None and time.monotonic() - cached[1] < self.ttl_seconds:
+            return cached[0]
+        try:
+            return self.load_secret(secret_name)
+        except Exception:
+            if cached is None:
+                raise
+            return cached[0]
+
+    def load_secret(self, secret_name):
+        value = self.source.get_secret(secret_name)
+        with self.lock:
+            self.secrets[secret_name] = (value, time.monotonic())
+        self.start_refresh()
+        return value
+
+    def refresh(self):
+        """
+        Reloads every cached secret, keeping the old value of the ones that fail.
+        """
+        for secret_name in list(self.secrets):
+            try:
+                self.load_secret(secret_name)
+            except Exception:
+                pass
+
+    def start_refresh(self):
+        if self.refresh_seconds is None or self.refresh_thread is not None:
+            return
+        with self.lock:
+            if self.refresh_thread is None:
+                self.refresh_thread = threading.Thread(target=self.refresh_loop, name="secrets-refresh", daemon=True)
+                self.refresh_thread.start()
+
+    def refresh_loop(self):
+        while not self.stop_refresh.wait(self.refresh_seconds):
+            self.refresh()
+
+    def close(self):
+        self.stop_refresh.set()
+
+
+def create_secrets_provider() -> SecretsProvider:
+    """
+    Builds the secrets provider from the environment.
+
+    SECRETS_SOURCE selects the source: "keyvault" (default), "env" or "file". The Key Vault name is read
+    from KEY_VAULT_NAME, the file from SECRETS_FILE and the cache ttl from SECRETS_TTL_SECONDS.
+    """
+    source_name = os.getenv("SECRETS_SOURCE", "keyvault").lower()
+    if source_name == "env":
+        source = EnvironmentSecrets(os.getenv("SECRETS_PREFIX", ""))
+    elif source_name == "file":
+        source = FileSecrets(os.getenv("SECRETS_FILE", "secrets.json"))
+    else:
+        key_vault_name = os.getenv("KEY_VAULT_NAME", "ServicesDbKeyVault")
+        source = KeyVaultSecrets(vault_url=f"https://{key_vault_name}.vault.azure.net/")
+    ttl_seconds = int(os.getenv("SECRETS_TTL_SECONDS", "3600"))
+    return SecretsProvider(source, ttl_seconds=ttl_seconds, refresh_seconds=ttl_seconds * 0.8)
+
+
+secrets_provider_lock = threading.Lock()
+secrets_provider = None
+
+def get_secrets_provider() -> SecretsProvider:
+    """
+    Returns the secrets provider shared by the whole process, it is created on the first call.
+    """
+    global secrets_provider
+    if secrets_provider is None:
+        with secrets_provider_lock:
+            if secrets_provider is None:
+                secrets_provider = create_secrets_provider()
+    return secrets_provider
@@ -0,0 +1,230 @@
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import Table
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from logger.logger import get_rejected_row_logger
+from models.request.departments_request_model import DepartmentRequestModel
+from models.request.hired_employees_request_model import HiredEmployeesRequestModel
+from models.request.jobs_request_model import JobRequestModel
+from models.response.base_response_model import BaseResponseModel
+from service.batch_writer import insert_batch_async
+from service.engine_registry import get_async_engine
+from service.idempotency_store import mark_write_failed
+from service.departments_service import Departments, add_department_to_log
+from service.hired_employees_service import HiredEmployees, add_employee_to_log, validate_key_fields, set_specific_error_message
+from service.jobs_service import Jobs, add_job_to_log
+from service.key_index import key_index
+from service.metrics import count_rows, stage
+from service.validation import DEPARTMENT_RULES, HIRED_EMPLOYEE_RULES, JOB_RULES, to_columns, validate_batch
+
+
+async def log_invalid_rows_async(log_list: List, blob_prefix: str) -> BaseResponseModel:
+    """
+    Logs the list of invalid rows to an Azure Blob Storage container.
+
+    Args:
+        log_list (List): A list of LogHiredEmployees, LogJobs or LogDepartments.
+        blob_prefix (str): The prefix of the blob name, the same one used by the sync services.
+
+    Returns:
+        BaseResponseModel: The response model indicating the success or failure of the logging operation.
+    """
+    response = BaseResponseModel()
+    response.Error = False
+    response.ErrorMessage = ""
+    try:
+        get_rejected_row_logger().log_rows(log_list, blob_prefix)
+        response.Error = True
+        response.ErrorMessage = "El proceso detecto registros invalidos, se genero un log con los registros."
+    except Exception as e:
+        response.Error = True
+        response.ErrorMessage = str(e)
+    return response
+
+
+async def insert_rows_async(items: List, errors: List[str], table: Table, to_row: Callable, add_to_log: Callable, add_to_index: Callable, blob_prefix: str) -> BaseResponseModel:
+    """
+    Writes the rows without validation error in one batch and logs the rejected ones, like the sync insert_* functions.
+
+    Takes the same arguments as write_rows_async.
+
+    Returns:
+        BaseResponseModel: A BaseResponseModel object indicating the success or failure of the operation.
+    """
+    response, accepted = await write_rows_async(items, errors, table, to_row, add_to_log, add_to_index, blob_prefix)
+    return response
+
+
+async def write_rows_async(items: List, errors: List[str], table: Table, to_row: Callable, add_to_log: Callable, add_to_index: Callable, blob_prefix: str) -> Tuple[BaseResponseModel, int]:
+    """
+    Writes the rows without validation error in one batch and logs the rejected ones.
+
+    Args:
+        items (List): The request models to be inserted.
+        errors (List[str]): The validation error of every item, an empty string if it is valid.
+        table (Table): The table where the rows will be inserted.
+        to_row (Callable): Converts a request model to a dict of column values.
+        add_to_log (Callable): The add_*_to_log function of the entity.
+        add_to_index (Callable): The key_index.add_* function that records the inserted ids.
+        blob_prefix (str): The prefix of the rejected rows log blob.
+
+    Returns:
+        Tuple[BaseResponseModel, int]: The response of the operation and the number of rows written.
+    """
+    response = BaseResponseModel()
+    accepted = 0
+    log_list = []
+    valid_items = []
+    enable_log = False
+    for item, error_validation_message in zip(items, errors):
+        if error_validation_message:
+            log_list = add_to_log(log_list, item, error_validation_message)
+            enable_log = True
+        else:
+            valid_items.append(item)
+
+    rows = [to_row(item) for item in valid_items]
+    if rows:
+        Session = async_sessionmaker(bind=get_async_engine(), expire_on_commit=False)
+        async with Session() as session:
+            try:
+                with stage("db_write"):
+                    rejected = await insert_batch_async(session, table, rows)
+                    await session.commit()
+                response.Error = False
+                response.ErrorMessage = "Los registros se insertaron correctamente"
+                for position, error_message in rejected:
+                    result = set_specific_error_message(error_message)
+                    log_list = add_to_log(log_list, valid_items[position], result.ErrorMessage)
+                    enable_log = True
+                    response.Error = result.Error
+                    response.ErrorMessage = result.ErrorMessage
+                rejected_positions = {position for position, error_message in rejected}
+                add_to_index(row["id"] for position, row in enumerate(rows) if position not in rejected_positions)
+                accepted = len(rows) - len(rejected_positions)
+            except Exception as e:
+                await session.rollback()
+                mark_write_failed()
+                enable_log = True
+                response.Error = True
+                response.ErrorMessage = str(e)
+
+    if enable_log:
+        log_response = await log_invalid_rows_async(log_list, blob_prefix)
+        response.Error = log_response.Error
+        response.ErrorMessage = log_response.ErrorMessage
+    count_rows(table.name, accepted, len(errors) - accepted)
+    return response, accepted
+
+
+def hired_employee_row(hiredEmployee: HiredEmployeesRequestModel) -> dict:
+    return {
+        "id": hiredEmployee.id,
+        "name": hiredEmployee.name,
+        "datetime": hiredEmployee.dateTime,
+        "department_id": hiredEmployee.departmentId,
+        "job_id": hiredEmployee.jobId
+    }
+
+
+def job_row(job: JobRequestModel) -> dict:
+    return {"id": job.id, "job": job.job}
+
+
+def department_row(department: DepartmentRequestModel) -> dict:
+    return {"id": department.id, "department": department.department}
+
+
+async def validate_keys_async(columns: Dict[str, list], errors: List[str]) -> List[str]:
+    """
+    Adds the key index errors to the rows that passed the field validation.
+
+    The catalogs are reloaded once, without blocking the event loop, when a row has an unknown key and they
+    were not loaded in the last catalog_refresh_seconds. When they can not be reloaded the unknown jobId and
+    departmentId are left to the foreign keys of the database.
+
+    Args:
+        columns (Dict[str, list]): The hired employees in column form, with the id, jobId and departmentId fields.
+        errors (List[str]): The validation error of every row.
+    """
+    def key_errors(check_catalogs=True):
+        keys = zip(columns["id"], columns["jobId"], columns["departmentId"])
+        return [error or validate_key_fields(*key, refresh_catalogs=False, check_catalogs=check_catalogs)[1] for key, error in zip(keys, errors)]
+
+    checked_errors = key_errors()
+    if checked_errors != errors:
+        refreshed = await key_index.refresh_catalogs_async(get_async_engine())
+        checked_errors = key_errors(check_catalogs=refreshed)
+    return checked_errors
+
+
+async def insert_hired_employee_async(listLogHiredEmployees: List[HiredEmployeesRequestModel]) -> BaseResponseModel:
+    """
+    Inserts a list of hired employees into the database without blocking the event loop.
+
+    Args:
+        listLogHiredEmployees (List[HiredEmployeesRequestModel]): A list of HiredEmployeesRequestModel objects representing the hired employees to be inserted.
+
+    Returns:
+        BaseResponseModel: A BaseResponseModel object indicating the success or failure of the operation.
+    """
+    with stage("validation"):
+        columns = to_columns(listLogHiredEmployees, HIRED_EMPLOYEE_RULES)
+        errors = validate_batch(columns, HIRED_EMPLOYEE_RULES)
+        if await key_index.ensure_loaded_async(get_async_engine()):
+            errors = await validate_keys_async(columns, errors)
+
+    return await insert_rows_async(
+        listLogHiredEmployees,
+        errors,
+        HiredEmployees.__table__,
+        hired_employee_row,
+        add_employee_to_log,
+        key_index.add_employees,
+        'log_hired_employees_',
+    )
+
+
+async def insert_jobs_async(listLogJobs: List[JobRequestModel]) -> BaseResponseModel:
+    """
+    Inserts a list of jobs into the database without blocking the event loop.
+
+    Args:
+        listLogJobs (List[JobRequestModel]): A list of JobRequestModel objects representing the jobs to be inserted.
+
+    Returns:
+        BaseResponseModel: A BaseResponseModel object indicating the success or failure of the operation.
+    """
+    with stage("validation"):
+        errors = validate_batch(to_columns(listLogJobs, JOB_RULES), JOB_RULES)
+    return await insert_rows_async(
+        listLogJobs,
+        errors,
+        Jobs.__table__,
+        job_row,
+        add_job_to_log,
+        key_index.add_jobs,
+        'jobs_',
+    )
+
+
+async def insert_departments_async(listLogDepartments: List[DepartmentRequestModel]) -> BaseResponseModel:
+    """
+    Inserts a list of departments into the database without blocking the event loop.
+
+    Args:
+        listLogDepartments (List[DepartmentRequestModel]): A list of DepartmentRequestModel objects representing the departments to be inserted.
+
+    Returns:
+        BaseResponseModel: A BaseResponseModel object indicating the success or failure of the operation.
+    """
+    with stage("validation"):
+        errors = validate_batch(to_columns(listLogDepartments, DEPARTMENT_RULES), DEPARTMENT_RULES)
+    return await insert_rows_async(
+        listLogDepartments,
+        errors,
+        Departments.__table__,
+        department_row,
+        add_department_to_log,
+        key_index.add_departments,
+        'departments_',
+    )
@@ -0,0 +1,98 @@
+import datetime
+import decimal
+import json
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceModifiedError, ResourceNotFoundError
+
+
+# The watermarks that JSON has no type for are stored as an object with one of these keys, so they are read
+# back with their type and compare with the column: datetimes, dates, decimals and binary rowversions.
+TYPED_VALUES = {
+    "$datetime": (datetime.datetime, datetime.datetime.isoformat, datetime.datetime.fromisoformat),
+    "$date": (datetime.date, datetime.date.isoformat, datetime.date.fromisoformat),
+    "$decimal": (decimal.Decimal, str, decimal.Decimal),
+    "$bytes": (bytes, bytes.hex, bytes.fromhex),
+}
+
+
+def chain_manifest_name(table_name):
+    """
+    Returns the name of the blob that records the base backup and the incremental deltas of the table.
+    """
+    return f'{table_name}.manifest.json'
+
+
+class ManifestConflict(Exception):
+    """
+    The manifest was written by another backup after it was read.
+    """
+
+
+def read_manifest(blob_client):
+    """
+    Returns the manifest stored in the blob, None when the blob does not exist.
+    """
+    return read_manifest_version(blob_client)[0]
+
+
+def read_manifest_version(blob_client):
+    """
+    Returns the manifest stored in the blob and the etag of the blob, None and None when it does not exist.
+    """
+    try:
+        download = blob_client.download_blob()
+    except ResourceNotFoundError:
+        return None, None
+    return json.loads(download.readall(), object_hook=decode_value), download.properties.etag
+
+
+def write_manifest(blob_client, manifest):
+    blob_client.upload_blob(json.dumps(manifest, indent=2, default=encode_value), overwrite=True)
+
+
+def replace_manifest(blob_client, manifest, etag):
+    """
+    Writes the manifest only if the blob still has the etag it was read with, or still does not exist when
+    the etag is None.
+
+    Raises:
+        ManifestConflict: If another backup wrote the manifest in the meantime.
+    """
+    data = json.dumps(manifest, indent=2, default=encode_value)
+    try:
+        if etag is None:
+            blob_client.upload_blob(data, overwrite=False)
+        else:
+            blob_client.upload_blob(data, overwrite=True, etag=etag, match_condition=MatchConditions.IfNotModified)
+    except (ResourceExistsError, ResourceModifiedError) as e:
+        raise ManifestConflict("Otra copia de seguridad de la tabla se ejecuto al mismo tiempo, intente de nuevo.") from e
+
+
+def entry_files(entry):
+    """
+    Returns the files of a backup entry, its parts or its only file.
+    """
+    return [part["file"] for part in entry["parts"]] if "parts" in entry else [entry["file"]]
+
+
+def chain_files(chain):
+    """
+    Returns the files of the base backup and of every delta of the chain.
+    """
+    return entry_files(chain["base"]) + [delta["file"] for delta in chain["deltas"]]
+
+
+def encode_value(value):
+    # A datetime is also a date, the types are checked in the order of TYPED_VALUES.
+    for key, (value_type, encode, decode) in TYPED_VALUES.items():
+        if isinstance(value, value_type):
+            return {key: encode(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def decode_value(obj):
+    if len(obj) == 1:
+        key, value = next(iter(obj.items()))
+        if key in TYPED_VALUES:
+            return TYPED_VALUES[key][2](value)
+    return obj
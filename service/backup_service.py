@@ -1,9 +1,57 @@
 import datetime
-from sqlalchemy import create_engine, MetaData, Table
-import pandas as pd
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from functools import lru_cache
+from sqlalchemy import BigInteger, MetaData, Table, func, select
+from sqlalchemy.engine import make_url
+from azure.core.exceptions import ResourceNotFoundError
 from azure.storage.blob import BlobServiceClient
 from fastavro import writer,  parse_schema
 from models.response.base_response_model import BaseResponseModel
+from service.backup_manifest import ManifestConflict, chain_files, chain_manifest_name, entry_files, read_manifest_version, replace_manifest, write_manifest
+from service.blob_streams import BlockBlobWriter
+from service.engine_registry import get_engine
+from service.metrics import in_current_context, record_stage
+from service.profiling import profiled
+
+
+# Rows fetched from the database cursor at a time.
+BACKUP_CHUNK_SIZE = 10000
+# The default file format of the backups, avro or parquet.
+BACKUP_FORMAT = os.getenv("BACKUP_FORMAT", "avro")
+BACKUP_FORMATS = ["avro", "parquet"]
+# The Avro block codec: null, deflate, bzip2, xz, or snappy, zstandard and lz4 when their libraries are installed.
+BACKUP_CODEC = os.getenv("BACKUP_CODEC", "deflate")
+AVRO_CODECS = ["null", "deflate", "bzip2", "xz", "snappy", "zstandard", "lz4"]
+# The uncompressed bytes of an Avro block, larger blocks compress better and take more memory.
+BACKUP_SYNC_INTERVAL = int(os.getenv("BACKUP_SYNC_INTERVAL", str(256 * 1024)))
+# The tables of a backup set when the request does not list them.
+DEFAULT_BACKUP_SET = ["jobs", "departments", "hired_employees"]
+MANIFEST_BLOB_NAME = 'manifest.json'
+# The column of every table whose highest value backed up is the watermark of the incremental backups, an
+# integer, datetime, decimal or rowversion column.
+WATERMARK_COLUMNS = {
+    "jobs": "id",
+    "departments": "id",
+    "hired_employees": "id",
+}
+# The integer column whose ranges split a backup in parts.
+PARTITION_COLUMN = "id"
+# Most files a backup can be split in.
+MAX_BACKUP_PARTS = 64
+# The isolation level that gives a transaction a stable snapshot of the database, by dialect.
+SNAPSHOT_ISOLATION = {
+    "mssql": "SNAPSHOT",
+    "postgresql": "REPEATABLE READ",
+}
+
+# Uvicorn prints this logger, the application has no logging configuration of its own.
+logger = logging.getLogger("uvicorn.error")
 
 class BackupService:
     """
@@ -13,80 +61,413 @@ class BackupService:
         connection_string (str): The connection string for the SQL Server.
         container_name (str): The name of the Azure Blob Storage container.
         blob_name (str): The name of the blob file to be created.
+        codec (str): The Avro block codec, BACKUP_CODEC when it is not given.
+        sync_interval (int): The uncompressed bytes of every Avro block, BACKUP_SYNC_INTERVAL when it is not given.
+        file_format (str): avro, or parquet for typed columns with row group statistics, BACKUP_FORMAT when it is not given.
+        progress (JobProgress): Receives the rows to backup and the rows and bytes written, when the backup runs as a job.
     """
-    def __init__(self, db_connection_string, dl_connection_string, container_name):
+    def __init__(self, db_connection_string, dl_connection_string, container_name, codec=None, sync_interval=None, file_format=None, progress=None):
         self.db_connection_string = db_connection_string
         self.dl_connection_string = dl_connection_string
         self.container_name = container_name
+        self.file_format = file_format or BACKUP_FORMAT
+        self.progress = progress
+        self.codec = codec or BACKUP_CODEC
+        self.sync_interval = sync_interval or BACKUP_SYNC_INTERVAL
 
-    def backup_table_to_blob(self, table_name) -> BaseResponseModel:
+    @profiled
+    def backup_table_to_blob(self, table_name, incremental=False, parts=1) -> BaseResponseModel:
         """
         Backs up the data from the specified SQL Server table to an Avro file and uploads it to Azure Blob Storage.
+
+        A full backup writes {table}.{chain}.avro, or .parquet, and starts a new chain in {table}.manifest.json.
+        An incremental backup only exports the rows above the watermark of the chain, the highest value of the
+        WATERMARK_COLUMNS column already backed up, to the next {table}.{chain}.delta.NNNN.{run}.avro file and
+        appends it to the chain. The watermark has to grow with every new or changed row: an id misses the
+        updates and the rows inserted with a lower id, a change column such as a rowversion catches them.
+        Without a chain the incremental backup is a full one.
+
+        Every backup writes files of its own and then the manifest, only if no other backup of the table wrote
+        it since it was read, so a backup that fails leaves the chain as it was. A backup that loses that race
+        deletes its files. Once a full backup wrote its manifest the files of the chain it replaced are deleted.
+
+        A full backup in several parts splits the table in ranges of id, {table}.{chain}.part.NNNN.avro, that are read
+        from the same snapshot and uploaded concurrently, so the restore can load them in parallel.
         
         Args:
             table_name (str): The name of the table to backup.
+            incremental (bool): Whether to export only the rows above the watermark.
+            parts (int): The number of files of a full backup.
         """
         response = BaseResponseModel()
         response.Error = False
         response.ErrorMessage = ""
        
         try:
-            engine = create_engine(self.db_connection_string)
+            self.check_codec()
+            engine = get_engine(self.db_connection_string)
             metadata = MetaData()
             table = Table(table_name, metadata, autoload_with=engine)
-            schema = {
-            "type": "record",
-            "name": table_name,
-            "fields": []
-            }
+            manifest_client = self.get_blob_client(chain_manifest_name(table_name))
+            previous_chain, etag = read_manifest_version(manifest_client)
+            chain = previous_chain if incremental else None
+            run_id = new_chain_id()
+            query = select(table)
+            if chain is None:
+                blob_name = f'{table_name}.{run_id}.{self.file_format}'
+            else:
+                # The chains written before the files were named by chain have no id. The run id keeps apart the
+                # deltas of two backups that read the same manifest.
+                prefix = f'{table_name}.{chain["id"]}' if "id" in chain else table_name
+                blob_name = f'{prefix}.delta.{len(chain["deltas"]) + 1:04d}.{run_id}.{self.file_format}'
+                if chain["watermark"] is not None:
+                    query = query.where(table.c[chain["watermarkColumn"]] > chain["watermark"])
+            if chain is None and parts > 1:
+                entry = self.write_parts(table, parts, run_id)
+            else:
+                with engine.connect() as conn:
+                    self.count_rows(conn, [query])
+                    result = conn.execute(query.execution_options(yield_per=BACKUP_CHUNK_SIZE)).mappings()
+                    entry = self.write_table(table, result, blob_name)
 
-            for column in table.columns:
-                avro_type = None
-                if column.type.python_type is int:
-                    avro_type = 'int'
-                elif column.type.python_type is float:
-                    avro_type = 'float'
-                elif column.type.python_type is bool:
-                    avro_type = 'boolean'
-                elif column.type.python_type is str:
-                    avro_type = 'string'
-                elif column.type.python_type in [datetime.date, datetime.datetime]:
-                    avro_type = 'string'  # Usar 'string' para representar fechas y horas en Avro
-                else:
-                    avro_type = 'string'  # Asigna un tipo por defecto o maneja otros tipos específicamente
-
-                field = {
-                    "name": column.name,
-                    "type": ["null", avro_type],  # Acepta nulos
-                    "default": None  
-                }
-                schema["fields"].append(field)
-
-            
-            with engine.connect() as conn:
-                df = pd.read_sql(f'SELECT * FROM {table_name}', conn)
-                df = convert_datetime_to_string(df) 
-
-                parsed_schema = parse_schema(schema)
-                with open(f'{table_name}.avro', 'wb') as out:
-                    records = df.to_dict('records')  
-                    writer(out, parsed_schema, records)
-
-
-                blob_service_client = BlobServiceClient.from_connection_string(self.dl_connection_string)
-                container_client = blob_service_client.get_container_client(self.container_name)
-                blob_client = container_client.get_blob_client(f'{table_name}.avro')
-                with open(f'{table_name}.avro', "rb") as avro_file:
-                    blob_client.upload_blob(avro_file, overwrite=True)
+            if chain is None:
+                self.replace_chain(manifest_client, new_chain(table, entry, run_id), etag, entry, previous_chain)
+            elif entry["rows"]:
+                chain["deltas"].append(dict(entry, fromWatermark=chain["watermark"]))
+                chain["watermark"] = entry["watermark"]
+                self.replace_chain(manifest_client, chain, etag, entry)
+            else:
+                self.delete_files(entry_files(entry))
         except Exception as e:
             response.Error = True
             response.ErrorMessage = str(e)
 
         return response
-    
 
-def convert_datetime_to_string(df):
-    for column in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[column]):
-            df[column] = df[column].apply(lambda x: x.isoformat() if pd.notnull(x) else None)
-    return df
\ No newline at end of file
+    def backup_tables_to_blob(self, table_names) -> BaseResponseModel:
+        """
+        Backs up several tables concurrently from the same snapshot and writes a manifest with the file,
+        row count and time of every table.
+
+        The tables are read in one transaction with snapshot isolation, one cursor per table on the same
+        connection (MARS on SQL Server, the database needs ALLOW_SNAPSHOT_ISOLATION ON). A worker thread per
+        table takes its turn to fetch a chunk and then encodes and uploads it in parallel with the others, so
+        the files are consistent with each other, e.g. the jobs of every backed up employee are in the jobs file.
+        The manifest is written last, only when every table was backed up, and every table starts a new
+        incremental chain that replaces its previous one, like a full backup of the table.
+
+        Args:
+            table_names (List[str]): The names of the tables to backup.
+        """
+        response = BaseResponseModel()
+        response.Error = False
+        response.ErrorMessage = ""
+
+        try:
+            self.check_codec()
+            started = time.perf_counter()
+            manifest_clients = [self.get_blob_client(chain_manifest_name(table_name)) for table_name in table_names]
+            previous_chains = [read_manifest_version(manifest_client) for manifest_client in manifest_clients]
+            with self.snapshot() as conn:
+                isolation_level = conn.get_isolation_level()
+                metadata = MetaData()
+                tables = [Table(table_name, metadata, autoload_with=conn) for table_name in table_names]
+                chain_id = new_chain_id()
+                entries = self.write_concurrently(conn, [(table, select(table), f'{table.name}.{chain_id}.{self.file_format}') for table in tables])
+
+            for position, (table, entry, manifest_client, (previous_chain, etag)) in enumerate(zip(tables, entries, manifest_clients, previous_chains)):
+                try:
+                    self.replace_chain(manifest_client, new_chain(table, entry, chain_id), etag, entry, previous_chain)
+                except ManifestConflict:
+                    # The tables whose chain was not replaced yet are not part of any chain.
+                    self.delete_files(name for later_entry in entries[position + 1:] for name in entry_files(later_entry))
+                    raise
+
+            manifest = {
+                "createdAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "isolationLevel": isolation_level,
+                "seconds": round(time.perf_counter() - started, 3),
+                "tables": entries,
+            }
+            write_manifest(self.get_blob_client(MANIFEST_BLOB_NAME), manifest)
+        except Exception as e:
+            response.Error = True
+            response.ErrorMessage = str(e)
+
+        return response
+
+    def check_codec(self):
+        """
+        Raises:
+            ValueError: If the backup is written in Avro with a codec fastavro can not write.
+        """
+        if self.file_format == "avro" and not codec_available(self.codec):
+            raise ValueError(codec_error(self.codec))
+
+    def write_parts(self, table, parts, chain_id) -> dict:
+        """
+        Writes the table in up to parts files, one per range of id, from the same snapshot.
+
+        Returns:
+            dict: The manifest entry of the backup, with the entry of every part.
+        """
+        started = time.perf_counter()
+        with self.snapshot() as conn:
+            key = table.c[PARTITION_COLUMN]
+            low, high = conn.execute(select(func.min(key), func.max(key))).one()
+            queries = part_queries(table, key, low, high, parts)
+            entries = self.write_concurrently(conn, [(table, query, f'{table.name}.{chain_id}.part.{number:04d}.{self.file_format}') for number, query in enumerate(queries, start=1)])
+        watermarks = [entry["watermark"] for entry in entries if entry["watermark"] is not None]
+        return {
+            "table": table.name,
+            "parts": entries,
+            "rows": sum(entry["rows"] for entry in entries),
+            "bytes": sum(entry["bytes"] for entry in entries),
+            "seconds": round(time.perf_counter() - started, 3),
+            "watermark": max(watermarks, default=None),
+            "createdAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    @contextmanager
+    def snapshot(self):
+        """
+        Opens a connection in a transaction with snapshot isolation where several cursors can be open at once
+        (MARS on SQL Server, the database needs ALLOW_SNAPSHOT_ISOLATION ON).
+        """
+        engine = get_engine(mars_connection_string(self.db_connection_string))
+        isolation_level = SNAPSHOT_ISOLATION.get(engine.dialect.name)
+        with engine.connect() as conn:
+            if isolation_level is not None:
+                conn.execution_options(isolation_level=isolation_level)
+            with conn.begin():
+                yield conn
+
+    def write_concurrently(self, conn, files) -> list:
+        """
+        Runs the queries on the connection and writes their rows to the blobs, a worker thread per blob.
+
+        Every worker takes its turn to fetch a chunk from its cursor and then encodes and uploads it in
+        parallel with the others.
+
+        Args:
+            conn (Connection): The connection of the snapshot.
+            files (List[tuple]): The table, the query and the blob name of every file.
+
+        Returns:
+            List[dict]: The manifest entry of every file.
+        """
+        self.count_rows(conn, [query for table, query, blob_name in files])
+        results = [conn.execute(query.execution_options(yield_per=BACKUP_CHUNK_SIZE)).mappings() for table, query, blob_name in files]
+        fetch_lock = threading.Lock()
+        with ThreadPoolExecutor(max_workers=len(files)) as executor:
+            return list(executor.map(in_current_context(lambda file, result: self.write_table(file[0], result, file[2], fetch_lock)), files, results))
+
+    def count_rows(self, conn, queries):
+        """
+        Adds the rows of the queries to the total of the job progress.
+        """
+        if self.progress is not None:
+            self.progress.add_total(sum(conn.execute(select(func.count()).select_from(query.subquery())).scalar() for query in queries))
+
+    def write_table(self, table, result, blob_name, fetch_lock=None) -> dict:
+        """
+        Writes the rows of the result to the blob. When the cursors share the connection the chunks are fetched
+        under fetch_lock.
+
+        Returns:
+            dict: The manifest entry of the file, with the highest watermark column value written.
+        """
+        started = time.perf_counter()
+        watermark_column = WATERMARK_COLUMNS.get(table.name, "id")
+        rows = 0
+        watermark = None
+        reported_bytes = 0
+        read_seconds = 0.0
+
+        def chunks():
+            nonlocal rows, watermark, reported_bytes, read_seconds
+            while True:
+                with fetch_lock or nullcontext():
+                    fetch_started = time.perf_counter()
+                    chunk = result.fetchmany(BACKUP_CHUNK_SIZE)
+                    read_seconds += time.perf_counter() - fetch_started
+                if not chunk:
+                    return
+                rows += len(chunk)
+                if self.progress is not None:
+                    self.progress.add(len(chunk), blob_stream.bytes_written - reported_bytes)
+                    reported_bytes = blob_stream.bytes_written
+                if watermark_column in table.c:
+                    values = [row[watermark_column] for row in chunk if row[watermark_column] is not None]
+                    if values:
+                        watermark = max(values) if watermark is None else max(watermark, *values)
+                yield from chunk
+
+        blob_stream = BlockBlobWriter(self.get_blob_client(blob_name))
+        if self.file_format == "parquet":
+            # pyarrow is only loaded by the Parquet backups, it adds a tenth of a second to the startup.
+            from service import parquet_files
+            parquet_files.write_parquet(blob_stream, table, chunks())
+            codec = parquet_files.PARQUET_COMPRESSION
+        else:
+            writer(blob_stream, parse_schema(avro_schema(table)), chunks(), codec=self.codec, sync_interval=self.sync_interval)
+            codec = self.codec
+        blob_stream.commit()
+        if self.progress is not None:
+            self.progress.add(0, blob_stream.bytes_written - reported_bytes)
+        # The rows are fetched, encoded and uploaded in turns, the encoding is the rest of the time.
+        record_stage("backup_read", read_seconds)
+        record_stage("backup_upload", blob_stream.upload_seconds)
+        record_stage("backup_serialize", time.perf_counter() - started - read_seconds - blob_stream.upload_seconds)
+        return {
+            "table": table.name,
+            "file": blob_name,
+            "rows": rows,
+            "bytes": blob_stream.bytes_written,
+            "format": self.file_format,
+            "codec": codec,
+            "seconds": round(time.perf_counter() - started, 3),
+            "watermark": watermark,
+            "createdAt": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        }
+
+    def replace_chain(self, manifest_client, chain, etag, entry, previous_chain=None):
+        """
+        Writes the chain manifest if it still has the etag it was read with and then deletes the files of the
+        chain it replaces, if any. When another backup wrote the manifest first the files of the entry are
+        deleted and ManifestConflict is raised.
+        """
+        try:
+            replace_manifest(manifest_client, chain, etag)
+        except ManifestConflict:
+            self.delete_files(entry_files(entry))
+            raise
+        if previous_chain is not None:
+            self.delete_files(chain_files(previous_chain))
+
+    def delete_files(self, blob_names):
+        """
+        Deletes the backup files, a file that can not be deleted is only logged.
+        """
+        for blob_name in blob_names:
+            try:
+                self.get_blob_client(blob_name).delete_blob()
+            except ResourceNotFoundError:
+                pass
+            except Exception as e:
+                logger.warning("The backup file %s could not be deleted: %s", blob_name, e)
+
+    def get_blob_client(self, blob_name):
+        blob_service_client = BlobServiceClient.from_connection_string(self.dl_connection_string)
+        container_client = blob_service_client.get_container_client(self.container_name)
+        return container_client.get_blob_client(blob_name)
+
+
+def new_chain_id() -> str:
+    """
+    Returns the id of a new chain or backup run, the UTC time it starts, that is part of the names of its files.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).strftime("%Y%m%dT%H%M%S%fZ")
+
+
+def new_chain(table, entry, chain_id) -> dict:
+    """
+    Returns the incremental chain manifest that starts at the full backup entry.
+    """
+    return {
+        "table": table.name,
+        "id": chain_id,
+        "watermarkColumn": WATERMARK_COLUMNS.get(table.name, "id"),
+        "watermark": entry["watermark"],
+        "base": entry,
+        "deltas": [],
+    }
+
+
+def part_queries(table, key, low, high, parts) -> list:
+    """
+    Splits the table in up to parts queries over ranges of the same width of the integer key.
+    """
+    if not isinstance(low, int) or not isinstance(high, int) or parts <= 1:
+        return [select(table)]
+    width = -(-(high - low + 1) // parts)
+    queries = []
+    for start in range(low, high + 1, width):
+        query = select(table).where(key >= start)
+        if start + width <= high:
+            query = query.where(key < start + width)
+        queries.append(query)
+    return queries
+
+
+def avro_schema(table):
+    """
+    Returns the Avro schema of the reflected table, every column is nullable.
+
+    Dates and datetimes use the date and timestamp-millis logical types, big integers are long.
+    """
+    schema = {
+    "type": "record",
+    "name": table.name,
+    "fields": []
+    }
+
+    for column in table.columns:
+        avro_type = None
+        if isinstance(column.type, BigInteger):
+            avro_type = 'long'
+        elif column.type.python_type is int:
+            avro_type = 'int'
+        elif column.type.python_type is float:
+            avro_type = 'double'
+        elif column.type.python_type is bool:
+            avro_type = 'boolean'
+        elif column.type.python_type is str:
+            avro_type = 'string'
+        elif column.type.python_type is datetime.datetime:
+            avro_type = {"type": "long", "logicalType": "timestamp-millis"}
+        elif column.type.python_type is datetime.date:
+            avro_type = {"type": "int", "logicalType": "date"}
+        else:
+            avro_type = 'string'  # Asigna un tipo por defecto o maneja otros tipos específicamente
+
+        field = {
+            "name": column.name,
+            "type": ["null", avro_type],  # Acepta nulos
+            "default": None  
+        }
+        schema["fields"].append(field)
+    return schema
+
+
+@lru_cache(maxsize=None)
+def codec_available(codec) -> bool:
+    """
+    Returns True when fastavro can write the codec, snappy, zstandard and lz4 need their libraries installed.
+    """
+    try:
+        writer(io.BytesIO(), parse_schema({"type": "record", "name": "codec", "fields": []}), [{}], codec=codec)
+        return True
+    except ValueError:
+        return False
+
+
+def codec_error(codec) -> str:
+    available = [name for name in AVRO_CODECS if codec_available(name)]
+    return f"El codec {codec} no es soportado, los codecs disponibles son: {', '.join(available)}"
+
+
+
+def mars_connection_string(connection_string):
+    """
+    Returns the connection string with Multiple Active Result Sets enabled on SQL Server, so several
+    cursors can be open on one connection.
+    """
+    url = make_url(connection_string)
+    if url.get_backend_name() != "mssql":
+        return connection_string
+    if "odbc_connect" in url.query:
+        url = url.update_query_dict({"odbc_connect": url.query["odbc_connect"].rstrip(";") + ";MARS_Connection=Yes"})
+    else:
+        url = url.update_query_dict({"MARS_Connection": "Yes"})
+    return url.render_as_string(hide_password=False)
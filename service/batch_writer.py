@@ -0,0 +1,87 @@
+from typing import List, Tuple
+from sqlalchemy import Table, insert
+from sqlalchemy.exc import DataError, IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+
+BATCH_SIZE = 500
+# The errors caused by the values of a row: a constraint violation, a value too long or out of range for its
+# column, a conversion error, or an integer the driver can not bind. They only reject the row.
+ROW_ERRORS = (IntegrityError, DataError, OverflowError)
+
+
+def insert_batch(session: Session, table: Table, rows: List[dict], batch_size: int = BATCH_SIZE) -> List[Tuple[int, str]]:
+    """
+    Inserts a list of rows using multi-row statements inside the current transaction of the session.
+
+    Every chunk runs under its own savepoint. When a row of a chunk violates a constraint or has a value the
+    column does not take, the chunk is rolled back to the savepoint and split in halves until the offending
+    rows are isolated, so a single bad row is rejected and the rest of the batch is still written.
+
+    Args:
+        session (Session): The session that owns the transaction. The caller commits it.
+        table (Table): The table where the rows will be inserted.
+        rows (List[dict]): The rows to be inserted, one dict of column values per row.
+        batch_size (int): The maximum number of rows sent in a single statement.
+
+    Returns:
+        List[Tuple[int, str]]: The position in rows and the database error message of every rejected row.
+    """
+    rejected: List[Tuple[int, str]] = []
+    for start in range(0, len(rows), batch_size):
+        _insert_chunk(session, table, rows, start, min(start + batch_size, len(rows)), rejected)
+    return rejected
+
+
+def _insert_chunk(session: Session, table: Table, rows: List[dict], start: int, end: int, rejected: List[Tuple[int, str]]):
+    try:
+        with session.begin_nested():
+            session.execute(insert(table), rows[start:end])
+    except ROW_ERRORS as e:
+        if end - start == 1:
+            rejected.append((start, str(getattr(e, "orig", e))))
+            return
+        middle = (start + end) // 2
+        _insert_chunk(session, table, rows, start, middle, rejected)
+        _insert_chunk(session, table, rows, middle, end, rejected)
+
+
+async def insert_batch_async(session: AsyncSession, table: Table, rows: List[dict], batch_size: int = BATCH_SIZE) -> List[Tuple[int, str]]:
+    """
+    Same as insert_batch for an AsyncSession, the statements are awaited instead of blocking the thread.
+    """
+    return await session.run_sync(insert_batch, table, rows, batch_size)
+
+
+def insert_bulk(session: Session, table: Table, rows: List[dict], batch_size: int = BATCH_SIZE) -> List[Tuple[int, str]]:
+    """
+    Same as insert_batch for large loads.
+
+    On SQL Server every chunk is sent with pyodbc fast_executemany, the parameters of the whole chunk go in
+    one round trip instead of multi-row statements of up to 2100 parameters. The cursor belongs to the
+    connection of the session, so the rows are part of its transaction. A chunk that violates a constraint or
+    has a value a column does not take is rolled back to its savepoint and written again by insert_batch to
+    isolate the rejected rows. The other
+    databases use insert_batch.
+    """
+    connection = session.connection()
+    if connection.dialect.name != "mssql" or not rows:
+        return insert_batch(session, table, rows, batch_size)
+
+    columns = list(rows[0])
+    statement = f"INSERT INTO {table.name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    cursor = connection.connection.driver_connection.cursor()
+    cursor.fast_executemany = True
+    rejected: List[Tuple[int, str]] = []
+    try:
+        for start in range(0, len(rows), batch_size):
+            chunk = rows[start:start + batch_size]
+            try:
+                with session.begin_nested():
+                    cursor.executemany(statement, [tuple(row[column] for column in columns) for row in chunk])
+            except (connection.dialect.dbapi.IntegrityError, connection.dialect.dbapi.DataError, OverflowError):
+                rejected.extend((start + position, error_message) for position, error_message in insert_batch(session, table, chunk, batch_size))
+    finally:
+        cursor.close()
+    return rejected
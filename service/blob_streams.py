@@ -0,0 +1,112 @@
+import base64
+import io
+import time
+from azure.storage.blob import BlobBlock
+
+
+# Size of every staged block, a block blob accepts up to 50000 of them.
+BLOCK_SIZE = 4 * 1024 * 1024
+
+
+class BlockBlobWriter(io.RawIOBase):
+    """
+    A write-only file object that uploads to a block blob while it is written.
+
+    The data is buffered up to block_size and staged as a block, commit() commits the block list. Only one
+    block is kept in memory, and until the commit the previous version of the blob stays untouched, so a
+    failed backup does not leave a truncated file behind. upload_seconds adds up the time of the uploads.
+
+    Args:
+        blob_client (BlobClient): The client of the blob to be written.
+        block_size (int): The size of every staged block.
+    """
+    def __init__(self, blob_client, block_size=BLOCK_SIZE):
+        self.blob_client = blob_client
+        self.block_size = block_size
+        self.buffer = bytearray()
+        self.block_ids = []
+        self.bytes_written = 0
+        self.upload_seconds = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= self.block_size:
+            self.stage(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def stage(self, block):
+        # Every block id of a blob must have the same length.
+        block_id = base64.b64encode(f"{len(self.block_ids):08d}".encode()).decode()
+        started = time.perf_counter()
+        self.blob_client.stage_block(block_id, block, length=len(block))
+        self.upload_seconds += time.perf_counter() - started
+        self.block_ids.append(block_id)
+
+    def commit(self):
+        """
+        Stages the buffered data and commits the blocks, replacing the previous version of the blob.
+        """
+        if self.buffer:
+            self.stage(bytes(self.buffer))
+            self.buffer.clear()
+        started = time.perf_counter()
+        self.blob_client.commit_block_list([BlobBlock(block_id=block_id) for block_id in self.block_ids])
+        self.upload_seconds += time.perf_counter() - started
+
+
+class BlobRangeReader(io.RawIOBase):
+    """
+    A read-only file object that downloads the blob in ranges as it is read, seeking only moves the position
+    of the next range.
+
+    Use open_blob_reader to wrap it in a buffer, so every download is a range of chunk_size bytes.
+    download_seconds adds up the time of the downloads.
+
+    Args:
+        blob_client (BlobClient): The client of the blob to be read.
+    """
+    def __init__(self, blob_client):
+        self.blob_client = blob_client
+        self.size = blob_client.get_blob_properties().size
+        self.position = 0
+        self.bytes_read = 0
+        self.download_seconds = 0.0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self.position = offset
+        elif whence == io.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.size + offset
+        return self.position
+
+    def readinto(self, buffer):
+        length = min(len(buffer), self.size - self.position)
+        if length <= 0:
+            return 0
+        started = time.perf_counter()
+        data = self.blob_client.download_blob(offset=self.position, length=length).readall()
+        self.download_seconds += time.perf_counter() - started
+        buffer[:len(data)] = data
+        self.position += len(data)
+        self.bytes_read += len(data)
+        return len(data)
+
+
+def open_blob_reader(blob_client, chunk_size=BLOCK_SIZE):
+    """
+    Returns a buffered file object over the blob that keeps a single chunk in memory.
+    """
+    return io.BufferedReader(BlobRangeReader(blob_client), buffer_size=chunk_size)
@@ -0,0 +1,129 @@
+import functools
+from typing import Dict, List, Optional, Tuple
+import orjson
+import pydantic
+from models.response.base_response_model import BaseResponseModel
+from service.async_ingestion_service import validate_keys_async, write_rows_async
+from service.engine_registry import get_async_engine
+from service.key_index import key_index
+from service.metrics import stage
+from service.stream_ingestion_service import STREAM_ENTITIES, StreamEntity
+from service.validation import validate_batch
+
+
+# The list of rows in the body of every entity, the same bodies as the add endpoints.
+LIST_FIELDS = {
+    "employees": "hiredEmployees",
+    "jobs": "jobs",
+    "departments": "departments",
+}
+
+
+def decode_body(entity_name: str, body: bytes) -> Tuple[Dict[str, list], List[str]]:
+    """
+    Decodes the JSON body of an add endpoint straight into one list of values per field, no request model
+    is built for the rows.
+
+    The values are validated with the types of the request models, so they are coerced like in the v1 and v2
+    endpoints: the ids and the texts are strings, integers are not accepted, and dateTime is parsed by pydantic.
+    A value that does not validate is left empty and reported as the error of its row, where the v1 and v2
+    endpoints reject the whole request with a 422.
+
+    Args:
+        entity_name (str): employees, jobs or departments.
+        body (bytes): The raw body of the request.
+
+    Returns:
+        Tuple[Dict[str, list], List[str]]: The columns of the rows and the decoding error of every row,
+        an empty string if the row decoded.
+
+    Raises:
+        ValueError: If the body is not JSON or does not have between 1 and 1000 rows.
+    """
+    try:
+        payload = orjson.loads(body)
+    except orjson.JSONDecodeError:
+        raise ValueError("El cuerpo de la solicitud no es un JSON valido")
+    records = payload.get(LIST_FIELDS[entity_name]) if type(payload) is dict else None
+    if type(records) is not list or not (1 <= len(records) <= 1000):
+        raise ValueError("El numero de registros debe estar entre 1 y 1000")
+
+    entity = STREAM_ENTITIES[entity_name]
+    errors = [""] * len(records)
+    if not all(type(record) is dict for record in records):
+        for position, record in enumerate(records):
+            if type(record) is not dict:
+                records[position] = {}
+                errors[position] = "El registro no es un objeto JSON valido"
+
+    columns = {field: decode_column(field, entity.model.model_fields[field].annotation, records, errors) for field in entity.fields}
+    return columns, errors
+
+
+@functools.lru_cache(maxsize=None)
+def field_adapters(annotation) -> Tuple[pydantic.TypeAdapter, pydantic.TypeAdapter]:
+    # The adapters of a whole column and of one value, the missing fields are None.
+    return pydantic.TypeAdapter(List[Optional[annotation]]), pydantic.TypeAdapter(Optional[annotation])
+
+
+def decode_column(field: str, annotation, records: List[dict], errors: List[str]) -> list:
+    """
+    Validates the values of a field with the type of the request model, the column is validated whole and
+    value by value only when a value does not validate.
+    """
+    column_adapter, value_adapter = field_adapters(annotation)
+    values = [record.get(field) for record in records]
+    try:
+        decoded = column_adapter.validate_python(values)
+    except pydantic.ValidationError:
+        decoded = []
+        for position, value in enumerate(values):
+            try:
+                decoded.append(value_adapter.validate_python(value))
+            except pydantic.ValidationError:
+                decoded.append(None)
+                errors[position] = errors[position] or f"El campo {field} no es valido"
+    # The request models do not accept a null, only a missing field.
+    if None in values:
+        for position, record in enumerate(records):
+            if values[position] is None and field in record:
+                errors[position] = errors[position] or f"El campo {field} no es valido"
+    return decoded
+
+
+async def insert_columns_async(entity_name: str, columns: Dict[str, list], decode_errors: List[str]) -> BaseResponseModel:
+    """
+    Validates and writes the rows decoded by decode_body, like insert_*_async does with the request models.
+
+    The rows are written from the columns and a request model is only built for the rejected rows, to log them.
+
+    Args:
+        entity_name (str): employees, jobs or departments.
+        columns (Dict[str, list]): The values of the rows, one list per field.
+        decode_errors (List[str]): The decoding error of every row.
+
+    Returns:
+        BaseResponseModel: A BaseResponseModel object indicating the success or failure of the operation.
+    """
+    entity = STREAM_ENTITIES[entity_name]
+    with stage("validation"):
+        errors = validate_batch(columns, entity.rules)
+        if entity.check_keys and await key_index.ensure_loaded_async(get_async_engine()):
+            errors = await validate_keys_async(columns, errors)
+    errors = [decode_error or error for decode_error, error in zip(decode_errors, errors)]
+
+    table_columns = [column.name for column in entity.table.columns]
+
+    def to_row(position: int) -> dict:
+        return {table_column: columns[field][position] for field, table_column in zip(entity.fields, table_columns)}
+
+    def add_to_log(log_list: List, position: int, error_message: str) -> List:
+        return entity.add_to_log(log_list, to_request_model(entity, columns, position), error_message)
+
+    response, accepted = await write_rows_async(range(len(errors)), errors, entity.table, to_row, add_to_log, entity.add_to_index, entity.blob_prefix)
+    return response
+
+
+def to_request_model(entity: StreamEntity, columns: Dict[str, list], position: int):
+    # The values were already checked by decode_body.
+    return entity.model.model_construct(**{field: columns[field][position] for field in entity.fields})
@@ -1,27 +1,18 @@
 from typing import List
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date
+from sqlalchemy import Column, Integer, String, Float, Date
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
-import datetime
-import re
-from logger.logger import AzureBlobLogger
+from logger.logger import get_rejected_row_logger
 
 from models.entities.log_departments import LogDepartments
 from models.request.departments_request_model import DepartmentRequestModel
 from models.response.base_response_model import BaseResponseModel
-from security.keyvault import KeyVaultSecrets
-
-
-key_vault_name = "ServicesDbKeyVault"
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-key_vault_secrets = KeyVaultSecrets(vault_url=key_vault_uri)
-
-db_connection = key_vault_secrets.get_secret("DATABASEURI1")
-dl_connection = key_vault_secrets.get_secret("DataCodeDLConnectionString")
-container_name = 'logger'
-
-engine = create_engine(db_connection)
+from service.batch_writer import insert_batch
+from service.engine_registry import get_engine
+from service.idempotency_store import mark_write_failed
+from service.key_index import key_index
+from service.metrics import count_rows, stage
+from service.validation import DEPARTMENT_RULES, to_columns, validate_batch
 
 Base = declarative_base()
 
@@ -49,17 +40,8 @@ def valitate_departments(department: DepartmentRequestModel) -> bool:
     Returns:
         bool: False if the hired employee data is valid, True otherwise.
     """
-    if department.id is None:
-        return True, "El campo id es requerido"
-    if department.department is None:
-        return True, "El campo department es requerido"
-    
-    if not re.match(r'^[a-zA-Z0-9 ]+$', department.department):
-        return True, "El campo department solo puede contener letras y numeros"
-    if not re.match(r'^[0-9 ]+$', department.id):
-        return True, "El campo id solo puede contener numeros"
-    
-    return False, ""
+    errors = validate_batch(to_columns([department], DEPARTMENT_RULES), DEPARTMENT_RULES)
+    return errors[0] != "", errors[0]
 
 
 def log_invalid_departments(listLogDepartments: List[LogDepartments]) -> BaseResponseModel:
@@ -76,11 +58,7 @@ def log_invalid_departments(listLogDepartments: List[LogDepartments]) -> BaseRes
     response.Error = False
     response.ErrorMessage = ""
     try:
-        azure_blob_logger = AzureBlobLogger(dl_connection, container_name)
-        timestamp = datetime.datetime.now().isoformat()
-        log_blob_name = f'departments_{timestamp}.log'
-        departments_json = '[' + ','.join([dep.model_dump_json() for dep in listLogDepartments]) + ']'
-        azure_blob_logger.log_data(departments_json, log_blob_name)
+        get_rejected_row_logger().log_rows(listLogDepartments, 'departments_')
         response.Error = True
         response.ErrorMessage = "El proceso detecto registros invalidos, se genero un log con los registros."
     except Exception as e:
@@ -102,46 +80,60 @@ def insert_departments(listLogDepartments: List[DepartmentRequestModel]) -> Base
     """
     response = BaseResponseModel()
     
-    Session = sessionmaker(bind=engine)
-    session = Session()
     log_list : List[LogDepartments] = []
+    valid_departments : List[DepartmentRequestModel] = []
     exists_validation_error = False
     enable_log = False
-    for department in listLogDepartments:
-        exists_validation_error, error_validation_message = valitate_departments(department)
-        if exists_validation_error:
-            log_list = add_department_to_log(log_list, department, error_validation_message)
-            enable_log = True
-        else:
-            new_department = Departments(
-                id=department.id,
-                department=department.department,
-            )
-
-            try:
-                session.add(new_department)
+    accepted = 0
+    with stage("validation"):
+        validation_errors = validate_batch(to_columns(listLogDepartments, DEPARTMENT_RULES), DEPARTMENT_RULES)
+        for department, error_validation_message in zip(listLogDepartments, validation_errors):
+            exists_validation_error = error_validation_message != ""
+            if exists_validation_error:
+                log_list = add_department_to_log(log_list, department, error_validation_message)
+                enable_log = True
+            else:
+                valid_departments.append(department)
+
+    if valid_departments:
+        Session = sessionmaker(bind=get_engine())
+        session = Session()
+        try:
+            rows = [
+                {
+                    "id": department.id,
+                    "department": department.department
+                }
+                for department in valid_departments
+            ]
+            with stage("db_write"):
+                rejected = insert_batch(session, Departments.__table__, rows)
                 session.commit()
-                response.Error = False
-                response.ErrorMessage = "Los registros se insertaron correctamente"
-            except IntegrityError as e: 
-                session.rollback()
-                result = set_specific_error_message(str(e.orig))
-                log_list = add_department_to_log(log_list, department, result.ErrorMessage)
+            rejected_positions = {position for position, error_message in rejected}
+            accepted = len(rows) - len(rejected_positions)
+            key_index.add_departments(row["id"] for position, row in enumerate(rows) if position not in rejected_positions)
+            response.Error = False
+            response.ErrorMessage = "Los registros se insertaron correctamente"
+            for position, error_message in rejected:
+                result = set_specific_error_message(error_message)
+                log_list = add_department_to_log(log_list, valid_departments[position], result.ErrorMessage)
                 enable_log = True
                 response.Error = result.Error
                 response.ErrorMessage = result.ErrorMessage
-            except Exception as e:
-                session.rollback()
-                enable_log = True
-                response.Error = True
-                response.ErrorMessage = str(e)
-            finally:
-                session.close()
+        except Exception as e:
+            session.rollback()
+            mark_write_failed()
+            enable_log = True
+            response.Error = True
+            response.ErrorMessage = str(e)
+        finally:
+            session.close()
 
     if enable_log:
         log_response = log_invalid_departments(log_list)
         response.Error = log_response.Error
         response.ErrorMessage = log_response.ErrorMessage
+    count_rows(Departments.__table__.name, accepted, len(listLogDepartments) - accepted)
     return response
     
 def add_department_to_log(log_list: List[LogDepartments], department: DepartmentRequestModel, error_validation_message: str) -> List[LogDepartments]:
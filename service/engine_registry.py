@@ -0,0 +1,245 @@
+import os
+import threading
+import time
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from security.secrets_provider import get_secrets_provider
+
+
+# The asyncio drivers that replace the blocking drivers of the connection string.
+ASYNC_DRIVERS = {
+    "mssql": "mssql+aioodbc",
+    "mssql+pyodbc": "mssql+aioodbc",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+}
+
+
+def to_async_url(connection_string: str):
+    """
+    Returns the connection string with its driver replaced by the asyncio driver of the same database.
+    """
+    url = make_url(connection_string)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+class PoolStats:
+    """
+    Counts the checkouts of a pool and the time the callers waited for a connection.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record_checkout(self, wait_seconds):
+        with self.lock:
+            self.checkouts += 1
+            self.wait_seconds += wait_seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, wait_seconds)
+
+    def record_timeout(self):
+        with self.lock:
+            self.timeouts += 1
+
+
+class MeasuredPool:
+    """
+    Mixin for the queue pools that measures how long every checkout waits, pre-ping and handshake included.
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def connect(self):
+        started = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            self.stats.record_timeout()
+            raise
+        self.stats.record_checkout(time.perf_counter() - started)
+        return connection
+
+
+class MeasuredQueuePool(MeasuredPool, QueuePool):
+    pass
+
+
+class MeasuredAsyncQueuePool(MeasuredPool, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_options(url, poolclass) -> dict:
+    """
+    Returns the pool arguments of create_engine, read from the environment.
+
+    DB_POOL_SIZE and DB_MAX_OVERFLOW bound the connections of every engine in one process, so a deployment
+    opens up to uvicorn workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections. DB_POOL_TIMEOUT is the
+    seconds a request waits for a free connection, DB_POOL_RECYCLE the age in seconds after which a connection
+    is replaced (Azure SQL closes idle connections after 30 minutes) and DB_POOL_PRE_PING checks a connection
+    before handing it out.
+
+    In-memory SQLite keeps its single connection pool, it can not be shared by a queue pool.
+    """
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        return {}
+    return {
+        "poolclass": poolclass,
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes"),
+    }
+
+
+engines_lock = threading.Lock()
+engines = {}
+async_engines = {}
+
+def get_engine(connection_string: str = None):
+    """
+    Returns the engine of the connection string, created on the first call and shared afterwards.
+
+    Every service and request uses this engine, so its pool, configured by pool_options, is the only one of
+    the process.
+
+    Args:
+        connection_string (str): The database connection string, DATABASEURI1 when it is not given.
+    """
+    if connection_string is None:
+        connection_string = get_secrets_provider().get_secret("DATABASEURI1")
+    engine = engines.get(connection_string)
+    if engine is None:
+        with engines_lock:
+            engine = engines.get(connection_string)
+            if engine is None:
+                engine = engines[connection_string] = create_engine(connection_string, **pool_options(make_url(connection_string), MeasuredQueuePool))
+    return engine
+
+
+def get_async_engine(connection_string: str = None):
+    """
+    Same as get_engine for the asyncio engine of the connection string.
+    """
+    if connection_string is None:
+        connection_string = get_secrets_provider().get_secret("DATABASEURI1")
+    engine = async_engines.get(connection_string)
+    if engine is None:
+        with engines_lock:
+            engine = async_engines.get(connection_string)
+            if engine is None:
+                url = to_async_url(connection_string)
+                engine = async_engines[connection_string] = create_async_engine(url, **pool_options(url, MeasuredAsyncQueuePool))
+    return engine
+
+
+def warm_up_pool(engine, connections: int = None):
+    """
+    Opens the connections of the pool up front so the first requests do not pay for the handshake.
+
+    Args:
+        engine: The engine whose pool is warmed up.
+        connections (int): The number of connections to open, the pool size when it is not given.
+    """
+    if connections is None:
+        size = getattr(engine.pool, "size", None)
+        connections = size() if callable(size) else 1
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(engine.connect())
+    finally:
+        for connection in opened:
+            connection.close()
+
+
+async def warm_up_async_pool(engine, connections: int = None):
+    """
+    Same as warm_up_pool for an AsyncEngine.
+    """
+    if connections is None:
+        size = getattr(engine.pool, "size", None)
+        connections = size() if callable(size) else 1
+    opened = []
+    try:
+        for _ in range(connections):
+            opened.append(await engine.connect())
+    finally:
+        for connection in opened:
+            await connection.close()
+
+
+def engine_labels(connection_strings) -> dict:
+    """
+    Names the engines without any part of their connection string, hide_password only masks the password
+    of the url and not the Uid and Pwd of an odbc_connect query: the engine of DATABASEURI1 is default and
+    the others, e.g. the MARS engine of the backups, are numbered in the order they were created.
+    """
+    default_connection_string = get_secrets_provider().get_secret("DATABASEURI1")
+    labels = {}
+    for connection_string in connection_strings:
+        if connection_string not in labels:
+            backend = make_url(connection_string).get_backend_name()
+            labels[connection_string] = "default" if connection_string == default_connection_string else f"{backend}-{len(labels) + 1}"
+    return labels
+
+
+def pool_stats() -> list:
+    """
+    Returns the state of the pool of every engine: the connections checked out, idle and in overflow, and
+    the checkouts with their average and maximum wait in milliseconds.
+    """
+    stats = []
+    with engines_lock:
+        registered = [(connection_string, engine, False) for connection_string, engine in engines.items()]
+        registered += [(connection_string, engine, True) for connection_string, engine in async_engines.items()]
+    labels = engine_labels(connection_string for connection_string, engine, is_async in registered)
+    for connection_string, engine, is_async in registered:
+        pool = engine.pool
+        entry = {
+            "engine": labels[connection_string],
+            "async": is_async,
+            "pool": type(pool).__name__,
+        }
+        if isinstance(pool, QueuePool):
+            entry.update({
+                "size": pool.size(),
+                "checkedOut": pool.checkedout(),
+                "checkedIn": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+            })
+        pool_stats = getattr(pool, "stats", None)
+        if pool_stats is not None:
+            checkouts = pool_stats.checkouts
+            entry.update({
+                "checkouts": checkouts,
+                "timeouts": pool_stats.timeouts,
+                "waitMsAvg": round(pool_stats.wait_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+                "waitMsMax": round(pool_stats.max_wait_seconds * 1000, 3),
+            })
+        stats.append(entry)
+    return stats
+
+
+async def dispose_engines():
+    """
+    Closes the pooled connections of every engine, called when the application shuts down.
+    """
+    with engines_lock:
+        sync_engines = list(engines.values())
+        asyncio_engines = list(async_engines.values())
+        engines.clear()
+        async_engines.clear()
+    for engine in sync_engines:
+        engine.dispose()
+    for engine in asyncio_engines:
+        await engine.dispose()
@@ -0,0 +1,249 @@
+import csv
+import datetime
+import gc
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+from sqlalchemy import Date, DateTime, Integer
+from sqlalchemy.orm import sessionmaker
+from logger.logger import get_rejected_row_logger
+from models.response.ingest_response_model import IngestResponseModel
+from service.batch_writer import insert_bulk
+from service.engine_registry import get_engine
+from service.hired_employees_service import set_specific_error_message, validate_key_values
+from service.key_index import key_index
+from service.metrics import count_rows, stage
+from service.stream_ingestion_service import STREAM_ENTITIES, is_csv_header, to_model
+from service.validation import validate_batch
+
+
+# Processes that parse and validate the ranges of an uploaded file.
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", str(os.cpu_count() or 1)))
+# Bytes of the file parsed by one task, every range is written in its own transaction.
+LOAD_RANGE_BYTES = int(os.getenv("LOAD_RANGE_BYTES", str(4 * 1024 * 1024)))
+# Rows sent in one executemany.
+LOAD_BATCH_SIZE = 5000
+
+
+def split_ranges(size: int, range_bytes: int) -> List[Tuple[int, int]]:
+    return [(start, min(start + range_bytes, size)) for start in range(0, size, range_bytes)]
+
+
+def read_range(path: str, start: int, end: int) -> str:
+    """
+    Reads the lines that start between start and end: the line cut by start belongs to the previous range
+    and the one cut by end is read to its end.
+    """
+    with open(path, "rb") as file:
+        if start > 0:
+            file.seek(start - 1)
+            file.readline()
+        position = file.tell()
+        if position >= end:
+            return ""
+        data = file.read(end - position)
+        if not data.endswith(b"\n"):
+            data += file.readline()
+    return data.decode("utf-8-sig" if start == 0 else "utf-8")
+
+
+def parse_range(entity_name: str, path: str, start: int, end: int) -> Tuple[int, List[tuple], List[Tuple[dict, str]]]:
+    """
+    Parses and validates one range of an uploaded CSV file, it runs in the processes of the load pool.
+
+    Returns:
+        Tuple[int, List[tuple], List[Tuple[dict, str]]]: The rows read, the values of the valid rows in the
+        order of the table columns, and the fields and error message of the rejected rows.
+    """
+    # The rows hold no reference cycles, the collections triggered by the allocations only slow the parse down.
+    gc.disable()
+    try:
+        return parse_lines(STREAM_ENTITIES[entity_name], read_range(path, start, end).splitlines(), start == 0)
+    finally:
+        gc.enable()
+
+
+def parse_lines(entity, lines: List[str], first_range: bool) -> Tuple[int, List[tuple], List[Tuple[dict, str]]]:
+    if first_range and lines and is_csv_header(lines[0]):
+        lines = lines[1:]
+
+    rows_read = 0
+    rejected = []
+    records = []
+    for values in csv.reader(line for line in lines if line.strip()):
+        rows_read += 1
+        if len(values) != len(entity.fields):
+            rejected.append((dict(zip(entity.fields, values)), f"El registro debe tener {len(entity.fields)} columnas"))
+        else:
+            records.append([value or None for value in values])
+
+    columns = list(zip(*records)) or [()] * len(entity.fields)
+    errors = validate_batch(dict(zip(entity.fields, columns)), entity.rules)
+    # The columns are converted whole, value by value only when a column has a value that does not convert.
+    valid_positions = [position for position, error in enumerate(errors) if not error]
+    converted_columns = []
+    for field, column, table_column in zip(entity.fields, columns, entity.table.columns):
+        convert = column_converter(table_column.type)
+        values = [column[position] for position in valid_positions]
+        try:
+            converted_columns.append(list(map(convert, values)))
+        except ValueError:
+            converted = []
+            for position, value in zip(valid_positions, values):
+                try:
+                    converted.append(convert(value))
+                except ValueError:
+                    converted.append(None)
+                    errors[position] = errors[position] or f"El campo {field} no es valido"
+            converted_columns.append(converted)
+    rows = [row for position, row in zip(valid_positions, zip(*converted_columns)) if not errors[position]]
+    rejected.extend((dict(zip(entity.fields, record)), error) for record, error in zip(records, errors) if error)
+    return rows_read, rows, rejected
+
+
+def column_converter(column_type):
+    if isinstance(column_type, Integer):
+        return int
+    if isinstance(column_type, (Date, DateTime)):
+        return parse_datetime
+    return str
+
+
+def parse_datetime(value: str) -> datetime.datetime:
+    # fromisoformat only reads the Z suffix of the extracts from Python 3.11.
+    return datetime.datetime.fromisoformat(value[:-1] + "+00:00" if value.endswith("Z") else value)
+
+
+def row_fields(entity, row: tuple) -> dict:
+    # The ids of the request models are strings.
+    return {field: str(value) if type(value) is int else value for field, value in zip(entity.fields, row)}
+
+
+load_executor_lock = threading.Lock()
+load_executor = None
+
+def get_load_executor() -> ProcessPoolExecutor:
+    """
+    Returns the process pool of the file loads, it is created on the first call.
+
+    The processes are spawned instead of forked, a fork copies the locks held by the threads of the server.
+    """
+    global load_executor
+    if load_executor is None:
+        with load_executor_lock:
+            if load_executor is None:
+                load_executor = ProcessPoolExecutor(max_workers=LOAD_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return load_executor
+
+
+def shutdown_load_executor():
+    if load_executor is not None:
+        load_executor.shutdown(cancel_futures=True)
+
+
+def load_csv_file(entity_name: str, upload) -> IngestResponseModel:
+    """
+    Loads an uploaded CSV file into the table of the entity.
+
+    The upload is copied to a temporary file that is split in ranges of LOAD_RANGE_BYTES. The load pool
+    parses and validates the ranges in parallel while the valid rows of the ranges already parsed are written,
+    at most two ranges per process wait to be written. The rejected rows are logged like the add endpoints.
+
+    Args:
+        entity_name (str): employees, jobs or departments.
+        upload: The file object of the UploadFile.
+
+    Returns:
+        IngestResponseModel: The rows read, written and rejected, batches is the number of ranges.
+    """
+    response = IngestResponseModel(Error=False, ErrorMessage="Los registros se insertaron correctamente", rowsRead=0, rowsAccepted=0, rowsRejected=0, batches=0)
+    entity = STREAM_ENTITIES[entity_name]
+    started = time.perf_counter()
+    with tempfile.NamedTemporaryFile(suffix=".csv", delete=False) as spooled:
+        shutil.copyfileobj(upload, spooled, 1024 * 1024)
+    pending = deque()
+    try:
+        executor = get_load_executor()
+        ranges = deque(split_ranges(os.path.getsize(spooled.name), LOAD_RANGE_BYTES))
+        while ranges or pending:
+            while ranges and len(pending) < 2 * LOAD_WORKERS:
+                pending.append(executor.submit(parse_range, entity_name, spooled.name, *ranges.popleft()))
+            rows_read, rows, rejected = pending.popleft().result()
+            accepted, log_message = write_range(entity, rows, rejected)
+            response.batches += 1
+            response.rowsRead += rows_read
+            response.rowsAccepted += accepted
+            response.rowsRejected += rows_read - accepted
+            count_rows(entity.table.name, accepted, rows_read - accepted)
+            if log_message:
+                response.Error = True
+                response.ErrorMessage = log_message
+    except Exception as e:
+        response.Error = True
+        response.ErrorMessage = f"La carga se detuvo despues de {response.rowsRead} registros: {e}"
+    finally:
+        for future in pending:
+            future.cancel()
+        os.remove(spooled.name)
+    response.seconds = round(time.perf_counter() - started, 3)
+    return response
+
+
+def write_range(entity, rows: List[tuple], rejected: List[Tuple[dict, str]]) -> Tuple[int, str]:
+    """
+    Writes the valid rows of a range in one transaction and logs its rejected rows.
+
+    Returns:
+        Tuple[int, str]: The rows written and the message of the log, empty when no row was rejected.
+    """
+    columns = [column.name for column in entity.table.columns]
+    if entity.check_keys and rows and key_index.ensure_loaded(get_engine()):
+        with stage("validation"):
+            rows = check_keys(entity, columns, rows, rejected)
+
+    accepted = 0
+    if rows:
+        records = [dict(zip(columns, row)) for row in rows]
+        Session = sessionmaker(bind=get_engine())
+        with Session() as session:
+            with stage("db_write"):
+                failed = insert_bulk(session, entity.table, records, LOAD_BATCH_SIZE)
+                session.commit()
+        failed_positions = {position for position, error_message in failed}
+        entity.add_to_index(record["id"] for position, record in enumerate(records) if position not in failed_positions)
+        accepted = len(records) - len(failed_positions)
+        rejected.extend((row_fields(entity, rows[position]), set_specific_error_message(error_message).ErrorMessage) for position, error_message in failed)
+
+    if not rejected:
+        return accepted, ""
+    log_list = []
+    for fields, error_message in rejected:
+        item, parse_error = to_model(entity, {field: value for field, value in fields.items() if value is not None})
+        log_list = entity.add_to_log(log_list, item, error_message)
+    get_rejected_row_logger().log_rows(log_list, entity.blob_prefix)
+    return accepted, "El proceso detecto registros invalidos, se genero un log con los registros."
+
+
+def check_keys(entity, columns: List[str], rows: List[tuple], rejected: List[Tuple[dict, str]]) -> List[tuple]:
+    """
+    Returns the hired employees whose keys are valid and adds the others to the rejected rows.
+    """
+    id_position, job_position, department_position = (columns.index(column) for column in ("id", "job_id", "department_id"))
+    checked_rows = []
+    for row in rows:
+        id, job_id, department_id = row[id_position], row[job_position], row[department_position]
+        if not key_index.employee_exists(id) and key_index.job_exists(job_id) and key_index.department_exists(department_id):
+            checked_rows.append(row)
+            continue
+        exists_error, error_message = validate_key_values(id, job_id, department_id)
+        if exists_error:
+            rejected.append((row_fields(entity, row), error_message))
+        else:
+            checked_rows.append(row)
+    return checked_rows
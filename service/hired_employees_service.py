@@ -1,28 +1,21 @@
 import json
 from typing import List
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date
+from sqlalchemy import Column, Integer, String, Float, Date
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
-import datetime
-import re
-from logger.logger import AzureBlobLogger
+from logger.logger import get_rejected_row_logger
 from models.entities.log_hired_employee import LogHiredEmployees
 from models.request.hired_employees_request_model import HiredEmployeesRequestModel
 from models.response.base_response_model import BaseResponseModel
-from security.keyvault import KeyVaultSecrets
+from service.batch_writer import insert_batch
+from service.engine_registry import get_engine
+from service.idempotency_store import mark_write_failed
+from service.key_index import key_index
+from service.metrics import count_rows, stage
+from service.profiling import profiled
+from service.validation import HIRED_EMPLOYEE_RULES, to_columns, validate_batch
 import pydantic
 
-key_vault_name = "ServicesDbKeyVault"
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-key_vault_secrets = KeyVaultSecrets(vault_url=key_vault_uri)
-
-db_connection = key_vault_secrets.get_secret("DATABASEURI1")
-dl_connection = key_vault_secrets.get_secret("DataCodeDLConnectionString")
-container_name = 'logger'
-
-engine = create_engine(db_connection)
-
 Base = declarative_base()
 
 class HiredEmployees(Base):
@@ -55,24 +48,56 @@ def valitate_hired_employee(hiredEmployee: HiredEmployeesRequestModel) -> bool:
     Returns:
         bool: False if the hired employee data is valid, True otherwise.
     """
-    if hiredEmployee.id is None:
-        return True, "El campo id es requerido"
-    if hiredEmployee.name is None:
-        return True, "El campo name es requerido"
-    if hiredEmployee.dateTime is None:
-        return True,  "El campo dateTime es requerido"
-    if hiredEmployee.departmentId is None:
-        return True, "El campo departmentId es requerido"
-    if hiredEmployee.jobId is None:
-        return True, "El campo jobId es requerido"
-    if not re.match(r'^[a-zA-Z0-9 ]+$', hiredEmployee.name):
-        return True, "El campo name solo puede contener letras y numeros"
-    if not re.match(r'^[0-9 ]+$', hiredEmployee.id):
-        return True, "El campo id solo puede contener numeros"
-    if not re.match(r'^[0-9 ]+$', hiredEmployee.departmentId):
-        return True, "El campo departmentId solo puede contener numeros"
-    if not re.match(r'^[0-9 ]+$', hiredEmployee.jobId):
-        return True, "El campo jobId solo puede contener numeros"
+    errors = validate_batch(to_columns([hiredEmployee], HIRED_EMPLOYEE_RULES), HIRED_EMPLOYEE_RULES)
+    return errors[0] != "", errors[0]
+
+
+def validate_keys(hiredEmployee: HiredEmployeesRequestModel, refresh_catalogs: bool = True) -> bool:
+    """
+    Validates the id, jobId and departmentId of the hired employee against the key index.
+
+    Args:
+        hiredEmployee (HiredEmployeesRequestModel): The hired employee object to be validated.
+        refresh_catalogs (bool): Reload the catalogs from the database when the jobId or departmentId is unknown.
+
+    Returns:
+        bool: False if the keys are valid or can not be checked in memory, True otherwise.
+    """
+    return validate_key_fields(hiredEmployee.id, hiredEmployee.jobId, hiredEmployee.departmentId, refresh_catalogs)
+
+
+def validate_key_fields(id: str, job_id: str, department_id: str, refresh_catalogs: bool = True, check_catalogs: bool = True) -> bool:
+    """
+    Same as validate_keys for the id, jobId and departmentId fields of a hired employee.
+    """
+    try:
+        id = int(id)
+        job_id = int(job_id)
+        department_id = int(department_id)
+    except (TypeError, ValueError):
+        return False, ""
+    return validate_key_values(id, job_id, department_id, refresh_catalogs, check_catalogs)
+
+
+def validate_key_values(id: int, job_id: int, department_id: int, refresh_catalogs: bool = True, check_catalogs: bool = True) -> bool:
+    """
+    Same as validate_keys for the ids of a hired employee already converted to int.
+
+    The catalogs are reloaded when the jobId or departmentId is unknown, unless they were loaded less than
+    catalog_refresh_seconds ago. An unknown id is left to the foreign keys of the database when the catalogs
+    could not be reloaded, and when check_catalogs is False.
+    """
+    if key_index.employee_exists(id):
+        return True, "El id ya existe en la tabla"
+    if not check_catalogs:
+        return False, ""
+    if refresh_catalogs and not (key_index.job_exists(job_id) and key_index.department_exists(department_id)):
+        if not key_index.refresh_catalogs(get_engine()):
+            return False, ""
+    if not key_index.job_exists(job_id):
+        return True, "El job id no existe en el catálogo."
+    if not key_index.department_exists(department_id):
+        return True, "El department id no existe en el catálogo."
     return False, ""
 
 
@@ -90,11 +115,7 @@ def log_invalid_employee(listLogHiredEmployees: List[LogHiredEmployees]) -> Base
     response.Error = False
     response.ErrorMessage = ""
     try:
-        azure_blob_logger = AzureBlobLogger(dl_connection, container_name)
-        timestamp = datetime.datetime.now().isoformat()
-        log_blob_name = f'log_hired_employees_{timestamp}.log'
-        hired_employees_json = '[' + ','.join([emp.model_dump_json() for emp in listLogHiredEmployees]) + ']'
-        azure_blob_logger.log_data(hired_employees_json, log_blob_name)
+        get_rejected_row_logger().log_rows(listLogHiredEmployees, 'log_hired_employees_')
         response.Error = True
         response.ErrorMessage = "El proceso detecto registros invalidos, se genero un log con los registros."
     except Exception as e:
@@ -103,6 +124,7 @@ def log_invalid_employee(listLogHiredEmployees: List[LogHiredEmployees]) -> Base
     return response
 
 
+@profiled
 def insert_hired_employee(listLogHiredEmployees: List[HiredEmployeesRequestModel]) -> BaseResponseModel:
     """
     Inserts a list of hired employees into the database.
@@ -116,49 +138,66 @@ def insert_hired_employee(listLogHiredEmployees: List[HiredEmployeesRequestModel
     """
     response = BaseResponseModel()
     
-    Session = sessionmaker(bind=engine)
-    session = Session()
     log_list : List[LogHiredEmployees] = []
+    valid_employees : List[HiredEmployeesRequestModel] = []
     exists_validation_error = False
     enable_log = False
-    for hiredEmployee in listLogHiredEmployees:
-        exists_validation_error, error_validation_message = valitate_hired_employee(hiredEmployee)
-        if exists_validation_error:
-            log_list = add_employee_to_log(log_list, hiredEmployee, error_validation_message)
-            enable_log = True
-        else:
-            new_employee = HiredEmployees(
-                id=hiredEmployee.id,
-                name=hiredEmployee.name,
-                datetime=hiredEmployee.dateTime,
-                department_id=hiredEmployee.departmentId,
-                job_id=hiredEmployee.jobId
-            )
-
-            try:
-                session.add(new_employee)
+    accepted = 0
+    with stage("validation"):
+        use_key_index = key_index.ensure_loaded(get_engine())
+        validation_errors = validate_batch(to_columns(listLogHiredEmployees, HIRED_EMPLOYEE_RULES), HIRED_EMPLOYEE_RULES)
+        for hiredEmployee, error_validation_message in zip(listLogHiredEmployees, validation_errors):
+            exists_validation_error = error_validation_message != ""
+            if not exists_validation_error and use_key_index:
+                exists_validation_error, error_validation_message = validate_keys(hiredEmployee)
+            if exists_validation_error:
+                log_list = add_employee_to_log(log_list, hiredEmployee, error_validation_message)
+                enable_log = True
+            else:
+                valid_employees.append(hiredEmployee)
+
+    if valid_employees:
+        Session = sessionmaker(bind=get_engine())
+        session = Session()
+        try:
+            rows = [
+                {
+                    "id": hiredEmployee.id,
+                    "name": hiredEmployee.name,
+                    "datetime": hiredEmployee.dateTime,
+                    "department_id": hiredEmployee.departmentId,
+                    "job_id": hiredEmployee.jobId
+                }
+                for hiredEmployee in valid_employees
+            ]
+            with stage("db_write"):
+                rejected = insert_batch(session, HiredEmployees.__table__, rows)
                 session.commit()
-                response.Error = False
-                response.ErrorMessage = "Los registros se insertaron correctamente"
-            except IntegrityError as e: 
-                session.rollback()
-                result = set_specific_error_message(str(e.orig))
-                log_list = add_employee_to_log(log_list, hiredEmployee, result.ErrorMessage)
+            rejected_positions = {position for position, error_message in rejected}
+            accepted = len(rows) - len(rejected_positions)
+            key_index.add_employees(row["id"] for position, row in enumerate(rows) if position not in rejected_positions)
+            response.Error = False
+            response.ErrorMessage = "Los registros se insertaron correctamente"
+            for position, error_message in rejected:
+                result = set_specific_error_message(error_message)
+                log_list = add_employee_to_log(log_list, valid_employees[position], result.ErrorMessage)
                 enable_log = True
                 response.Error = result.Error
                 response.ErrorMessage = result.ErrorMessage
-            except Exception as e:
-                session.rollback()
-                enable_log = True
-                response.Error = True
-                response.ErrorMessage = str(e)
-            finally:
-                session.close()
+        except Exception as e:
+            session.rollback()
+            mark_write_failed()
+            enable_log = True
+            response.Error = True
+            response.ErrorMessage = str(e)
+        finally:
+            session.close()
 
     if enable_log:
         log_response = log_invalid_employee(log_list)
         response.Error = log_response.Error
         response.ErrorMessage = log_response.ErrorMessage
+    count_rows(HiredEmployees.__table__.name, accepted, len(listLogHiredEmployees) - accepted)
     return response
     
 def add_employee_to_log(log_list: List[LogHiredEmployees], hiredEmployee: HiredEmployeesRequestModel, error_validation_message: str) -> List[LogHiredEmployees]:
@@ -0,0 +1,204 @@
+import asyncio
+import contextvars
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Optional, Union
+from pydantic import BaseModel
+from models.response.base_response_model import BaseResponseModel
+
+
+# The local SQLite file shared by the workers of the host, a retry may reach any of them.
+IDEMPOTENCY_DB_PATH = os.getenv("IDEMPOTENCY_DB_PATH", "idempotency.db")
+# Seconds a response is replayed for its key.
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 60 * 60)))
+# Keys kept, the oldest are dropped first. The limit is checked every PRUNE_EVERY completed requests.
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "100000"))
+# Seconds after which a request that never finished, e.g. because its worker died, can run again.
+IDEMPOTENCY_PENDING_SECONDS = 300
+# Completed requests between two prunes of the expired keys.
+PRUNE_EVERY = 100
+
+
+class IdempotencyStore:
+    """
+    Keeps the response of every request sent with an Idempotency-Key, so a retry of the same batch gets the
+    stored response instead of running it again.
+
+    A key is claimed before the request runs and completed with its response. A retry that arrives while the
+    first request still runs is told so, and a key sent again with a different body is refused.
+
+    Args:
+        path (str): The SQLite file of the keys.
+        ttl_seconds (int): Seconds a response is kept.
+        max_keys (int): Keys kept at most.
+    """
+    def __init__(self, path=IDEMPOTENCY_DB_PATH, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, max_keys=IDEMPOTENCY_MAX_KEYS):
+        self.ttl_seconds = ttl_seconds
+        self.max_keys = max_keys
+        self.lock = threading.Lock()
+        self.completed = 0
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                scope TEXT, key TEXT, request_hash TEXT, response TEXT, created_at REAL,
+                PRIMARY KEY (scope, key)
+            )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created_at ON idempotency_keys (created_at)")
+
+    def claim(self, scope, key, request_hash) -> Optional[BaseResponseModel]:
+        """
+        Claims the key for a request.
+
+        Returns:
+            BaseResponseModel: None if the request must run, otherwise the response to return instead: the
+            stored one, or an error when the key is in use or was sent with a different body.
+        """
+        now = time.time()
+        with self.lock:
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self.connection.execute(
+                    "SELECT request_hash, response, created_at FROM idempotency_keys WHERE scope = ? AND key = ?", (scope, key)).fetchone()
+                if row is not None and row[2] < now - self.ttl_seconds:
+                    row = None
+                if row is not None and row[1] is None and row[2] < now - IDEMPOTENCY_PENDING_SECONDS:
+                    row = None
+                if row is None:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO idempotency_keys (scope, key, request_hash, response, created_at) VALUES (?, ?, ?, NULL, ?)",
+                        (scope, key, request_hash, now))
+            finally:
+                self.connection.execute("COMMIT")
+        if row is None:
+            return None
+        if row[0] != request_hash:
+            return BaseResponseModel(Error=True, ErrorMessage="La Idempotency-Key ya se uso con otros registros.")
+        if row[1] is None:
+            return BaseResponseModel(Error=True, ErrorMessage="Una solicitud con la misma Idempotency-Key esta en proceso.")
+        return BaseResponseModel.model_validate_json(row[1])
+
+    def complete(self, scope, key, response: BaseResponseModel):
+        with self.lock:
+            self.connection.execute(
+                "UPDATE idempotency_keys SET response = ? WHERE scope = ? AND key = ?", (response.model_dump_json(), scope, key))
+            self.completed += 1
+            if self.completed % PRUNE_EVERY == 0:
+                self.prune()
+
+    def release(self, scope, key):
+        """
+        Forgets a claimed key whose request failed, so the retry runs it.
+        """
+        with self.lock:
+            self.connection.execute("DELETE FROM idempotency_keys WHERE scope = ? AND key = ? AND response IS NULL", (scope, key))
+
+    def prune(self):
+        self.connection.execute("DELETE FROM idempotency_keys WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        self.connection.execute(
+            "DELETE FROM idempotency_keys WHERE created_at <= (SELECT created_at FROM idempotency_keys ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+            (self.max_keys,))
+
+
+idempotency_store_lock = threading.Lock()
+idempotency_store = None
+
+def get_idempotency_store() -> IdempotencyStore:
+    """
+    Returns the store of the idempotency keys, it is created on the first call.
+    """
+    global idempotency_store
+    if idempotency_store is None:
+        with idempotency_store_lock:
+            if idempotency_store is None:
+                idempotency_store = IdempotencyStore()
+    return idempotency_store
+
+
+# The outcome of the insert run by run_idempotent, see mark_write_failed.
+write_outcome: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("write_outcome", default=None)
+
+
+def mark_write_failed():
+    """
+    Called by the insert_* functions when their database write failed and was rolled back. Their response is
+    not stored for the Idempotency-Key, a retry runs the insert again.
+    """
+    outcome = write_outcome.get()
+    if outcome is not None:
+        outcome["failed"] = True
+
+
+def request_hash(request_model: Union[BaseModel, bytes]) -> str:
+    # The v3 endpoints are not parsed into a model, their raw body is hashed.
+    body = request_model if isinstance(request_model, bytes) else request_model.model_dump_json().encode()
+    return hashlib.sha256(body).hexdigest()
+
+
+def run_idempotent(idempotency_key: str, scope: str, request_model: Union[BaseModel, bytes], insert: Callable, *args) -> BaseResponseModel:
+    """
+    Runs insert(*args) once per Idempotency-Key and returns the stored response to the retries, without
+    touching the database or the rejected rows log. Without a key the insert always runs.
+
+    Only the responses of the inserts whose database write finished are stored, rejected rows included. When
+    the write failed, e.g. on a timeout, the key is released so the retry of the client runs the insert again.
+
+    Args:
+        idempotency_key (str): The Idempotency-Key header, None when it was not sent.
+        scope (str): The entity of the endpoint, the v1 and v2 endpoints of an entity share the keys.
+        request_model (Union[BaseModel, bytes]): The body of the request, a key sent again with another body is refused.
+        insert (Callable): The insert_* function of the entity.
+
+    Returns:
+        BaseResponseModel: The response of the insert or the stored one.
+    """
+    if not idempotency_key:
+        return insert(*args)
+    store = get_idempotency_store()
+    stored_response = store.claim(scope, idempotency_key, request_hash(request_model))
+    if stored_response is not None:
+        return stored_response
+    outcome = {"failed": False}
+    token = write_outcome.set(outcome)
+    try:
+        response = insert(*args)
+    except BaseException:
+        store.release(scope, idempotency_key)
+        raise
+    finally:
+        write_outcome.reset(token)
+    if outcome["failed"]:
+        store.release(scope, idempotency_key)
+    else:
+        store.complete(scope, idempotency_key, response)
+    return response
+
+
+async def run_idempotent_async(idempotency_key: str, scope: str, request_model: Union[BaseModel, bytes], insert: Callable, *args) -> BaseResponseModel:
+    """
+    Same as run_idempotent for the insert_*_async functions, the store is read and written in a worker thread.
+    """
+    if not idempotency_key:
+        return await insert(*args)
+    store = get_idempotency_store()
+    stored_response = await asyncio.to_thread(store.claim, scope, idempotency_key, request_hash(request_model))
+    if stored_response is not None:
+        return stored_response
+    outcome = {"failed": False}
+    token = write_outcome.set(outcome)
+    try:
+        response = await insert(*args)
+    except BaseException:
+        await asyncio.to_thread(store.release, scope, idempotency_key)
+        raise
+    finally:
+        write_outcome.reset(token)
+    if outcome["failed"]:
+        await asyncio.to_thread(store.release, scope, idempotency_key)
+    else:
+        await asyncio.to_thread(store.complete, scope, idempotency_key, response)
+    return response
@@ -0,0 +1,226 @@
+import datetime
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+# The local SQLite file where the jobs are kept across restarts.
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+# Jobs running at the same time, every one holds database connections and a blob upload or download.
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "2"))
+# Seconds between the saves of the progress of a running job.
+PROGRESS_SAVE_SECONDS = 1.0
+# Seconds between the renewals of the leases of the running jobs and the checks for the jobs of stopped processes.
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "10"))
+# A running job whose lease was not renewed for this long was left by a stopped process and is queued again.
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", "60"))
+
+JOB_COLUMNS = ["id", "kind", "params", "status", "error", "error_message", "rows_done", "rows_total", "bytes_done", "created_at", "started_at", "finished_at"]
+
+
+# Uvicorn prints this logger, the application has no logging configuration of its own.
+logger = logging.getLogger("uvicorn.error")
+
+
+def now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+class JobProgress:
+    """
+    The rows and bytes processed by a running job, updated by the services from any thread and saved at most
+    every PROGRESS_SAVE_SECONDS.
+    """
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+        self.lock = threading.Lock()
+        self.rows_total = None
+        self.rows_done = 0
+        self.bytes_done = 0
+        self.saved_at = time.monotonic()
+
+    def add_total(self, rows):
+        with self.lock:
+            self.rows_total = (self.rows_total or 0) + rows
+        self.save()
+
+    def add(self, rows=0, bytes_done=0):
+        with self.lock:
+            self.rows_done += rows
+            self.bytes_done += bytes_done
+            if time.monotonic() - self.saved_at < PROGRESS_SAVE_SECONDS:
+                return
+        self.save()
+
+    def track(self, records, bytes_read, every=1000):
+        """
+        Yields the records, adding them and the bytes read to the progress every `every` records.
+
+        Args:
+            records: The records being restored.
+            bytes_read (Callable): Returns the bytes read so far, including the header read before the first record.
+            every (int): The records between updates.
+        """
+        rows = 0
+        reported_bytes = 0
+        for record in records:
+            yield record
+            rows += 1
+            if rows == every:
+                self.add(rows, bytes_read() - reported_bytes)
+                rows = 0
+                reported_bytes = bytes_read()
+        self.add(rows, bytes_read() - reported_bytes)
+
+    def save(self):
+        with self.lock:
+            self.saved_at = time.monotonic()
+            values = {"rows_done": self.rows_done, "rows_total": self.rows_total, "bytes_done": self.bytes_done}
+        self.runner.update(self.job_id, **values)
+
+
+class JobRunner:
+    """
+    Runs the backups and restores in the background on a bounded pool of worker threads.
+
+    Every job is kept in a local SQLite file with its parameters, status and progress, shared by the worker
+    processes. A job runs in the process that claims it, the one that changes its status from queued to
+    running, and that process renews the lease of the job every JOB_HEARTBEAT_SECONDS while it runs. The
+    running jobs whose lease expired were left by a stopped process and are queued again by resume(), a backup
+    or a restore can be run again from the start.
+
+    Args:
+        functions (dict): The function of every kind of job, called with the job parameters and its
+            JobProgress and returning a BaseResponseModel.
+        path (str): The SQLite file of the jobs.
+        workers (int): The jobs that run at the same time.
+    """
+    def __init__(self, functions, path=JOBS_DB_PATH, workers=JOB_WORKERS):
+        self.functions = functions
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, kind TEXT, params TEXT, status TEXT, error INTEGER, error_message TEXT,
+                rows_done INTEGER, rows_total INTEGER, bytes_done INTEGER,
+                created_at TEXT, started_at TEXT, finished_at TEXT, owner TEXT, heartbeat_at REAL
+            )""")
+        columns = {row[1] for row in self.connection.execute("PRAGMA table_info(jobs)")}
+        for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+            if column not in columns:
+                try:
+                    self.connection.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                except sqlite3.OperationalError:
+                    # Another worker process added it first.
+                    pass
+        # Identifies the jobs run by this runner in the shared file.
+        self.owner = uuid.uuid4().hex
+        # The jobs waiting in the queue of the executor, resume() does not submit them twice.
+        self.queued = set()
+        # Set by shutdown(), it stops the renewals of the leases and the resumes.
+        self.stopped = threading.Event()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="job")
+        self.heartbeat_thread = threading.Thread(target=self.keep_alive, name="job-heartbeat", daemon=True)
+        self.heartbeat_thread.start()
+
+    def submit(self, kind, params) -> str:
+        """
+        Queues a job and returns its id at once.
+        """
+        job_id = uuid.uuid4().hex
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO jobs (id, kind, params, status, rows_done, bytes_done, created_at) VALUES (?, ?, ?, 'queued', 0, 0, ?)",
+                (job_id, kind, json.dumps(params), now()))
+            self.queued.add(job_id)
+        self.executor.submit(self.run, job_id)
+        return job_id
+
+    def resume(self):
+        """
+        Queues again the running jobs whose lease expired and submits the queued jobs that are not waiting in
+        this runner yet. The jobs submitted by several processes run in the one that claims them first.
+        """
+        with self.lock:
+            self.connection.execute(
+                "UPDATE jobs SET status = 'queued', owner = NULL, rows_done = 0, rows_total = NULL, bytes_done = 0 "
+                "WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)",
+                (time.time() - JOB_LEASE_SECONDS,))
+            job_ids = [row[0] for row in self.connection.execute("SELECT id FROM jobs WHERE status = 'queued' ORDER BY created_at") if row[0] not in self.queued]
+            self.queued.update(job_ids)
+        for job_id in job_ids:
+            self.executor.submit(self.run, job_id)
+
+    def keep_alive(self):
+        """
+        Renews the leases of the jobs running in this runner and resumes the jobs of stopped processes, every
+        JOB_HEARTBEAT_SECONDS until shutdown() is called.
+        """
+        while not self.stopped.wait(JOB_HEARTBEAT_SECONDS):
+            try:
+                with self.lock:
+                    self.connection.execute("UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'", (time.time(), self.owner))
+                self.resume()
+            except Exception as e:
+                logger.warning("The job leases could not be renewed: %s", e)
+
+    def claim(self, job_id) -> bool:
+        """
+        Marks the job as running in this runner, False when it is no longer queued: another process claimed it.
+        """
+        with self.lock:
+            self.queued.discard(job_id)
+            cursor = self.connection.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, heartbeat_at = ?, started_at = ? WHERE id = ? AND status = 'queued'",
+                (self.owner, time.time(), now(), job_id))
+        return cursor.rowcount == 1
+
+    def run(self, job_id):
+        if not self.claim(job_id):
+            return
+        job = self.get(job_id)
+        progress = JobProgress(self, job_id)
+        try:
+            response = self.functions[job["kind"]](json.loads(job["params"]), progress)
+            error, error_message = bool(response.Error), response.ErrorMessage
+        except Exception as e:
+            error, error_message = True, str(e)
+        progress.save()
+        self.update(job_id, status="failed" if error else "succeeded", error=error, error_message=error_message, finished_at=now())
+
+    def update(self, job_id, **values):
+        assignments = ", ".join(f"{column} = ?" for column in values)
+        with self.lock:
+            self.connection.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*values.values(), job_id))
+
+    def get(self, job_id) -> dict:
+        """
+        Returns the job as a dict of its columns, None when it does not exist.
+        """
+        with self.lock:
+            row = self.connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return None if row is None else dict(zip(JOB_COLUMNS, row))
+
+    def list(self, limit=50) -> list:
+        """
+        Returns the last jobs, newest first.
+        """
+        with self.lock:
+            rows = self.connection.execute(f"SELECT {', '.join(JOB_COLUMNS)} FROM jobs ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [dict(zip(JOB_COLUMNS, row)) for row in rows]
+
+    def shutdown(self):
+        """
+        Stops taking queued jobs, they run again after the restart, and stops renewing the leases. The process
+        exits once the running ones finish, a job still running when its lease expires is run again by another
+        process.
+        """
+        self.stopped.set()
+        self.heartbeat_thread.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
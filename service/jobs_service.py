@@ -1,26 +1,17 @@
 from typing import List
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date
+from sqlalchemy import Column, Integer, String, Float, Date
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import IntegrityError
-import datetime
-import re
-from logger.logger import AzureBlobLogger
+from logger.logger import get_rejected_row_logger
 from models.entities.log_jobs import LogJobs
 from models.request.jobs_request_model import JobRequestModel
 from models.response.base_response_model import BaseResponseModel
-from security.keyvault import KeyVaultSecrets
-
-
-key_vault_name = "ServicesDbKeyVault"
-key_vault_uri = f"https://{key_vault_name}.vault.azure.net/"
-key_vault_secrets = KeyVaultSecrets(vault_url=key_vault_uri)
-
-db_connection = key_vault_secrets.get_secret("DATABASEURI1")
-dl_connection = key_vault_secrets.get_secret("DataCodeDLConnectionString")
-container_name = 'logger'
-
-engine = create_engine(db_connection)
+from service.batch_writer import insert_batch
+from service.engine_registry import get_engine
+from service.idempotency_store import mark_write_failed
+from service.key_index import key_index
+from service.metrics import count_rows, stage
+from service.validation import JOB_RULES, to_columns, validate_batch
 
 Base = declarative_base()
 
@@ -48,17 +39,8 @@ def valitate_jobs(job: JobRequestModel) -> bool:
     Returns:
         bool: False if the hired employee data is valid, True otherwise.
     """
-    if job.id is None:
-        return True, "El campo id es requerido"
-    if job.job is None:
-        return True, "El campo job es requerido"
-    
-    if not re.match(r'^[a-zA-Z0-9 ]+$', job.job):
-        return True, "El campo job solo puede contener letras y numeros"
-    if not re.match(r'^[0-9 ]+$', job.id):
-        return True, "El campo id solo puede contener numeros"
-    
-    return False, ""
+    errors = validate_batch(to_columns([job], JOB_RULES), JOB_RULES)
+    return errors[0] != "", errors[0]
 
 
 def log_invalid_jobs(listLogJobs: List[LogJobs]) -> BaseResponseModel:
@@ -75,11 +57,7 @@ def log_invalid_jobs(listLogJobs: List[LogJobs]) -> BaseResponseModel:
     response.Error = False
     response.ErrorMessage = ""
     try:
-        azure_blob_logger = AzureBlobLogger(dl_connection, container_name)
-        timestamp = datetime.datetime.now().isoformat()
-        log_blob_name = f'jobs_{timestamp}.log'
-        jobs_json = '[' + ','.join([job.model_dump_json() for job in listLogJobs]) + ']'
-        azure_blob_logger.log_data(jobs_json, log_blob_name)
+        get_rejected_row_logger().log_rows(listLogJobs, 'jobs_')
         response.Error = True
         response.ErrorMessage = "El proceso detecto registros invalidos, se genero un log con los registros."
     except Exception as e:
@@ -101,46 +79,60 @@ def insert_jobs(listLogJobs: List[JobRequestModel]) -> BaseResponseModel:
     """
     response = BaseResponseModel()
     
-    Session = sessionmaker(bind=engine)
-    session = Session()
     log_list : List[LogJobs] = []
+    valid_jobs : List[JobRequestModel] = []
     exists_validation_error = False
     enable_log = False
-    for job in listLogJobs:
-        exists_validation_error, error_validation_message = valitate_jobs(job)
-        if exists_validation_error:
-            log_list = add_job_to_log(log_list, job, error_validation_message)
-            enable_log = True
-        else:
-            new_job = Jobs(
-                id=job.id,
-                job=job.job,
-            )
-
-            try:
-                session.add(new_job)
+    accepted = 0
+    with stage("validation"):
+        validation_errors = validate_batch(to_columns(listLogJobs, JOB_RULES), JOB_RULES)
+        for job, error_validation_message in zip(listLogJobs, validation_errors):
+            exists_validation_error = error_validation_message != ""
+            if exists_validation_error:
+                log_list = add_job_to_log(log_list, job, error_validation_message)
+                enable_log = True
+            else:
+                valid_jobs.append(job)
+
+    if valid_jobs:
+        Session = sessionmaker(bind=get_engine())
+        session = Session()
+        try:
+            rows = [
+                {
+                    "id": job.id,
+                    "job": job.job
+                }
+                for job in valid_jobs
+            ]
+            with stage("db_write"):
+                rejected = insert_batch(session, Jobs.__table__, rows)
                 session.commit()
-                response.Error = False
-                response.ErrorMessage = "Los registros se insertaron correctamente"
-            except IntegrityError as e: 
-                session.rollback()
-                result = set_specific_error_message(str(e.orig))
-                log_list = add_job_to_log(log_list, job, result.ErrorMessage)
+            rejected_positions = {position for position, error_message in rejected}
+            accepted = len(rows) - len(rejected_positions)
+            key_index.add_jobs(row["id"] for position, row in enumerate(rows) if position not in rejected_positions)
+            response.Error = False
+            response.ErrorMessage = "Los registros se insertaron correctamente"
+            for position, error_message in rejected:
+                result = set_specific_error_message(error_message)
+                log_list = add_job_to_log(log_list, valid_jobs[position], result.ErrorMessage)
                 enable_log = True
                 response.Error = result.Error
                 response.ErrorMessage = result.ErrorMessage
-            except Exception as e:
-                session.rollback()
-                enable_log = True
-                response.Error = True
-                response.ErrorMessage = str(e)
-            finally:
-                session.close()
+        except Exception as e:
+            session.rollback()
+            mark_write_failed()
+            enable_log = True
+            response.Error = True
+            response.ErrorMessage = str(e)
+        finally:
+            session.close()
 
     if enable_log:
         log_response = log_invalid_jobs(log_list)
         response.Error = log_response.Error
         response.ErrorMessage = log_response.ErrorMessage
+    count_rows(Jobs.__table__.name, accepted, len(listLogJobs) - accepted)
     return response
     
 def add_job_to_log(log_list: List[LogJobs], job: JobRequestModel, error_validation_message: str) -> List[LogJobs]:
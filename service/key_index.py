@@ -0,0 +1,232 @@
+import asyncio
+import bisect
+import threading
+import time
+from array import array
+from typing import Iterable
+from sqlalchemy import text
+
+
+class KeyIndex:
+    """
+    A process-local index of the keys needed to pre-validate hired employees without a database round trip.
+
+    It keeps the job and department ids as sets and the hired employee ids as a sorted array of 64 bit
+    integers. Ids written by this process are kept in small sets of recent ids as soon as they are
+    committed, and the whole index is reloaded when the ttl expires or after invalidate() is called. Only one
+    caller reloads it at a time, the others keep using the previous snapshot meanwhile.
+
+    Args:
+        ttl_seconds (int): The seconds after which the index is reloaded from the database.
+        catalog_refresh_seconds (int): The seconds the catalogs are taken as complete after they were loaded, and
+            the minimum seconds between catalog reloads triggered by an unknown id.
+    """
+    def __init__(self, ttl_seconds=300, catalog_refresh_seconds=5):
+        self.ttl_seconds = ttl_seconds
+        self.catalog_refresh_seconds = catalog_refresh_seconds
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.reloading = False
+        self.invalidate()
+
+    def ensure_loaded(self, engine) -> bool:
+        """
+        Loads the index if it was never loaded, was invalidated or the ttl expired. While another caller loads
+        it the previous snapshot is used, or none after an invalidate().
+
+        Returns:
+            bool: True if the index can be used, False if it could not be loaded.
+        """
+        loaded_at = self.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds:
+            return True
+        if not self.claim_reload():
+            return loaded_at is not None
+        try:
+            self.refresh(engine)
+        except Exception:
+            return False
+        finally:
+            self.reloading = False
+        return True
+
+    def refresh(self, engine):
+        """
+        Reloads the job, department and hired employee ids from the database.
+        """
+        generation = self.generation
+        with engine.connect() as conn:
+            snapshot = read_snapshot(conn)
+        self.set_snapshot(generation, *snapshot)
+
+    async def ensure_loaded_async(self, engine) -> bool:
+        """
+        Same as ensure_loaded for an AsyncEngine.
+        """
+        loaded_at = self.loaded_at
+        if loaded_at is not None and time.monotonic() - loaded_at < self.ttl_seconds:
+            return True
+        if not self.claim_reload():
+            return loaded_at is not None
+        generation = self.generation
+        try:
+            async with engine.connect() as conn:
+                snapshot = await read_snapshot_async(conn)
+        except Exception:
+            return False
+        finally:
+            self.reloading = False
+        self.set_snapshot(generation, *snapshot)
+        return True
+
+    def claim_reload(self) -> bool:
+        with self.lock:
+            if self.reloading:
+                return False
+            self.reloading = True
+            return True
+
+    def set_snapshot(self, generation, job_ids, department_ids, employee_ids):
+        with self.lock:
+            # Recent ids that are not in the snapshot were committed while it was being read.
+            self.job_ids = job_ids
+            self.recent_job_ids = self.recent_job_ids - job_ids
+            self.department_ids = department_ids
+            self.recent_department_ids = self.recent_department_ids - department_ids
+            self.employee_ids = employee_ids
+            self.recent_employee_ids = {id for id in self.recent_employee_ids if not _contains(employee_ids, id)}
+            # A snapshot read before an invalidate() may be stale, so it is only used until the next check.
+            if generation == self.generation:
+                self.loaded_at = self.catalog_loaded_at = time.monotonic()
+
+    def refresh_catalogs(self, engine) -> bool:
+        """
+        Reloads the job and department ids unless they were loaded less than catalog_refresh_seconds ago. A
+        reload that fails is not tried again for catalog_refresh_seconds.
+
+        Returns:
+            bool: True if the catalogs are complete, an unknown id does not exist, False if they could not be
+            reloaded and an unknown id has to be checked by the database.
+        """
+        if self.catalogs_current():
+            return True
+        if not self.claim_catalog_refresh():
+            return False
+        generation = self.generation
+        try:
+            with engine.connect() as conn:
+                catalogs = read_catalogs(conn)
+        except Exception:
+            return False
+        return self.set_catalogs(generation, *catalogs)
+
+    async def refresh_catalogs_async(self, engine) -> bool:
+        """
+        Same as refresh_catalogs for an AsyncEngine.
+        """
+        if self.catalogs_current():
+            return True
+        if not self.claim_catalog_refresh():
+            return False
+        generation = self.generation
+        try:
+            async with engine.connect() as conn:
+                catalogs = await conn.run_sync(read_catalogs)
+        except Exception:
+            return False
+        return self.set_catalogs(generation, *catalogs)
+
+    def catalogs_current(self) -> bool:
+        catalog_loaded_at = self.catalog_loaded_at
+        return catalog_loaded_at is not None and time.monotonic() - catalog_loaded_at < self.catalog_refresh_seconds
+
+    def claim_catalog_refresh(self) -> bool:
+        with self.lock:
+            if self.catalog_refreshed_at is not None and time.monotonic() - self.catalog_refreshed_at < self.catalog_refresh_seconds:
+                return False
+            self.catalog_refreshed_at = time.monotonic()
+            return True
+
+    def set_catalogs(self, generation, job_ids, department_ids) -> bool:
+        """
+        Returns:
+            bool: False if the index was invalidated while the catalogs were being read, they may be stale.
+        """
+        with self.lock:
+            self.job_ids = job_ids
+            self.recent_job_ids = self.recent_job_ids - job_ids
+            self.department_ids = department_ids
+            self.recent_department_ids = self.recent_department_ids - department_ids
+            if generation != self.generation:
+                return False
+            self.catalog_loaded_at = time.monotonic()
+            return True
+
+    def invalidate(self):
+        """
+        Drops the index so the next use reloads it, e.g. after a table was restored.
+        """
+        with self.lock:
+            self.generation += 1
+            self.job_ids = set()
+            self.recent_job_ids = set()
+            self.department_ids = set()
+            self.recent_department_ids = set()
+            self.employee_ids = array('q')
+            self.recent_employee_ids = set()
+            self.loaded_at = self.catalog_loaded_at = self.catalog_refreshed_at = None
+
+    def add_jobs(self, ids: Iterable):
+        with self.lock:
+            self.recent_job_ids.update(int(id) for id in ids)
+
+    def add_departments(self, ids: Iterable):
+        with self.lock:
+            self.recent_department_ids.update(int(id) for id in ids)
+
+    def add_employees(self, ids: Iterable):
+        with self.lock:
+            self.recent_employee_ids.update(int(id) for id in ids)
+
+    def job_exists(self, id: int) -> bool:
+        return id in self.job_ids or id in self.recent_job_ids
+
+    def department_exists(self, id: int) -> bool:
+        return id in self.department_ids or id in self.recent_department_ids
+
+    def employee_exists(self, id: int) -> bool:
+        return id in self.recent_employee_ids or _contains(self.employee_ids, id)
+
+
+JOB_IDS = text("SELECT id FROM jobs")
+DEPARTMENT_IDS = text("SELECT id FROM departments")
+EMPLOYEE_IDS = text("SELECT id FROM hired_employees ORDER BY id")
+
+
+def read_catalogs(conn):
+    return {row[0] for row in conn.execute(JOB_IDS)}, {row[0] for row in conn.execute(DEPARTMENT_IDS)}
+
+
+def read_snapshot(conn):
+    return build_snapshot(conn.execute(JOB_IDS), conn.execute(DEPARTMENT_IDS), conn.execute(EMPLOYEE_IDS))
+
+
+async def read_snapshot_async(conn):
+    """
+    Same as read_snapshot for an AsyncConnection. The rows are fetched on the event loop and the index is
+    built from them in a thread, it takes a while for a large hired_employees table.
+    """
+    results = [await conn.execute(query) for query in (JOB_IDS, DEPARTMENT_IDS, EMPLOYEE_IDS)]
+    return await asyncio.to_thread(build_snapshot, *results)
+
+
+def build_snapshot(job_rows, department_rows, employee_rows):
+    return {row[0] for row in job_rows}, {row[0] for row in department_rows}, array('q', (row[0] for row in employee_rows))
+
+
+def _contains(sorted_ids: array, id: int) -> bool:
+    position = bisect.bisect_left(sorted_ids, id)
+    return position < len(sorted_ids) and sorted_ids[position] == id
+
+
+key_index = KeyIndex()
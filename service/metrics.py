@@ -0,0 +1,233 @@
+import contextvars
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from service.engine_registry import pool_stats
+
+
+# Upper bounds in seconds of the buckets of the latency histograms.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+# The endpoint label of the stages that run outside a request: jobs, the blob logger thread.
+BACKGROUND_ENDPOINT = "background"
+
+HELP = {
+    "datacode_requests_total": ("counter", "Requests served by endpoint, method and status code."),
+    "datacode_request_seconds": ("histogram", "Latency of the requests by endpoint and method."),
+    "datacode_stage_seconds": ("histogram", "Latency of the stages of the requests and jobs by endpoint and stage."),
+    "datacode_rows_total": ("counter", "Rows received by the load endpoints by table and outcome, accepted or rejected."),
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """
+    The count of the observations per bucket, their sum and their number.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Keeps the counters and latency histograms of the process and renders them in the Prometheus text format.
+
+    A series is a metric name and its labels. Recording takes a lock and a dictionary lookup, the text is only
+    built when /metrics is scraped. Every uvicorn worker keeps its own series, Prometheus adds them up by the
+    instance label of every worker.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[Tuple[str, Labels], float] = {}
+        self.histograms: Dict[Tuple[str, Labels], Histogram] = {}
+
+    def increment(self, name: str, labels: Labels, amount: float = 1):
+        with self.lock:
+            self.counters[name, labels] = self.counters.get((name, labels), 0) + amount
+
+    def observe(self, name: str, labels: Labels, seconds: float):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self) -> str:
+        """
+        Returns the series in the Prometheus text exposition format, the pool statistics included.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(histogram.counts), histogram.sum, histogram.count, histogram.buckets)) for key, histogram in self.histograms.items())
+        lines = []
+        described = set()
+
+        def describe(name):
+            if name not in described and name in HELP:
+                described.add(name)
+                metric_type, help_text = HELP[name]
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {metric_type}")
+
+        for (name, labels), value in counters:
+            describe(name)
+            lines.append(f"{name}{format_labels(labels)} {format_value(value)}")
+        for (name, labels), (counts, total, count, buckets) in histograms:
+            describe(name)
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', format_value(bound)),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {format_value(total)}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        lines.extend(render_pool_stats())
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+
+def format_labels(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in labels) + "}"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def render_pool_stats() -> List[str]:
+    """
+    Returns the state of the database pools of pool_stats as gauges and counters.
+    """
+    series = [
+        ("datacode_pool_size", "gauge", "Connections kept by the pool.", "size", None),
+        ("datacode_pool_checked_out", "gauge", "Connections in use.", "checkedOut", None),
+        ("datacode_pool_overflow", "gauge", "Connections opened over the pool size.", "overflow", None),
+        ("datacode_pool_checkouts_total", "counter", "Connections handed out by the pool.", "checkouts", None),
+        ("datacode_pool_timeouts_total", "counter", "Checkouts that gave up waiting for a connection.", "timeouts", None),
+        ("datacode_pool_wait_seconds_max", "gauge", "Longest wait for a connection.", "waitMsMax", 0.001),
+    ]
+    pools = pool_stats()
+    lines = []
+    for name, metric_type, help_text, key, scale in series:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for pool in pools:
+            if key in pool:
+                labels = (("engine", pool["engine"]), ("async", str(pool["async"]).lower()))
+                lines.append(f"{name}{format_labels(labels)} {format_value(pool[key] if scale is None else pool[key] * scale)}")
+    return lines
+
+
+# The stages of the current request, recorded with the endpoint label once the route is known.
+request_stages: contextvars.ContextVar[Optional[List[Tuple[str, float]]]] = contextvars.ContextVar("request_stages", default=None)
+
+
+def record_stage(name: str, seconds: float):
+    stages = request_stages.get()
+    if stages is None:
+        metrics.observe("datacode_stage_seconds", (("endpoint", BACKGROUND_ENDPOINT), ("stage", name)), seconds)
+    else:
+        stages.append((name, seconds))
+
+
+@contextmanager
+def stage(name: str):
+    """
+    Records the time spent in the block as the stage of the current request, or of the background when it
+    does not run in a request.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+class TimedIterator:
+    """
+    Iterates over the iterable and adds up in seconds the time spent waiting for its items.
+    """
+    def __init__(self, iterable: Iterable):
+        self.iterator = iter(iterable)
+        self.seconds = 0.0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        started = time.perf_counter()
+        try:
+            return next(self.iterator)
+        finally:
+            self.seconds += time.perf_counter() - started
+
+
+def in_current_context(function: Callable) -> Callable:
+    """
+    Wraps the function to run in a copy of the caller's context, so the stages recorded by the threads of an
+    executor are added to the request that started them.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(function, *args, **kwargs)
+
+
+def count_rows(table_name: str, accepted: int, rejected: int):
+    if accepted:
+        metrics.increment("datacode_rows_total", (("table", table_name), ("outcome", "accepted")), accepted)
+    if rejected:
+        metrics.increment("datacode_rows_total", (("table", table_name), ("outcome", "rejected")), rejected)
+
+
+class MetricsMiddleware:
+    """
+    Counts the requests and records their latency and the latency of their stages by route template, the
+    same label for every id in the path. Requests that match no route are labelled unmatched.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stages = []
+        token = request_stages.set(stages)
+        started = time.perf_counter()
+        status_code = 500
+
+        async def send_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            request_stages.reset(token)
+            route = scope.get("route")
+            endpoint = getattr(route, "path", "unmatched")
+            method = scope["method"]
+            metrics.observe("datacode_request_seconds", (("endpoint", endpoint), ("method", method)), time.perf_counter() - started)
+            metrics.increment("datacode_requests_total", (("endpoint", endpoint), ("method", method), ("status", str(status_code))))
+            for name, seconds in stages:
+                metrics.observe("datacode_stage_seconds", (("endpoint", endpoint), ("stage", name)), seconds)
@@ -0,0 +1,57 @@
+import datetime
+import os
+from itertools import islice
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import BigInteger
+
+
+# Rows of a Parquet row group, the unit a reader skips with the column statistics and the restore reads at a time.
+PARQUET_ROW_GROUP_SIZE = 100000
+# The Parquet column compression: none, snappy, gzip, brotli, lz4 or zstd.
+PARQUET_COMPRESSION = os.getenv("PARQUET_COMPRESSION", "zstd")
+
+
+def arrow_schema(table) -> pa.Schema:
+    """
+    Returns the Arrow schema of the reflected table, every column is nullable.
+    """
+    fields = []
+    for column in table.columns:
+        if isinstance(column.type, BigInteger):
+            arrow_type = pa.int64()
+        elif column.type.python_type is int:
+            arrow_type = pa.int32()
+        elif column.type.python_type is float:
+            arrow_type = pa.float64()
+        elif column.type.python_type is bool:
+            arrow_type = pa.bool_()
+        elif column.type.python_type is datetime.datetime:
+            arrow_type = pa.timestamp('ms')
+        elif column.type.python_type is datetime.date:
+            arrow_type = pa.date32()
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def write_parquet(file, table, rows, compression=PARQUET_COMPRESSION):
+    """
+    Writes the rows to the file in row groups of PARQUET_ROW_GROUP_SIZE rows with the min/max statistics of
+    every column, one row group in memory at a time.
+    """
+    schema = arrow_schema(table)
+    rows = iter(rows)
+    with pq.ParquetWriter(file, schema, compression=compression, write_statistics=True) as parquet_writer:
+        while row_group := [dict(row) for row in islice(rows, PARQUET_ROW_GROUP_SIZE)]:
+            parquet_writer.write_table(pa.Table.from_pylist(row_group, schema=schema), row_group_size=PARQUET_ROW_GROUP_SIZE)
+
+
+def read_parquet(file):
+    """
+    Yields the records of the Parquet file, one row group in memory at a time.
+    """
+    parquet_file = pq.ParquetFile(file)
+    for row_group in range(parquet_file.num_row_groups):
+        yield from parquet_file.read_row_group(row_group).to_pylist()
@@ -0,0 +1,99 @@
+import contextvars
+import cProfile
+import datetime
+import functools
+import hmac
+import io
+import logging
+import os
+import pstats
+import random
+import threading
+from typing import Callable
+
+
+# The value of the X-Profile header that profiles a request, the header is ignored when it is not set.
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# Share of the calls of the profiled functions that are profiled without the header, 0.01 is one in a hundred.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# The directory of the .prof files, they open with pstats or snakeviz.
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+# Functions listed in the summary written to the log.
+PROFILE_TOP_N = int(os.getenv("PROFILE_TOP_N", "20"))
+PROFILE_HEADER = "x-profile"
+
+# Without a token or a sample rate the functions are not wrapped at all.
+PROFILING_ENABLED = bool(PROFILE_TOKEN) or PROFILE_SAMPLE_RATE > 0
+
+# Uvicorn prints this logger, the application has no logging configuration of its own.
+logger = logging.getLogger("uvicorn.error")
+
+# True while a request sent with a valid X-Profile header runs.
+profile_requested: contextvars.ContextVar[bool] = contextvars.ContextVar("profile_requested", default=False)
+# The profiler can only be enabled once at a time, the calls that find it busy run unprofiled.
+profiler_lock = threading.Lock()
+
+
+def profiled(function: Callable) -> Callable:
+    """
+    Profiles the calls of the function with cProfile when the request asked for it with the X-Profile header,
+    or one call in 1 / PROFILE_SAMPLE_RATE.
+
+    The profile of a call is written to {PROFILE_DIR}/{function}-{time}-{pid}.prof and the PROFILE_TOP_N
+    functions with the highest cumulative time to the log. Only the thread of the call is profiled, not the
+    workers of its thread pools. When profiling is not configured the function is returned as it is.
+    """
+    if not PROFILING_ENABLED:
+        return function
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        if not (profile_requested.get() or random.random() < PROFILE_SAMPLE_RATE):
+            return function(*args, **kwargs)
+        if not profiler_lock.acquire(blocking=False):
+            return function(*args, **kwargs)
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(function, *args, **kwargs)
+        finally:
+            profiler_lock.release()
+            write_profile(function.__qualname__, profiler)
+
+    return wrapper
+
+
+def write_profile(name: str, profiler: cProfile.Profile):
+    """
+    Writes the profile to PROFILE_DIR and its top functions to the log, a failure is only logged.
+    """
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{name}-{datetime.datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{os.getpid()}.prof")
+        profiler.dump_stats(path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats(pstats.SortKey.CUMULATIVE).print_stats(PROFILE_TOP_N)
+        logger.info("Profile of %s written to %s\n%s", name, path, summary.getvalue())
+    except Exception as e:
+        logger.warning("The profile of %s could not be written: %s", name, e)
+
+
+class ProfilingMiddleware:
+    """
+    Marks the requests sent with the X-Profile header set to PROFILE_TOKEN, the profiled functions they call
+    are profiled. It is only added to the application when PROFILE_TOKEN is set.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.token = PROFILE_TOKEN.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            value = next((value for name, value in scope["headers"] if name == PROFILE_HEADER.encode()), None)
+            if value is not None and hmac.compare_digest(value, self.token):
+                token = profile_requested.set(True)
+                try:
+                    await self.app(scope, receive, send)
+                finally:
+                    profile_requested.reset(token)
+                return
+        await self.app(scope, receive, send)
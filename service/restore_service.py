@@ -1,10 +1,40 @@
 import datetime
-from io import BytesIO
-from sqlalchemy import create_engine, text
-import pandas as pd
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from sqlalchemy import text
+from sqlalchemy.pool import QueuePool
 from azure.storage.blob import BlobServiceClient
 from fastavro import reader
 from models.response.base_response_model import BaseResponseModel
+from service.backup_manifest import chain_manifest_name, entry_files, read_manifest
+from service.blob_streams import open_blob_reader
+from service.engine_registry import get_engine
+from service.key_index import key_index
+from service.metrics import TimedIterator, in_current_context, record_stage
+from service.profiling import profiled
+
+
+# Records sent to the database at a time.
+RESTORE_BATCH_SIZE = 1000
+# Records sent at a time to a table-valued parameter or to the staging table by the bulk restore.
+BULK_RESTORE_BATCH_SIZE = 10000
+# Parts of a backup merged at the same time, every one takes a connection of the pool, at most DB_POOL_SIZE.
+RESTORE_WORKERS = int(os.getenv("RESTORE_WORKERS", "4"))
+
+MERGE_PROCEDURES = {
+    "jobs": text("EXEC upsMergeJobs @id = :id, @job = :job"),
+    "departments": text("EXEC upsMergeDepartments @id = :id, @department = :department"),
+    "hired_employees": text("EXEC upsMergeHiredEmployees @id = :id, @name = :name, @datetime = :datetime, @department_id = :department_id, @job_id = :job_id"),
+}
+
+# The set based procedures and the columns of their table type, in order.
+BULK_MERGE_PROCEDURES = {
+    "jobs": ("upsMergeJobsData", ["id", "job"]),
+    "departments": ("upsMergeDepartmentsData", ["id", "department"]),
+    "hired_employees": ("upsMergeHiredEmployeesData", ["id", "name", "datetime", "department_id", "job_id"]),
+}
 
 class RestoreService:
     """
@@ -14,57 +44,185 @@ class RestoreService:
         connection_string (str): The connection string for the SQL Server.
         container_name (str): The name of the Azure Blob Storage container.
         blob_name (str): The name of the blob file to be restored.
+        progress (JobProgress): Receives the rows to restore and the rows and bytes restored, when the restore runs as a job.
     """
-    def __init__(self, db_connection_string, dl_connection_string, container_name):
+    def __init__(self, db_connection_string, dl_connection_string, container_name, progress=None):
         self.db_connection_string = db_connection_string
         self.dl_connection_string = dl_connection_string
         self.container_name = container_name
+        self.progress = progress
 
-    def restore_table_from_blob(self, table_name) -> BaseResponseModel:
+    @profiled
+    def restore_table_from_blob(self, table_name, bulk=True) -> BaseResponseModel:
         """
         Restores the data from an Avro file in Azure Blob Storage to the specified SQL Server table.
+
+        The bulk restore sends the records in batches to the upsMerge*Data procedures as a table-valued
+        parameter, or on other databases to a staging table that is merged with one UPDATE and one INSERT.
+        Otherwise every record goes through the row procedures upsMergeJobs, upsMergeDepartments and
+        upsMergeHiredEmployees. When the table has an incremental chain the base backup and then every delta
+        are merged in order, in one transaction. A base backup in parts is merged in parallel, every part on
+        its own connection and transaction, and then the deltas.
         
         Args:
             table_name (str): The name of the table where data will be restored.
+            bulk (bool): Whether to use the set based merge.
         """
         response = BaseResponseModel()
         response.Error = False
         response.ErrorMessage = ""
         
         try:
-
-            blob_service_client = BlobServiceClient.from_connection_string(self.dl_connection_string)
-            container_client = blob_service_client.get_container_client(self.container_name)
-            blob_client = container_client.get_blob_client(f'{table_name}.avro')
-            stream = blob_client.download_blob().readall()
-            
-
-            avro_stream = BytesIO(stream)
-            avro_stream.seek(0) 
-
-            records = [record for record in reader(avro_stream)]
-            df = pd.DataFrame(records)
-
-            # Connect to SQL Server and insert data
-            engine = create_engine(self.db_connection_string)
-            with engine.begin() as conn:
-                if table_name == "jobs":
-                    for index, row in df.iterrows():
-                        sql_query = text(f"EXEC upsMergeJobs @id = :param1, @job = :param2")
-                        result = conn.execute(sql_query, {'param1': row['id'], 'param2': row['job']})
-                if table_name == "departments":
-                    for index, row in df.iterrows():
-                        sql_query = text(f"EXEC upsMergeDepartments @id = :param1, @department = :param2")
-                        result = conn.execute(sql_query, {'param1': row['id'], 'param2': row['department']})
-    
-                if table_name == "hired_employees":
-                    for index, row in df.iterrows():
-                        print(row['datetime'])
-                        sql_query = text(f"EXEC upsMergeHiredEmployees @id = :param1, @name = :param2, @datetime = :param3, @department_id = :param4, @job_id = :param5")
-                        result = conn.execute(sql_query, {'param1': row['id'], 'param2': row['name'], 'param3': row['datetime'][0:23], 'param4': row['department_id'], 'param5': row['job_id']})
-                
+            if table_name in MERGE_PROCEDURES:
+                chain = read_manifest(self.get_blob_client(chain_manifest_name(table_name)))
+                if chain is None:
+                    base_files = [f'{table_name}.avro']
+                    delta_files = []
+                else:
+                    base = chain["base"]
+                    base_files = entry_files(base)
+                    delta_files = [delta["file"] for delta in chain["deltas"]]
+                    if self.progress is not None:
+                        self.progress.add_total(base["rows"] + sum(delta["rows"] for delta in chain["deltas"]))
+                engine = get_engine(self.db_connection_string)
+                if len(base_files) > 1:
+                    workers = restore_workers(engine, len(base_files))
+                    with ThreadPoolExecutor(max_workers=workers) as executor:
+                        list(executor.map(in_current_context(lambda blob_name: self.restore_files(engine, table_name, [blob_name], bulk)), base_files))
+                    self.restore_files(engine, table_name, delta_files, bulk)
+                else:
+                    self.restore_files(engine, table_name, base_files + delta_files, bulk)
         except Exception as e:
             response.Error = True
             response.ErrorMessage = str(e)
+        finally:
+            # The restore rewrites the tables, the key index has to be reloaded.
+            key_index.invalidate()
 
         return response
+
+    def restore_files(self, engine, table_name, blob_names, bulk):
+        """
+        Merges the Avro files into the table in order, in one transaction.
+        """
+        with engine.begin() as conn:
+            for blob_name in blob_names:
+                started = time.perf_counter()
+                with open_blob_reader(self.get_blob_client(blob_name)) as stream:
+                    records = decoded = TimedIterator(map(to_database_values, read_records(stream, blob_name)))
+                    # The header of the file is read when the reader is opened.
+                    decoded.seconds = time.perf_counter() - started
+                    if self.progress is not None:
+                        records = self.progress.track(records, lambda: stream.raw.bytes_read)
+                    if table_name == "hired_employees":
+                        records = map(trim_datetime, records)
+                    if not bulk:
+                        merge_rows(conn, table_name, records)
+                    elif conn.dialect.name == "mssql":
+                        merge_table_valued(conn, table_name, records)
+                    else:
+                        merge_staging(conn, table_name, records)
+                # The records are downloaded, decoded and merged in turns, the merge is the rest of the time.
+                record_stage("restore_download", stream.raw.download_seconds)
+                record_stage("restore_decode", decoded.seconds - stream.raw.download_seconds)
+                record_stage("restore_write", time.perf_counter() - started - decoded.seconds)
+
+    def get_blob_client(self, blob_name):
+        blob_service_client = BlobServiceClient.from_connection_string(self.dl_connection_string)
+        container_client = blob_service_client.get_container_client(self.container_name)
+        return container_client.get_blob_client(blob_name)
+
+
+def restore_workers(engine, parts) -> int:
+    """
+    Returns the parts merged at the same time: RESTORE_WORKERS, no more than the parts and the connections
+    kept by the pool of the engine, so the restore does not take the overflow connections of the requests.
+    """
+    if engine.dialect.name == "sqlite":
+        # SQLite has a single writer, the parts would wait on each other's transaction.
+        return 1
+    pool_size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    return max(1, min(RESTORE_WORKERS, pool_size, parts))
+
+
+def read_records(stream, blob_name):
+    """
+    Returns the records of an Avro or, by its extension, a Parquet backup file.
+    """
+    if blob_name.endswith(".parquet"):
+        # pyarrow is only loaded by the Parquet restores, it adds a tenth of a second to the startup.
+        from service import parquet_files
+        return parquet_files.read_parquet(stream)
+    return reader(stream)
+
+
+def to_database_values(record):
+    """
+    Converts the UTC datetimes read from timestamp-millis columns back to the naive datetimes of the database.
+    """
+    for column, value in record.items():
+        if isinstance(value, datetime.datetime) and value.tzinfo is not None:
+            record[column] = value.replace(tzinfo=None)
+    return record
+
+
+def trim_datetime(record):
+    """
+    The hired employees procedures take the datetime as a varchar(23), older backups stored it as an ISO string.
+    """
+    if isinstance(record['datetime'], datetime.datetime):
+        record['datetime'] = record['datetime'].isoformat(timespec='milliseconds')
+    elif record['datetime'] is not None:
+        record['datetime'] = record['datetime'][0:23]
+    return record
+
+
+def merge_rows(conn, table_name, records):
+    """
+    Merges the records one at a time with the row procedure of the table.
+    """
+    for batch in batches(records, RESTORE_BATCH_SIZE):
+        conn.execute(MERGE_PROCEDURES[table_name], batch)
+
+
+def merge_table_valued(conn, table_name, records):
+    """
+    Merges the records with the set based procedure of the table, a batch at a time as a table-valued parameter.
+    """
+    procedure, columns = BULK_MERGE_PROCEDURES[table_name]
+    for batch in batches(records, BULK_RESTORE_BATCH_SIZE):
+        rows = [tuple(record[column] for column in columns) for record in batch]
+        conn.exec_driver_sql(f"EXEC {procedure} @source = ?", (rows,))
+
+
+def merge_staging(conn, table_name, records):
+    """
+    Loads the records into a temporary staging table and merges it into the table with one UPDATE and one
+    INSERT, the same as the upsMerge*Data procedures on a database without them.
+    """
+    columns = BULK_MERGE_PROCEDURES[table_name][1]
+    quote = conn.dialect.identifier_preparer.quote
+    target = quote(table_name)
+    staging = quote(f"staging_{table_name}")
+    column_list = ", ".join(quote(column) for column in columns)
+
+    conn.execute(text(f"DROP TABLE IF EXISTS {staging}"))
+    conn.execute(text(f"CREATE TEMPORARY TABLE {staging} AS SELECT {column_list} FROM {target} WHERE 1 = 0"))
+    insert_staging = text(f"INSERT INTO {staging} ({column_list}) VALUES ({', '.join(':' + column for column in columns)})")
+    for batch in batches(records, BULK_RESTORE_BATCH_SIZE):
+        conn.execute(insert_staging, batch)
+    conn.execute(text(f"CREATE INDEX {quote(f'ix_staging_{table_name}_id')} ON {staging} (id)"))
+
+    assignments = ", ".join(f"{quote(column)} = (SELECT source.{quote(column)} FROM {staging} AS source WHERE source.id = {target}.id)" for column in columns[1:])
+    conn.execute(text(f"UPDATE {target} SET {assignments} WHERE id IN (SELECT id FROM {staging})"))
+    conn.execute(text(f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {staging} WHERE id NOT IN (SELECT id FROM {target})"))
+    conn.execute(text(f"DROP TABLE {staging}"))
+
+
+def batches(records, batch_size):
+    """
+    Groups the records in lists of batch_size, only one of them is in memory at a time.
+    """
+    records = iter(records)
+    while batch := list(islice(records, batch_size)):
+        yield batch
@@ -0,0 +1,184 @@
+import codecs
+import csv
+import json
+import os
+import time
+from typing import AsyncIterator, Callable, List, NamedTuple, Optional, Pattern, Tuple
+import pydantic
+from sqlalchemy import Table
+from models.request.departments_request_model import DepartmentRequestModel
+from models.request.hired_employees_request_model import HiredEmployeesRequestModel
+from models.request.jobs_request_model import JobRequestModel
+from models.response.ingest_response_model import IngestResponseModel
+from service.async_ingestion_service import department_row, hired_employee_row, job_row, validate_keys_async, write_rows_async
+from service.departments_service import Departments, add_department_to_log
+from service.engine_registry import get_async_engine
+from service.hired_employees_service import HiredEmployees, add_employee_to_log
+from service.jobs_service import Jobs, add_job_to_log
+from service.key_index import key_index
+from service.metrics import stage
+from service.validation import DEPARTMENT_RULES, HIRED_EMPLOYEE_RULES, JOB_RULES, to_columns, validate_batch
+
+
+# Rows validated and written together, the same limit as the add endpoints.
+STREAM_BATCH_SIZE = int(os.getenv("STREAM_BATCH_SIZE", "1000"))
+# Longest line accepted, so a body without line breaks can not fill the memory.
+MAX_LINE_LENGTH = 64 * 1024
+
+NDJSON_CONTENT_TYPES = ["application/x-ndjson", "application/jsonl"]
+CSV_CONTENT_TYPES = ["text/csv"]
+
+
+class StreamEntity(NamedTuple):
+    model: type
+    fields: List[str]
+    rules: List[Tuple[str, Optional[Pattern], str]]
+    table: Table
+    to_row: Callable
+    add_to_log: Callable
+    add_to_index: Callable
+    blob_prefix: str
+    check_keys: bool
+
+
+# The CSV columns are the fields in this order, like the files of the historical load.
+STREAM_ENTITIES = {
+    "employees": StreamEntity(HiredEmployeesRequestModel, ["id", "name", "dateTime", "departmentId", "jobId"], HIRED_EMPLOYEE_RULES,
+                              HiredEmployees.__table__, hired_employee_row, add_employee_to_log, key_index.add_employees, 'log_hired_employees_', True),
+    "jobs": StreamEntity(JobRequestModel, ["id", "job"], JOB_RULES,
+                         Jobs.__table__, job_row, add_job_to_log, key_index.add_jobs, 'jobs_', False),
+    "departments": StreamEntity(DepartmentRequestModel, ["id", "department"], DEPARTMENT_RULES,
+                                Departments.__table__, department_row, add_department_to_log, key_index.add_departments, 'departments_', False),
+}
+
+
+async def read_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """
+    Splits the chunks of the request body in lines as they arrive, only the last incomplete line is kept.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        if len(pending) > MAX_LINE_LENGTH:
+            raise ValueError(f"Una linea supera los {MAX_LINE_LENGTH} caracteres.")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+
+def to_model(entity: StreamEntity, values: dict) -> Tuple[object, str]:
+    """
+    Builds the request model of a row. The fields that do not parse are left empty and reported as the error
+    of the row, so it is logged with the rest of the rejected rows.
+    """
+    try:
+        return entity.model.model_validate(values), ""
+    except pydantic.ValidationError as e:
+        invalid_fields = [str(error["loc"][0]) for error in e.errors() if error["loc"]]
+        # An error of the whole model has no field, the row is rejected with an empty model.
+        if not invalid_fields:
+            return entity.model.model_construct(), "El registro no es valido"
+        values = {field: value for field, value in values.items() if field not in invalid_fields}
+        return entity.model.model_validate(values), f"El campo {invalid_fields[0]} no es valido"
+
+
+def parse_ndjson(entity: StreamEntity, line: str) -> Tuple[object, str]:
+    try:
+        values = json.loads(line)
+    except ValueError:
+        values = None
+    if not isinstance(values, dict):
+        return entity.model(), "El registro no es un objeto JSON valido"
+    # The ids are strings in the request models, the numbers are accepted too.
+    values = {field: str(value) if type(value) is int else value for field, value in values.items() if field in entity.fields}
+    return to_model(entity, values)
+
+
+def is_csv_header(line: str) -> bool:
+    return line.split(",")[0].strip().strip('"').lower() == "id"
+
+
+def parse_csv(entity: StreamEntity, line: str) -> Tuple[object, str]:
+    values = next(csv.reader([line]))
+    if len(values) != len(entity.fields):
+        return entity.model(), f"El registro debe tener {len(entity.fields)} columnas"
+    return to_model(entity, {field: value or None for field, value in zip(entity.fields, values)})
+
+
+async def write_batch(entity: StreamEntity, items: List, parse_errors: List[str]) -> Tuple[object, int]:
+    with stage("validation"):
+        columns = to_columns(items, entity.rules)
+        errors = validate_batch(columns, entity.rules)
+        if entity.check_keys and await key_index.ensure_loaded_async(get_async_engine()):
+            errors = await validate_keys_async(columns, errors)
+    errors = [parse_error or error for parse_error, error in zip(parse_errors, errors)]
+    return await write_rows_async(items, errors, entity.table, entity.to_row, entity.add_to_log, entity.add_to_index, entity.blob_prefix)
+
+
+async def ingest_stream(entity_name: str, content_type: str, chunks: AsyncIterator[bytes], batch_size: int = STREAM_BATCH_SIZE) -> IngestResponseModel:
+    """
+    Loads an NDJSON or CSV body of any size into the table of the entity.
+
+    The body is read as it arrives and split in batches of batch_size rows. Every batch is validated and
+    written, and its rejected rows logged, like the add endpoints, before the next chunks are read, so the
+    upload goes as fast as the database takes the rows and only one batch is kept in memory. A CSV header
+    row, with id as its first column, is skipped. Quoted CSV values can not contain line breaks.
+
+    Args:
+        entity_name (str): employees, jobs or departments.
+        content_type (str): The media type of the body, NDJSON or text/csv.
+        chunks (AsyncIterator[bytes]): The body of the request.
+        batch_size (int): The rows validated and written together.
+
+    Returns:
+        IngestResponseModel: The rows read, written and rejected.
+    """
+    response = IngestResponseModel(Error=False, ErrorMessage="Los registros se insertaron correctamente", rowsRead=0, rowsAccepted=0, rowsRejected=0, batches=0)
+    media_type = content_type.split(";")[0].strip().lower()
+    if media_type in NDJSON_CONTENT_TYPES:
+        parse = parse_ndjson
+    elif media_type in CSV_CONTENT_TYPES:
+        parse = parse_csv
+    else:
+        response.Error = True
+        response.ErrorMessage = "El tipo de contenido debe ser application/x-ndjson o text/csv"
+        return response
+
+    entity = STREAM_ENTITIES[entity_name]
+    started = time.perf_counter()
+    items, parse_errors = [], []
+
+    async def flush():
+        batch_response, accepted = await write_batch(entity, items, parse_errors)
+        response.batches += 1
+        response.rowsAccepted += accepted
+        response.rowsRejected += len(items) - accepted
+        if batch_response.Error:
+            response.Error = True
+            response.ErrorMessage = batch_response.ErrorMessage
+        items.clear()
+        parse_errors.clear()
+
+    try:
+        async for line in read_lines(chunks):
+            if not line.strip():
+                continue
+            if parse is parse_csv and response.rowsRead == 0 and is_csv_header(line):
+                continue
+            item, parse_error = parse(entity, line)
+            items.append(item)
+            parse_errors.append(parse_error)
+            response.rowsRead += 1
+            if len(items) == batch_size:
+                await flush()
+        if items:
+            await flush()
+    except Exception as e:
+        response.Error = True
+        response.ErrorMessage = f"La carga se detuvo despues de {response.rowsRead} registros: {e}"
+    response.seconds = round(time.perf_counter() - started, 3)
+    return response
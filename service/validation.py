@@ -0,0 +1,116 @@
+import re
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from typing import Dict, List, Optional, Pattern, Sequence, Tuple
+
+
+LETTERS_AND_NUMBERS = re.compile(r'^[a-zA-Z0-9 ]+$')
+NUMBERS = re.compile(r'^[0-9 ]+$')
+
+# Each rule is (field, pattern, error message). A rule without pattern checks that the field is present.
+# The rules are listed in the order they are checked, the first failing rule gives the message of the row.
+HIRED_EMPLOYEE_RULES: List[Tuple[str, Optional[Pattern], str]] = [
+    ("id", None, "El campo id es requerido"),
+    ("name", None, "El campo name es requerido"),
+    ("dateTime", None, "El campo dateTime es requerido"),
+    ("departmentId", None, "El campo departmentId es requerido"),
+    ("jobId", None, "El campo jobId es requerido"),
+    ("name", LETTERS_AND_NUMBERS, "El campo name solo puede contener letras y numeros"),
+    ("id", NUMBERS, "El campo id solo puede contener numeros"),
+    ("departmentId", NUMBERS, "El campo departmentId solo puede contener numeros"),
+    ("jobId", NUMBERS, "El campo jobId solo puede contener numeros"),
+]
+
+JOB_RULES: List[Tuple[str, Optional[Pattern], str]] = [
+    ("id", None, "El campo id es requerido"),
+    ("job", None, "El campo job es requerido"),
+    ("job", LETTERS_AND_NUMBERS, "El campo job solo puede contener letras y numeros"),
+    ("id", NUMBERS, "El campo id solo puede contener numeros"),
+]
+
+DEPARTMENT_RULES: List[Tuple[str, Optional[Pattern], str]] = [
+    ("id", None, "El campo id es requerido"),
+    ("department", None, "El campo department es requerido"),
+    ("department", LETTERS_AND_NUMBERS, "El campo department solo puede contener letras y numeros"),
+    ("id", NUMBERS, "El campo id solo puede contener numeros"),
+]
+
+
+def to_columns(models: Sequence, rules: List[Tuple[str, Optional[Pattern], str]]) -> Dict[str, list]:
+    """
+    Converts a list of request models to one list of values per field used by the rules.
+    """
+    fields = dict.fromkeys(field for field, pattern, message in rules)
+    return {field: [getattr(model, field) for model in models] for field in fields}
+
+
+def validate_batch(columns: Dict[str, Sequence], rules: List[Tuple[str, Optional[Pattern], str]]) -> List[str]:
+    """
+    Validates a whole batch in column form.
+
+    Every rule runs once over its whole column with precompiled patterns instead of checking the rows one by one.
+    The rules are applied from the last to the first, so the message kept for a row is the one of the first
+    rule it fails, the same message the per-row validation returns.
+
+    Args:
+        columns (Dict[str, Sequence]): The values of the batch, one sequence per field.
+        rules (List[Tuple[str, Optional[Pattern], str]]): The validation rules in the order they are checked.
+
+    Returns:
+        List[str]: The error message of every row, an empty string if the row is valid.
+    """
+    size = len(next(iter(columns.values()), []))
+    errors = [""] * size
+    for field, pattern, message in reversed(rules):
+        values = columns[field]
+        if pattern is None:
+            failed = [position for position, value in enumerate(values) if value is None] if None in values else []
+        else:
+            failed = _failed_positions(pattern, values)
+        for position in failed:
+            errors[position] = message
+    return errors
+
+
+@lru_cache(maxsize=None)
+def _column_patterns(pattern: Pattern) -> Tuple[Pattern, Pattern]:
+    # '^[0-9 ]+$' gives '(?:[0-9 ]+\x00)*[0-9 ]+' to match a whole column joined with NUL,
+    # and '[^0-9 \x00]' to find the characters that make a value invalid.
+    body = pattern.pattern[1:-1]
+    characters = body[1:-2]
+    return re.compile(f"(?:{body}\x00)*{body}"), re.compile(f"[^{characters}\x00]")
+
+
+def _failed_positions(pattern: Pattern, values: Sequence) -> List[int]:
+    """
+    Finds the values of a column that do not match an anchored character class pattern like '^[0-9 ]+$'.
+
+    The column is joined with NUL and checked with a single regex call. When it does not match, the invalid
+    characters are located in the joined string and only the values that contain them, or are empty, are
+    checked again one by one with the original pattern. None values are skipped.
+    """
+    if None in values:
+        positions = [position for position, value in enumerate(values) if value is not None]
+        values = [values[position] for position in positions]
+    else:
+        positions = range(len(values))
+    if not values:
+        return []
+
+    column_pattern, invalid_character = _column_patterns(pattern)
+    joined = "\x00".join(values)
+    if joined.count("\x00") != len(values) - 1:
+        # Some value contains NUL itself, the offsets can not be mapped back to the values.
+        candidates = range(len(values))
+    elif column_pattern.fullmatch(joined) is not None:
+        return []
+    else:
+        ends = list(accumulate(map((1).__add__, map(len, values))))
+        candidates = {bisect_right(ends, found.start()) for found in invalid_character.finditer(joined)}
+        if "" in values:
+            candidates.update(position for position, value in enumerate(values) if not value)
+        candidates = sorted(candidates)
+
+    match = pattern.match
+    return [positions[position] for position in candidates if match(values[position]) is None]
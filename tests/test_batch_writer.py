@@ -0,0 +1,31 @@
+from sqlalchemy import Column, Integer, MetaData, String, Table, create_engine, select
+from sqlalchemy.orm import Session
+from service.batch_writer import insert_batch
+
+metadata = MetaData()
+jobs = Table("jobs", metadata, Column("id", Integer, primary_key=True), Column("job", String(100)))
+
+
+def insert(rows, existing=()):
+    engine = create_engine("sqlite://")
+    metadata.create_all(engine)
+    with Session(engine) as session:
+        if existing:
+            session.execute(jobs.insert(), list(existing))
+        rejected = insert_batch(session, jobs, rows, batch_size=2)
+        session.commit()
+        ids = session.execute(select(jobs.c.id).order_by(jobs.c.id)).scalars().all()
+    return rejected, ids
+
+
+def test_duplicate_key_only_rejects_its_row():
+    rejected, ids = insert([{"id": 1, "job": "a"}, {"id": 2, "job": "b"}, {"id": 3, "job": "c"}], existing=[{"id": 2, "job": "x"}])
+    assert [position for position, error_message in rejected] == [1]
+    assert "UNIQUE" in rejected[0][1]
+    assert ids == [1, 2, 3]
+
+
+def test_value_out_of_range_only_rejects_its_row():
+    rejected, ids = insert([{"id": 1, "job": "a"}, {"id": 2 ** 70, "job": "b"}, {"id": 3, "job": "c"}])
+    assert [position for position, error_message in rejected] == [1]
+    assert ids == [1, 3]
@@ -0,0 +1,54 @@
+import orjson
+import pydantic
+import pytest
+from models.request.hired_employees_request_model import HiredEmployeesRequestModel
+from service.columnar_ingestion_service import decode_body
+
+VALID_EMPLOYEE = {"id": "1", "name": "Ana", "dateTime": "2021-11-07T02:48:42Z", "departmentId": "1", "jobId": "2"}
+
+
+def decode_employee(**fields):
+    body = orjson.dumps({"hiredEmployees": [dict(VALID_EMPLOYEE, **fields)]})
+    columns, errors = decode_body("employees", body)
+    return {field: values[0] for field, values in columns.items()}, errors[0]
+
+
+@pytest.mark.parametrize("fields", [
+    {"id": 5},
+    {"id": 5.0},
+    {"id": True},
+    {"id": None},
+    {"name": ["Ana"]},
+    {"jobId": {"id": "2"}},
+    {"dateTime": "2021-11-07"},
+    {"dateTime": "2021-11-07 02:48:42"},
+    {"dateTime": "07/11/2021"},
+    {"dateTime": 1636253322},
+    {"dateTime": "1636253322"},
+    {"dateTime": None},
+])
+def test_values_are_coerced_like_the_request_model(fields):
+    record = dict(VALID_EMPLOYEE, **fields)
+    decoded, error_message = decode_employee(**fields)
+    try:
+        model = HiredEmployeesRequestModel.model_validate(record)
+    except pydantic.ValidationError as e:
+        field = e.errors()[0]["loc"][0]
+        assert error_message == f"El campo {field} no es valido"
+        assert decoded[field] is None
+    else:
+        assert error_message == ""
+        assert decoded == model.model_dump()
+
+
+def test_missing_fields_are_empty():
+    body = orjson.dumps({"hiredEmployees": [{"id": "1"}]})
+    columns, errors = decode_body("employees", body)
+    assert errors == [""]
+    assert columns["name"] == [None] and columns["dateTime"] == [None]
+
+
+def test_integer_id_is_rejected_like_in_v1():
+    decoded, error_message = decode_employee(id=5)
+    assert error_message == "El campo id no es valido"
+    assert decoded["id"] is None
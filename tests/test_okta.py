@@ -0,0 +1,115 @@
+import asyncio
+import threading
+import time
+import httpx
+import pytest
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi import HTTPException
+from jose import jwk, jwt
+from security.okta import OKTA_AUDIENCE, OktaJWTValidator
+
+ISSUER = "https://issuer.example.com/oauth2/default"
+
+
+def private_key():
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()).decode()
+
+
+class StubIssuer:
+    """
+    Serves the discovery document and the JWKS of the signing keys, and counts the requests.
+    """
+    def __init__(self, kids, delay=0.0):
+        self.keys = {kid: private_key() for kid in kids}
+        self.delay = delay
+        self.jwks_body = None
+        self.calls = {"discovery": 0, "jwks": 0}
+        self.lock = threading.Lock()
+        self.requested = threading.Event()
+
+    def handle(self, request):
+        self.requested.set()
+        time.sleep(self.delay)
+        with self.lock:
+            if request.url.path.endswith("/.well-known/openid-configuration"):
+                self.calls["discovery"] += 1
+                return httpx.Response(200, json={"jwks_uri": f"{ISSUER}/v1/keys"})
+            self.calls["jwks"] += 1
+            if self.jwks_body is not None:
+                return httpx.Response(200, content=self.jwks_body)
+            return httpx.Response(200, json={"keys": [dict(jwk.construct(pem, "RS256").public_key().to_dict(), kid=kid, use="sig") for kid, pem in self.keys.items()]})
+
+    def token(self, kid):
+        claims = {"iss": ISSUER, "aud": OKTA_AUDIENCE, "sub": kid, "exp": int(time.time()) + 300}
+        return jwt.encode(claims, self.keys[kid], algorithm="RS256", headers={"kid": kid})
+
+    def validator(self, **options):
+        validator = OktaJWTValidator(ISSUER, **options)
+        validator.client = httpx.Client(transport=httpx.MockTransport(self.handle))
+        return validator
+
+
+def test_keys_are_cached_and_a_rotated_kid_refreshes_them_once():
+    issuer = StubIssuer(["one"])
+    validator = issuer.validator(min_refresh_seconds=0, token_cache_size=0)
+    token = issuer.token("one")
+
+    threads = [threading.Thread(target=validator.validate_token, args=(token,)) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert issuer.calls == {"discovery": 1, "jwks": 1}
+
+    for _ in range(100):
+        assert validator.validate_token(token)["sub"] == "one"
+    assert issuer.calls == {"discovery": 1, "jwks": 1}
+
+    issuer.keys["two"] = private_key()
+    assert validator.validate_token(issuer.token("two"))["sub"] == "two"
+    assert validator.validate_token(issuer.token("two"))["sub"] == "two"
+    assert issuer.calls == {"discovery": 1, "jwks": 2}
+
+
+def test_sync_and_async_validations_share_one_refresh():
+    issuer = StubIssuer(["one"], delay=0.2)
+    validator = issuer.validator(token_cache_size=0)
+    token = issuer.token("one")
+
+    async def validate_async():
+        return await asyncio.gather(*(validator.validate_token_async(token) for _ in range(5)))
+
+    # The sync validations start while the async one is downloading the keys.
+    async_thread = threading.Thread(target=asyncio.run, args=(validate_async(),))
+    async_thread.start()
+    assert issuer.requested.wait(5)
+    threads = [threading.Thread(target=validator.validate_token, args=(token,)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads + [async_thread]:
+        thread.join()
+    assert issuer.calls == {"discovery": 1, "jwks": 1}
+
+
+@pytest.mark.parametrize("body", [b"<html>", b'{"items": []}', b'{"keys": [{"kty": "RSA", "kid": "one"}]}'])
+def test_unreadable_keys_are_a_503(body):
+    issuer = StubIssuer(["one"])
+    issuer.jwks_body = body
+    validator = issuer.validator()
+    with pytest.raises(HTTPException) as error:
+        validator.validate_token(issuer.token("one"))
+    assert error.value.status_code == 503
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(validator.validate_token_async(issuer.token("one")))
+    assert error.value.status_code == 503
+
+
+def test_cached_keys_are_used_while_the_issuer_fails():
+    issuer = StubIssuer(["one"])
+    validator = issuer.validator(keys_ttl_seconds=0, token_cache_size=0)
+    token = issuer.token("one")
+    assert validator.validate_token(token)["sub"] == "one"
+    issuer.jwks_body = b"<html>"
+    assert validator.validate_token(token)["sub"] == "one"
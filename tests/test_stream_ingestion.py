@@ -0,0 +1,26 @@
+import pydantic
+from service.stream_ingestion_service import STREAM_ENTITIES, to_model
+
+
+class WholeRowModel(pydantic.BaseModel):
+    id: str = None
+    job: str = None
+
+    @pydantic.model_validator(mode="after")
+    def check_row(self):
+        if self.id == self.job:
+            raise ValueError("id and job are the same")
+        return self
+
+
+def test_invalid_field_is_reported_and_left_empty():
+    model, error_message = to_model(STREAM_ENTITIES["jobs"], {"id": "1", "job": ["not", "a", "string"]})
+    assert error_message == "El campo job no es valido"
+    assert model.id == "1" and model.job is None
+
+
+def test_error_without_a_field_rejects_the_row():
+    entity = STREAM_ENTITIES["jobs"]._replace(model=WholeRowModel)
+    model, error_message = to_model(entity, {"id": "1", "job": "1"})
+    assert error_message == "El registro no es valido"
+    assert model.id is None and model.job is None